@@ -0,0 +1,148 @@
+'''
+Benchmark of the texture atlas packers with synthetic sprite sets. Runs with any python interpreter, blender is not needed.
+
+    python atlas_benchmark.py
+    python atlas_benchmark.py --algorithm MAXRECTS --repeat 5 --json results.json
+
+For every sprite set and packer it reports the wall time, the restarted packing passes, the final atlas size, the
+used output scale and the occupancy. Results written with --json can be compared against a later run with --compare.
+'''
+
+import os
+import sys
+import json
+import time
+import random
+import argparse
+from collections import OrderedDict
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "coa_tools", "operators", "exporter"))
+import atlas_packer
+
+
+def uniform_set(rng):
+    return [(rng.randint(16, 128), rng.randint(16, 128)) for i in range(200)]
+
+
+def power_law_set(rng):
+    ### few large and many small sprites, like the parts of a character
+    sizes = []
+    for i in range(300):
+        size = min(int(8 * rng.paretovariate(1.2)), 1024)
+        aspect = rng.uniform(0.25, 4.0)
+        sizes.append((max(1, int(size * aspect ** 0.5)), max(1, int(size / aspect ** 0.5))))
+    return sizes
+
+
+def tiny_set(rng):
+    return [(rng.randint(2, 12), rng.randint(2, 12)) for i in range(2000)]
+
+
+def huge_set(rng):
+    return [(rng.randint(600, 1500), rng.randint(600, 1500)) for i in range(6)]
+
+
+def long_thin_set(rng):
+    ### limb like sprites that are much longer than wide
+    sizes = []
+    for i in range(120):
+        length = rng.randint(128, 512)
+        thickness = rng.randint(12, 48)
+        sizes.append((length, thickness) if rng.random() < 0.5 else (thickness, length))
+    return sizes
+
+
+SPRITE_SETS = [("uniform", uniform_set),
+               ("power_law", power_law_set),
+               ("tiny", tiny_set),
+               ("huge", huge_set),
+               ("long_thin", long_thin_set)]
+
+
+def sort_sizes(sizes):
+    ### same order as TextureAtlasGenerator.get_sorted_texture_data
+    return sorted(sizes, key=lambda size: size[0] * size[1] + size[0] + size[1], reverse=True)
+
+
+def get_scaled_sizes(sizes, scale):
+    return [(int(width * scale), int(height * scale)) for width, height in sizes]
+
+
+def run_benchmark(sizes, algorithm, args):
+    sizes = sort_sizes(sizes)
+    start = time.perf_counter()
+    results, scale, restarts = atlas_packer.search_pack_scale(lambda scale: get_scaled_sizes(sizes, scale), 1.0, 16, 16,
+                                                              args.max_size, args.max_size, args.margin, args.square,
+                                                              algorithm, args.scale_precision, args.multi_page,
+                                                              args.allow_rotation)
+    wall_time = time.perf_counter() - start
+    used_area = sum(result.used_area for result in results)
+    atlas_area = sum(result.width * result.height for result in results)
+    return {"time": wall_time,
+            "restarts": restarts,
+            "pages": len(results),
+            "size": [results[0].width, results[0].height],
+            "scale": scale,
+            "occupancy": used_area / float(atlas_area)}
+
+
+def run_benchmarks(args):
+    algorithms = args.algorithm or sorted(atlas_packer.PACKERS.keys())
+    results = OrderedDict()
+    for set_name, create_set in SPRITE_SETS:
+        if args.set and set_name not in args.set:
+            continue
+        sizes = create_set(random.Random(args.seed))
+        for algorithm in algorithms:
+            runs = [run_benchmark(sizes, algorithm, args) for i in range(args.repeat)]
+            result = runs[0]
+            result["time"] = min(run["time"] for run in runs)
+            result["count"] = len(sizes)
+            results[set_name + "/" + algorithm] = result
+    return results
+
+
+def print_results(results, compare=None):
+    print("%-22s %6s %10s %8s %5s %11s %7s %9s" % ("set/packer", "count", "time ms", "restarts", "pages", "size", "scale", "occupancy"))
+    for name, result in results.items():
+        line = "%-22s %6d %10.2f %8d %5d %11s %7.3f %8.1f%%" % (name, result["count"], result["time"] * 1000,
+                                                                result["restarts"], result["pages"],
+                                                                "%dx%d" % tuple(result["size"]), result["scale"],
+                                                                result["occupancy"] * 100)
+        if compare != None and name in compare:
+            before = compare[name]
+            line += "   time %+.0f%%, occupancy %+.1f%%" % ((result["time"] / before["time"] - 1) * 100,
+                                                         (result["occupancy"] - before["occupancy"]) * 100)
+        print(line)
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Benchmark the texture atlas packers with synthetic sprite sets.")
+    parser.add_argument("--algorithm", action="append", choices=sorted(atlas_packer.PACKERS.keys()), help="Packer to run. Can be given multiple times. Defaults to all packers.")
+    parser.add_argument("--set", action="append", choices=[name for name, create_set in SPRITE_SETS], help="Sprite set to run. Can be given multiple times. Defaults to all sets.")
+    parser.add_argument("--max-size", type=int, default=2048, help="Max atlas width and height.")
+    parser.add_argument("--margin", type=int, default=1)
+    parser.add_argument("--square", action="store_true", help="Force square atlases.")
+    parser.add_argument("--multi-page", action="store_true", help="Overflow into additional pages instead of scaling down.")
+    parser.add_argument("--allow-rotation", action="store_true", help="Let the packers rotate rects by 90 degrees.")
+    parser.add_argument("--scale-precision", type=float, default=0.01)
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per benchmark. The fastest run is reported.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", default=None, help="Write the results to a json file.")
+    parser.add_argument("--compare", default=None, help="Json file of an earlier run to compare the results with.")
+    args = parser.parse_args(argv)
+
+    results = run_benchmarks(args)
+    compare = None
+    if args.compare != None:
+        with open(args.compare) as compare_file:
+            compare = json.load(compare_file)
+    print_results(results, compare)
+    if args.json != None:
+        with open(args.json, "w") as json_file:
+            json.dump(results, json_file, indent="\t")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,248 @@
+'''
+Headless batch export of COA Tools projects.
+
+Export a single file inside blender:
+    blender -b character.blend --python-exit-code 1 --python batch_export.py -- --format DRAGONBONES --export-path ./export
+
+Export many files with a pool of blender processes:
+    python batch_export.py --blender /path/to/blender --jobs 4 --format DRAGONBONES --export-path ./export *.blend
+
+All arguments except --blender, --jobs and the file list are forwarded to every blender process.
+'''
+
+import os
+import sys
+import argparse
+import subprocess
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+try:
+    import bpy
+except ImportError:
+    bpy = None
+
+ADDON_NAME = os.path.basename(os.path.dirname(os.path.abspath(__file__)))
+EXPORT_FORMATS = ["DRAGONBONES", "CREATURE", "JSON"]
+
+
+def add_export_arguments(parser):
+    parser.add_argument("--format", choices=EXPORT_FORMATS, default="DRAGONBONES", help="Runtime format to export.")
+    parser.add_argument("--export-path", default=None, help="Export directory. Defaults to the export path stored in the file.")
+    parser.add_argument("--project-name", default=None, help="Project name. Defaults to the project name stored in the file.")
+    parser.add_argument("--sprite-object", action="append", default=[], help="Name of a sprite object to export. Can be given multiple times. Defaults to all sprite objects.")
+    parser.add_argument("--image-mode", choices=["ATLAS", "IMAGES"], default=None)
+    parser.add_argument("--atlas-mode", choices=["AUTO_SIZE", "LIMIT_SIZE"], default=None)
+    parser.add_argument("--atlas-resolution", type=int, nargs=2, metavar=("X", "Y"), default=None)
+    parser.add_argument("--sprite-scale", type=float, default=None)
+    parser.add_argument("--armature-scale", type=float, default=None)
+    parser.add_argument("--atlas-packing", choices=["MAXRECTS", "SKYLINE"], default=None, help="Texture atlas packing algorithm.")
+    parser.add_argument("--allow-rotation", dest="allow_rotation", action="store_true", default=None, help="Let the atlas packer rotate sprites by 90 degrees.")
+    parser.add_argument("--no-allow-rotation", dest="allow_rotation", action="store_false")
+    parser.add_argument("--multi-page", dest="multi_page", action="store_true", default=None, help="Put sprites that do not fit into the max atlas size on additional DragonBones atlas pages.")
+    parser.add_argument("--no-multi-page", dest="multi_page", action="store_false")
+    parser.add_argument("--resolution-planning", dest="resolution_planning", action="store_true", default=None, help="Export every sprite only at the largest resolution the scene camera shows it at.")
+    parser.add_argument("--no-resolution-planning", dest="resolution_planning", action="store_false")
+    parser.add_argument("--quality-margin", type=float, default=None, help="Resolution added on top of the planned sprite size, e.g. 0.1 for 10%%.")
+    parser.add_argument("--scale-precision", type=float, default=None, help="Precision of the sprite scale search when the atlas is too small.")
+    parser.add_argument("--margin", type=int, default=None, help="Texture island margin in pixels.")
+    parser.add_argument("--texture-bleed", type=int, default=None)
+    parser.add_argument("--atlas-variants", default=None, help="Comma separated list of additional atlas scales, e.g. \"0.5,0.25\".")
+    parser.add_argument("--png-compression", type=int, default=None, help="Png compression from 0 to 100. Lower values write faster.")
+    parser.add_argument("--square-atlas", dest="square_atlas", action="store_true", default=None)
+    parser.add_argument("--no-square-atlas", dest="square_atlas", action="store_false")
+    parser.add_argument("--bake-anim", dest="bake_anim", action="store_true", default=None)
+    parser.add_argument("--no-bake-anim", dest="bake_anim", action="store_false")
+    parser.add_argument("--bake-steps", type=int, default=None)
+    parser.add_argument("--reduce-keys", dest="reduce_keys", action="store_true", default=None, help="Remove sampled keyframes the interpolation reconstructs within tolerance.")
+    parser.add_argument("--no-reduce-keys", dest="reduce_keys", action="store_false")
+    parser.add_argument("--pos-tolerance", type=float, default=None, help="Keyframe reduction tolerance in pixels.")
+    parser.add_argument("--rot-tolerance", type=float, default=None, help="Keyframe reduction tolerance in degrees.")
+    parser.add_argument("--scale-tolerance", type=float, default=None, help="Keyframe reduction tolerance for scale keys.")
+    parser.add_argument("--use-cache", dest="use_cache", action="store_true", default=None, help="Reuse unchanged DragonBones skin data of the last export.")
+    parser.add_argument("--no-use-cache", dest="use_cache", action="store_false")
+    parser.add_argument("--delta-frames", dest="delta_frames", action="store_true", default=None, help="Drop Creature slot data inside runs of frames where it does not change.")
+    parser.add_argument("--no-delta-frames", dest="delta_frames", action="store_false")
+    parser.add_argument("--zip-compression", type=int, default=None, help="Deflate level 0-9 of the Creature data zip.")
+    parser.add_argument("--json-file", dest="json_file", action="store_true", default=None, help="Write the Creature data as loose json file next to the zip.")
+    parser.add_argument("--no-json-file", dest="json_file", action="store_false")
+    parser.add_argument("--data-format", choices=["JSON", "BINARY"], default=None, help="DragonBones skeleton file format.")
+    parser.add_argument("--minify", dest="minify", action="store_true", default=None)
+    parser.add_argument("--no-minify", dest="minify", action="store_false")
+
+
+### maps parsed arguments to the scene settings the exporters read
+SCENE_SETTINGS = [("project_name", "coa_project_name"),
+                  ("image_mode", "coa_export_image_mode"),
+                  ("atlas_mode", "coa_atlas_mode"),
+                  ("sprite_scale", "coa_sprite_scale"),
+                  ("armature_scale", "coa_armature_scale"),
+                  ("atlas_packing", "coa_atlas_packing"),
+                  ("allow_rotation", "coa_atlas_allow_rotation"),
+                  ("multi_page", "coa_atlas_multi_page"),
+                  ("resolution_planning", "coa_atlas_resolution_planning"),
+                  ("quality_margin", "coa_atlas_quality_margin"),
+                  ("scale_precision", "coa_atlas_scale_precision"),
+                  ("margin", "coa_atlas_island_margin"),
+                  ("texture_bleed", "coa_export_texture_bleed"),
+                  ("atlas_variants", "coa_atlas_variant_scales"),
+                  ("png_compression", "coa_export_png_compression"),
+                  ("square_atlas", "coa_export_square_atlas"),
+                  ("bake_anim", "coa_export_bake_anim"),
+                  ("bake_steps", "coa_export_bake_steps"),
+                  ("reduce_keys", "coa_export_reduce_keys"),
+                  ("pos_tolerance", "coa_export_reduce_tolerance_pos"),
+                  ("rot_tolerance", "coa_export_reduce_tolerance_rot"),
+                  ("scale_tolerance", "coa_export_reduce_tolerance_scale"),
+                  ("delta_frames", "coa_export_delta_frames"),
+                  ("zip_compression", "coa_export_zip_compression"),
+                  ("json_file", "coa_export_json_file"),
+                  ("data_format", "coa_export_data_format"),
+                  ("use_cache", "coa_export_use_cache"),
+                  ("minify", "coa_minify_json")]
+
+
+########################################################################################################################
+### blender side. runs inside "blender -b file.blend --python batch_export.py -- ..."
+
+def enable_addon():
+    import addon_utils
+    loaded_default, loaded_state = addon_utils.check(ADDON_NAME)
+    if not loaded_state:
+        addon_utils.enable(ADDON_NAME, default_set=False)
+
+
+def apply_scene_settings(scene, args):
+    for arg_name, prop_name in SCENE_SETTINGS:
+        value = getattr(args, arg_name)
+        if value != None:
+            setattr(scene, prop_name, value)
+    if args.export_path != None:
+        scene.coa_export_path = os.path.abspath(args.export_path)
+    if args.atlas_resolution != None:
+        scene.coa_atlas_resolution_x = args.atlas_resolution[0]
+        scene.coa_atlas_resolution_y = args.atlas_resolution[1]
+
+
+def get_sprite_objects(scene, names):
+    if len(names) > 0:
+        return [scene.objects[name] for name in names]
+    return [obj for obj in scene.objects if "sprite_object" in obj]
+
+
+def export_sprite_object(context, sprite_object, args):
+    scene = context.scene
+    for obj in scene.objects:
+        obj.select = False
+    sprite_object.select = True
+    scene.objects.active = sprite_object
+
+    override = context.copy()
+    override["scene"] = scene
+    override["active_object"] = sprite_object
+    override["object"] = sprite_object
+
+    export_path = bpy.path.abspath(scene.coa_export_path)
+    if not os.path.exists(export_path):
+        os.makedirs(export_path)
+
+    if args.format == "DRAGONBONES":
+        return bpy.ops.coa_tools.export_dragon_bones(override)
+    elif args.format == "CREATURE":
+        return bpy.ops.coa_tools.export_creature(override, export_path=export_path, project_name=str(scene.coa_project_name).lower())
+    elif args.format == "JSON":
+        json_path = os.path.join(export_path, scene.coa_project_name + ".json")
+        return bpy.ops.object.export_to_json(override, filepath=json_path)
+
+
+def run_export(argv):
+    parser = argparse.ArgumentParser(prog="blender -b file.blend --python batch_export.py --")
+    add_export_arguments(parser)
+    args = parser.parse_args(argv)
+
+    enable_addon()
+    context = bpy.context
+    apply_scene_settings(context.scene, args)
+
+    sprite_objects = get_sprite_objects(context.scene, args.sprite_object)
+    if len(sprite_objects) == 0:
+        print("COA Batch Export: No sprite object found in", bpy.data.filepath)
+        return 1
+
+    project_name = context.scene.coa_project_name
+    failed = False
+    for sprite_object in sprite_objects:
+        ### export each sprite object into its own project if there are several
+        if len(sprite_objects) > 1:
+            context.scene.coa_project_name = project_name + "_" + sprite_object.name
+        result = export_sprite_object(context, sprite_object, args)
+        if "FINISHED" not in result:
+            print("COA Batch Export: Exporting", sprite_object.name, "failed.")
+            failed = True
+        else:
+            print("COA Batch Export: Exported", sprite_object.name, "as", context.scene.coa_project_name)
+    context.scene.coa_project_name = project_name
+    return 1 if failed else 0
+
+
+########################################################################################################################
+### driver side. runs with any python interpreter and spawns one blender process per file
+
+def export_file(blender, blend_file, export_argv):
+    cmd = [blender, "-b", blend_file, "--python-exit-code", "1", "--python", os.path.abspath(__file__), "--"] + export_argv
+    process = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True)
+    return process.returncode, process.stdout
+
+
+def get_export_argv(args):
+    ### turns parsed export arguments back into a command line for the blender processes
+    argv = ["--format", args.format]
+    for name in ["export_path", "project_name", "image_mode", "atlas_mode", "sprite_scale", "armature_scale", "atlas_packing", "quality_margin", "scale_precision", "margin", "texture_bleed", "atlas_variants", "png_compression", "bake_steps", "pos_tolerance", "rot_tolerance", "scale_tolerance", "zip_compression", "data_format"]:
+        value = getattr(args, name)
+        if value != None:
+            if name == "export_path":
+                value = os.path.abspath(value)
+            argv += ["--" + name.replace("_", "-"), str(value)]
+    for name in args.sprite_object:
+        argv += ["--sprite-object", name]
+    if args.atlas_resolution != None:
+        argv += ["--atlas-resolution", str(args.atlas_resolution[0]), str(args.atlas_resolution[1])]
+    for name in ["square_atlas", "allow_rotation", "multi_page", "resolution_planning", "bake_anim", "reduce_keys", "delta_frames", "json_file", "use_cache", "minify"]:
+        value = getattr(args, name)
+        if value != None:
+            argv.append(("--" if value else "--no-") + name.replace("_", "-"))
+    return argv
+
+
+def run_driver(argv):
+    parser = argparse.ArgumentParser(description="Export COA Tools projects of many .blend files in parallel.")
+    parser.add_argument("--blender", default="blender", help="Path to the blender executable.")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count() or 1, help="Number of blender processes running at the same time.")
+    parser.add_argument("files", nargs="+", help=".blend files to export.")
+    add_export_arguments(parser)
+    args = parser.parse_args(argv)
+    export_argv = get_export_argv(args)
+
+    failed = []
+    ### every job blocks on its own blender process, so threads are enough to keep the process pool busy
+    with ThreadPoolExecutor(max_workers=max(1, args.jobs)) as executor:
+        jobs = {executor.submit(export_file, args.blender, os.path.abspath(blend_file), export_argv): blend_file for blend_file in args.files}
+        for job in as_completed(jobs):
+            blend_file = jobs[job]
+            returncode, output = job.result()
+            if returncode != 0:
+                failed.append(blend_file)
+                print("FAILED", blend_file)
+                print(output)
+            else:
+                print("OK", blend_file)
+
+    print(len(args.files) - len(failed), "of", len(args.files), "files exported.")
+    return 1 if len(failed) > 0 else 0
+
+
+if __name__ == "__main__":
+    if bpy != None:
+        argv = sys.argv[sys.argv.index("--")+1:] if "--" in sys.argv else []
+        sys.exit(run_export(argv))
+    else:
+        sys.exit(run_driver(sys.argv[1:]))
@@ -33,6 +33,7 @@ import json
 from bpy.app.handlers import persistent
 from .. functions import *
 from .. ui import preview_collections
+from . exporter.image_writer import ImageWriter
 import bpy.utils.previews
 
     
@@ -153,27 +154,27 @@ class CreateSpritesheetPreview(bpy.types.Operator):
                 render_margin = bpy.context.scene.render.bake_margin
                 bpy.context.scene.render.bake_margin = 0
                 init_sprite_frame = obj.coa_sprite_frame
-                for i in range(obj.coa_tiles_x * obj.coa_tiles_y):
-                    obj.coa_sprite_frame = i
-                    obj.data.uv_textures.active = obj.data.uv_textures[1]
+                ### thumbnails are encoded in the background while the next frame is baked
+                with ImageWriter(compression=bpy.context.scene.render.image_settings.compression) as image_writer:
+                    for i in range(obj.coa_tiles_x * obj.coa_tiles_y):
+                        obj.coa_sprite_frame = i
+                        obj.data.uv_textures.active = obj.data.uv_textures[1]
                     
-                    img_name = "thumb_"+obj.name+"_"+str(i).zfill(3)
+                        img_name = "thumb_"+obj.name+"_"+str(i).zfill(3)
                     
-                    if img_name not in bpy.data.images:
-                        img = bpy.data.images.new(img_name,preview_dimension[0],preview_dimension[1],True)
-                    else:
-                        img = bpy.data.images[img_name]
-                    assign_tex_to_uv(img,obj.data.uv_textures[1])
+                        if img_name not in bpy.data.images:
+                            img = bpy.data.images.new(img_name,preview_dimension[0],preview_dimension[1],True)
+                        else:
+                            img = bpy.data.images[img_name]
+                        assign_tex_to_uv(img,obj.data.uv_textures[1])
                     
-                    bpy.context.scene.render.bake_type = "TEXTURE"
-                    bpy.ops.object.bake_image()
-                    obj.data.uv_textures.active = obj.data.uv_textures[0]
+                        bpy.context.scene.render.bake_type = "TEXTURE"
+                        bpy.ops.object.bake_image()
+                        obj.data.uv_textures.active = obj.data.uv_textures[0]
 
-                    img.save_render(os.path.join(thumb_dir_path, img.name+".png"))
-                    img.user_clear()
-                    bpy.data.images.remove(img)
-                    
-                    
+                        image_writer.add_image(os.path.join(thumb_dir_path, img.name+".png"), img)
+                        img.user_clear()
+                        bpy.data.images.remove(img)
                 
                 ### set back everything
                 bpy.context.scene.render.bake_margin = render_margin
@@ -24,6 +24,7 @@ import json
 import os
 import shutil
 from .. functions import *
+from . exporter.export_helper import reduce_keyframes
 from bpy.props import FloatProperty, IntProperty, BoolProperty, StringProperty, CollectionProperty, FloatVectorProperty, EnumProperty, IntVectorProperty
 from collections import OrderedDict
 import math
@@ -433,6 +434,16 @@ class ExportToJson(bpy.types.Operator, bpy_extras.io_utils.ExportHelper):
         else:
             return False
     
+    ### removes keys of a channel that linear interpolation of the remaining keys reconstructs within tolerance
+    def reduce_channel_keys(self,keys,tolerance):
+        times = sorted(keys, key=float)
+        values = [keys[time_idx]["value"] for time_idx in times]
+        key_indices = reduce_keyframes([float(time_idx) for time_idx in times],values,tolerance)
+        reduced_keys = OrderedDict()
+        for i in key_indices:
+            reduced_keys[times[i]] = keys[times[i]]
+        return reduced_keys
+    
     def get_action_data(self,start,end,restpose=False):
         scene = bpy.context.scene
         self.restpose = restpose
@@ -534,6 +545,14 @@ class ExportToJson(bpy.types.Operator, bpy_extras.io_utils.ExportHelper):
         export_channels = OrderedDict()
         for key in channels:
             export_channels[key] = channels[key][0]
+            
+        ### reduce sampled keys of transformation channels
+        if scene.coa_export_reduce_keys:
+            tolerances = {"pos":scene.coa_export_reduce_tolerance_pos, "rot":math.radians(scene.coa_export_reduce_tolerance_rot), "scale":scene.coa_export_reduce_tolerance_scale}
+            for key in export_channels:
+                track = os.path.basename(key.split(":")[1])
+                if track in tolerances:
+                    export_channels[key] = self.reduce_channel_keys(export_channels[key],tolerances[track])
         
         return export_channels
                     
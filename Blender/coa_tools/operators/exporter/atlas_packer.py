@@ -0,0 +1,303 @@
+'''
+Rectangle packers used to generate texture atlases. This module does not depend on bpy, so it can also be used outside of blender.
+
+All packers place rectangles with their bottom left corner at the returned position. Bins can grow in place,
+already placed rectangles keep their position. With allow_rotation a rectangle can also be placed rotated by 90 degrees,
+it then covers height x width.
+'''
+
+PACKING_ALGORITHMS = (("MAXRECTS", "MaxRects", "Places each texture into the free rectangle it fits best. Packs tightest."),
+                      ("SKYLINE", "Skyline", "Places each texture on the lowest position of the skyline. Faster, packs a bit looser."))
+
+
+class MaxRectsPacker:
+    ### keeps a list of all maximal free rectangles and places each rect by the best short side fit heuristic
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+        self.free_rects = [(0, 0, width, height)]
+
+    def find_position(self, width, height, allow_rotation=False):
+        best = None
+        best_score = None
+        orientations = [(width, height, False)]
+        if allow_rotation and width != height:
+            orientations.append((height, width, True))
+        for x, y, free_width, free_height in self.free_rects:
+            for rect_width, rect_height, rotated in orientations:
+                if rect_width <= free_width and rect_height <= free_height:
+                    leftover_x = free_width - rect_width
+                    leftover_y = free_height - rect_height
+                    score = (min(leftover_x, leftover_y), max(leftover_x, leftover_y), y, x)
+                    if best_score == None or score < best_score:
+                        best = (x, y, rotated)
+                        best_score = score
+        return best
+
+    def insert(self, width, height, allow_rotation=False):
+        ### returns (x, y, rotated) or None if the rect does not fit
+        position = self.find_position(width, height, allow_rotation)
+        if position != None:
+            if position[2]:
+                width, height = height, width
+            self.place((position[0], position[1], width, height))
+        return position
+
+    def place(self, rect):
+        kept_rects = []
+        split_rects = []
+        for free_rect in self.free_rects:
+            if rects_overlap(free_rect, rect):
+                split_rects += split_free_rect(free_rect, rect)
+            else:
+                kept_rects.append(free_rect)
+        ### kept rects can not be contained in a split rect, because split rects lie within a former free rect.
+        ### So only the split rects have to be pruned
+        split_rects = prune_free_rects(split_rects)
+        self.free_rects = kept_rects + [split_rect for split_rect in split_rects
+                                        if not any(rect_contains(kept_rect, split_rect) for kept_rect in kept_rects)]
+
+    def grow(self, width, height):
+        ### free rects touching the old border extend into the new space, the new strips are added as free rects
+        free_rects = []
+        for x, y, free_width, free_height in self.free_rects:
+            if x + free_width == self.width:
+                free_width = width - x
+            if y + free_height == self.height:
+                free_height = height - y
+            free_rects.append((x, y, free_width, free_height))
+        if width > self.width:
+            free_rects.append((self.width, 0, width - self.width, height))
+        if height > self.height:
+            free_rects.append((0, self.height, width, height - self.height))
+        self.width = width
+        self.height = height
+        self.free_rects = prune_free_rects(free_rects)
+
+
+class SkylinePacker:
+    ### keeps the upper outline of all placed rects as segments (x, y, width) and places each rect on its lowest position
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+        self.skyline = [(0, 0, width)]
+
+    def get_height_at(self, index, width):
+        ### returns the height a rect of given width would be placed at when it starts at the given segment
+        x = self.skyline[index][0]
+        if x + width > self.width:
+            return None
+        y = 0
+        remaining_width = width
+        while remaining_width > 0:
+            if index >= len(self.skyline):
+                return None
+            y = max(y, self.skyline[index][1])
+            remaining_width -= self.skyline[index][2]
+            index += 1
+        return y
+
+    def insert(self, width, height, allow_rotation=False):
+        ### returns (x, y, rotated) or None if the rect does not fit
+        best = None
+        best_score = None
+        orientations = [(width, height, False)]
+        if allow_rotation and width != height:
+            orientations.append((height, width, True))
+        for i, (x, y, segment_width) in enumerate(self.skyline):
+            for rect_width, rect_height, rotated in orientations:
+                top = self.get_height_at(i, rect_width)
+                if top != None and top + rect_height <= self.height:
+                    score = (top + rect_height, segment_width, x)
+                    if best_score == None or score < best_score:
+                        best = (i, x, top, rect_width, rect_height, rotated)
+                        best_score = score
+        if best == None:
+            return None
+        index, x, y, rect_width, rect_height, rotated = best
+        self.add_segment(index, x, y + rect_height, rect_width)
+        return (x, y, rotated)
+
+    def add_segment(self, index, x, y, width):
+        skyline = self.skyline[:index]
+        skyline.append((x, y, width))
+        for segment_x, segment_y, segment_width in self.skyline[index:]:
+            segment_end = segment_x + segment_width
+            if segment_end <= x + width:
+                continue
+            if segment_x < x + width:
+                segment_width = segment_end - (x + width)
+                segment_x = x + width
+            skyline.append((segment_x, segment_y, segment_width))
+        ### merge neighbouring segments of equal height
+        self.skyline = []
+        for segment in skyline:
+            if len(self.skyline) > 0 and self.skyline[-1][1] == segment[1]:
+                last = self.skyline[-1]
+                self.skyline[-1] = (last[0], last[1], last[2] + segment[2])
+            else:
+                self.skyline.append(segment)
+
+    def grow(self, width, height):
+        if width > self.width:
+            self.add_segment(len(self.skyline), self.width, 0, width - self.width)
+        self.width = width
+        self.height = height
+
+
+PACKERS = {"MAXRECTS": MaxRectsPacker, "SKYLINE": SkylinePacker}
+
+
+class PackResult:
+    def __init__(self, positions, width, height, used_area, indices=None, rotated=None):
+        self.positions = positions
+        self.indices = indices if indices != None else list(range(len(positions)))
+        self.rotated = rotated if rotated != None else [False] * len(positions)
+        self.width = width
+        self.height = height
+        self.used_area = used_area
+        self.occupancy = used_area / float(width * height) if width * height > 0 else 0.0
+
+
+def rects_overlap(rect_a, rect_b):
+    return (rect_a[0] < rect_b[0] + rect_b[2] and rect_b[0] < rect_a[0] + rect_a[2] and
+            rect_a[1] < rect_b[1] + rect_b[3] and rect_b[1] < rect_a[1] + rect_a[3])
+
+
+def rect_contains(rect_a, rect_b):
+    return (rect_a[0] <= rect_b[0] and rect_a[1] <= rect_b[1] and
+            rect_b[0] + rect_b[2] <= rect_a[0] + rect_a[2] and rect_b[1] + rect_b[3] <= rect_a[1] + rect_a[3])
+
+
+def split_free_rect(free_rect, rect):
+    ### returns the parts of free_rect that are not covered by rect
+    x, y, width, height = free_rect
+    split_rects = []
+    if rect[0] > x:
+        split_rects.append((x, y, rect[0] - x, height))
+    if rect[0] + rect[2] < x + width:
+        split_rects.append((rect[0] + rect[2], y, x + width - (rect[0] + rect[2]), height))
+    if rect[1] > y:
+        split_rects.append((x, y, width, rect[1] - y))
+    if rect[1] + rect[3] < y + height:
+        split_rects.append((x, rect[1] + rect[3], width, y + height - (rect[1] + rect[3])))
+    return split_rects
+
+
+def prune_free_rects(free_rects):
+    ### removes free rects that are contained in others
+    free_rects = sorted(set(free_rects), key=lambda rect: rect[2] * rect[3], reverse=True)
+    pruned_rects = []
+    for rect in free_rects:
+        if not any(rect_contains(other, rect) for other in pruned_rects):
+            pruned_rects.append(rect)
+    return pruned_rects
+
+
+def grow_atlas_size(width, height, max_width, max_height, square=True):
+    ### doubles the atlas height and width alternately. Returns None once the max size is reached
+    if width == height and height < max_height:
+        height *= 2
+        if square and width < height:
+            width *= 2
+    elif height > width and width < max_width:
+        width *= 2
+    elif width > height and height < max_height:
+        height *= 2
+    else:
+        return None
+    return min(width, max_width), min(height, max_height)
+
+
+def pack_page(sizes, indices, width, height, max_width, max_height, margin=0, square=True, algorithm="MAXRECTS",
+              overflow=False, allow_rotation=False):
+    ### packs the sizes of the given indices into one page. Returns the PackResult and the indices that did not fit.
+    ### Without overflow the result is None as soon as one size does not fit into the max size.
+    packer = PACKERS[algorithm](width - margin, height - margin)
+    positions = []
+    packed_indices = []
+    packed_rotated = []
+    overflow_indices = []
+    used_area = 0
+    for index in indices:
+        rect_width, rect_height = sizes[index]
+        position = packer.insert(rect_width + margin, rect_height + margin, allow_rotation)
+        while position == None:
+            size = grow_atlas_size(width, height, max_width, max_height, square)
+            if size == None:
+                break
+            width, height = size
+            packer.grow(width - margin, height - margin)
+            position = packer.insert(rect_width + margin, rect_height + margin, allow_rotation)
+        if position == None:
+            if not overflow:
+                return None, indices
+            overflow_indices.append(index)
+            continue
+        positions.append((position[0] + margin, position[1] + margin))
+        packed_indices.append(index)
+        packed_rotated.append(position[2])
+        used_area += rect_width * rect_height
+    return PackResult(positions, width, height, used_area, packed_indices, packed_rotated), overflow_indices
+
+
+def pack_rects(sizes, width, height, max_width, max_height, margin=0, square=True, algorithm="MAXRECTS",
+               allow_rotation=False):
+    ### packs all (width, height) sizes in the given order. Returns a PackResult or None if they do not fit into the max size.
+    ### margin is kept between all rects and to the atlas border.
+    result, overflow_indices = pack_page(sizes, range(len(sizes)), width, height, max_width, max_height, margin, square,
+                                         algorithm, allow_rotation=allow_rotation)
+    return result
+
+
+def pack_pages(sizes, width, height, max_width, max_height, margin=0, square=True, algorithm="MAXRECTS",
+               allow_rotation=False):
+    ### like pack_rects, but sizes that do not fit into a page of max size overflow into a new page.
+    ### Returns a list of PackResults or None if a single size is larger than the max size.
+    pages = []
+    indices = list(range(len(sizes)))
+    while len(indices) > 0:
+        result, indices = pack_page(sizes, indices, width, height, max_width, max_height, margin, square, algorithm,
+                                    overflow=True, allow_rotation=allow_rotation)
+        if len(result.indices) == 0:
+            return None
+        pages.append(result)
+    return pages
+
+
+def search_pack_scale(get_sizes, output_scale, width, height, max_width, max_height, margin=0, square=True,
+                      algorithm="MAXRECTS", scale_precision=0.01, multi_page=False, allow_rotation=False):
+    ### packs the sizes get_sizes(scale) returns. If they do not fit at output_scale, the largest scale that fits is searched.
+    ### Returns the list of page results, the used scale and the number of restarted packing passes
+    def pack(scale):
+        sizes = get_sizes(scale)
+        if multi_page:
+            return pack_pages(sizes, width, height, max_width, max_height, margin, square, algorithm, allow_rotation)
+        result = pack_rects(sizes, width, height, max_width, max_height, margin, square, algorithm, allow_rotation)
+        return [result] if result != None else None
+
+    ### the packer grows the atlas in place. Packing only restarts if the sizes do not fit into the max size
+    restarts = 0
+    results = pack(output_scale)
+    if results == None:
+        ### halve the scale until the sizes fit, then bisect between the fitting and the failing scale
+        upper_scale = output_scale
+        lower_scale = output_scale
+        while results == None:
+            if lower_scale < scale_precision:
+                raise ValueError("Textures do not fit into an atlas of " + str(max_width) + "x" + str(max_height))
+            upper_scale = lower_scale
+            lower_scale *= 0.5
+            results = pack(lower_scale)
+            restarts += 1
+        while upper_scale - lower_scale > scale_precision:
+            scale = (upper_scale + lower_scale) * 0.5
+            scaled_results = pack(scale)
+            restarts += 1
+            if scaled_results != None:
+                lower_scale = scale
+                results = scaled_results
+            else:
+                upper_scale = scale
+        output_scale = lower_scale
+    return results, output_scale, restarts
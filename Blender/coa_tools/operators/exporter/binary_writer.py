@@ -0,0 +1,168 @@
+'''
+Binary version of the exported json data. All values are little endian.
+
+Header:     4 bytes magic "COAB", uint16 version, uint32 offset of the string table
+Body:       one tagged value, the json root object
+Strings:    uint32 count, then every string as uint32 byte length and utf-8 bytes
+
+Tagged values start with a uint8 tag:
+    NULL, FALSE, TRUE
+    INT             int32
+    FLOAT           float32
+    STRING          uint32 string index
+    LIST            uint32 count, tagged items
+    DICT            uint32 count, pairs of uint32 key string index and tagged value
+    FLOAT_ARRAY     uint32 count, float32 values
+    INT16_ARRAY     uint32 count, int16 values
+    INT32_ARRAY     uint32 count, int32 values
+    LIST_STREAM     tagged items until END
+    DICT_STREAM     pairs of uint32 key string index and tagged value until END
+    TABLE           list of dicts that share their keys, e.g. keyframes. uint32 row count, uint16 column count,
+                    then per column uint32 key string index, uint16 values per row (0 for plain numbers instead of lists)
+                    and a typed array holding the column of all rows
+'''
+
+import struct
+from . export_helper import JsonStream, JsonDictStream
+
+BINARY_VERSION = 2
+
+NULL = 0
+FALSE = 1
+TRUE = 2
+INT = 3
+FLOAT = 4
+STRING = 5
+LIST = 6
+DICT = 7
+FLOAT_ARRAY = 8
+INT16_ARRAY = 9
+INT32_ARRAY = 10
+LIST_STREAM = 11
+DICT_STREAM = 12
+TABLE = 13
+END = 14
+
+class BinaryWriter:
+    def __init__(self, file):
+        self.file = file
+        self.strings = []
+        self.string_indices = {}
+
+    def get_string_index(self, string):
+        if string not in self.string_indices:
+            self.string_indices[string] = len(self.strings)
+            self.strings.append(string)
+        return self.string_indices[string]
+
+    def write(self, data):
+        start = self.file.tell()
+        self.file.write(b"COAB" + struct.pack("<HI", BINARY_VERSION, 0))
+        self.write_value(data)
+
+        string_table_offset = self.file.tell() - start
+        self.file.write(struct.pack("<I", len(self.strings)))
+        for string in self.strings:
+            string = string.encode("utf-8")
+            self.file.write(struct.pack("<I", len(string)) + string)
+
+        end = self.file.tell()
+        self.file.seek(start + 6)
+        self.file.write(struct.pack("<I", string_table_offset))
+        self.file.seek(end)
+
+    def write_tag(self, tag):
+        self.file.write(struct.pack("<B", tag))
+
+    def write_value(self, value):
+        if isinstance(value, JsonDictStream):
+            self.write_tag(DICT_STREAM)
+            for key, item in value.items:
+                self.file.write(struct.pack("<I", self.get_string_index(str(key))))
+                self.write_value(item)
+            self.write_tag(END)
+        elif isinstance(value, JsonStream):
+            self.write_tag(LIST_STREAM)
+            for item in value.items:
+                self.write_value(item)
+            self.write_tag(END)
+        elif value is None:
+            self.write_tag(NULL)
+        elif value is True or value is False:
+            self.write_tag(TRUE if value else FALSE)
+        elif isinstance(value, int):
+            if -2**31 <= value < 2**31:
+                self.file.write(struct.pack("<Bi", INT, value))
+            else:
+                self.file.write(struct.pack("<Bf", FLOAT, value))
+        elif isinstance(value, float):
+            self.file.write(struct.pack("<Bf", FLOAT, value))
+        elif isinstance(value, str):
+            self.file.write(struct.pack("<BI", STRING, self.get_string_index(value)))
+        elif isinstance(value, dict):
+            self.write_tag(DICT)
+            self.file.write(struct.pack("<I", len(value)))
+            for key in value:
+                self.file.write(struct.pack("<I", self.get_string_index(str(key))))
+                self.write_value(value[key])
+        elif isinstance(value, (list, tuple)):
+            if is_number_list(value) and len(value) > 0:
+                self.write_typed_array(value)
+            elif not self.write_table(value):
+                self.write_tag(LIST)
+                self.file.write(struct.pack("<I", len(value)))
+                for item in value:
+                    self.write_value(item)
+        else:
+            raise TypeError(repr(value) + " can not be written to binary data")
+
+    def write_typed_array(self, values):
+        if all(isinstance(value, int) for value in values):
+            if all(-2**15 <= value < 2**15 for value in values):
+                self.file.write(struct.pack("<BI", INT16_ARRAY, len(values)))
+                self.file.write(struct.pack("<" + str(len(values)) + "h", *values))
+                return
+            elif all(-2**31 <= value < 2**31 for value in values):
+                self.file.write(struct.pack("<BI", INT32_ARRAY, len(values)))
+                self.file.write(struct.pack("<" + str(len(values)) + "i", *values))
+                return
+        self.file.write(struct.pack("<BI", FLOAT_ARRAY, len(values)))
+        self.file.write(struct.pack("<" + str(len(values)) + "f", *values))
+
+    ### writes lists of dicts with equal keys and numeric values column wise. Returns False if the list does not fit
+    def write_table(self, rows):
+        if len(rows) < 2 or not all(isinstance(row, dict) for row in rows):
+            return False
+        keys = list(rows[0].keys())
+        if len(keys) > 0xffff:
+            return False
+        columns = []
+        for key in keys:
+            column = []
+            width = None
+            for row in rows:
+                if list(row.keys()) != keys:
+                    return False
+                value = row[key]
+                values = value if isinstance(value, (list, tuple)) else [value]
+                row_width = len(value) if isinstance(value, (list, tuple)) else 0
+                if not is_number_list(values) or len(values) == 0 or (width != None and row_width != width):
+                    return False
+                width = row_width
+                column += values
+            if width > 0xffff:
+                return False
+            columns.append((key, width, column))
+
+        self.write_tag(TABLE)
+        self.file.write(struct.pack("<IH", len(rows), len(columns)))
+        for key, width, column in columns:
+            self.file.write(struct.pack("<IH", self.get_string_index(str(key)), width))
+            self.write_typed_array(column)
+        return True
+
+def is_number_list(values):
+    return all(isinstance(value, (int, float)) and not isinstance(value, bool) for value in values)
+
+def write_binary(file, data):
+    BinaryWriter(file).write(data)
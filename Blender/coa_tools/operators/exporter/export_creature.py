@@ -30,7 +30,10 @@ import math
 from mathutils import Vector,Matrix, Quaternion, Euler
 import shutil
 from . texture_atlas_generator import TextureAtlasGenerator
-import zipfile
+from . image_writer import ImageWriter
+from . resolution_planner import get_sprite_screen_densities, get_max_texture_scales
+from . zip_writer import ZipStreamWriter
+import numpy as np
 
 class Sprite:
     def __init__(self, mesh_object):
@@ -102,9 +105,11 @@ class CreatureExport(bpy.types.Operator):
 
         self.root_bone_name = "__Creature RootBone__"
 
+        self.bone_indices = {}
         self.bone_weights = {}
         self.bone_scaled = {}
         self.mesh_deformed = {}
+        self.shape_key_cache = ShapeKeyMixCache()
         self.remapped_indices = {}
 
     def setup_json_data(self):
@@ -157,22 +162,6 @@ class CreatureExport(bpy.types.Operator):
         armature.data.pose_position = "POSE"
         return sprites, armature
 
-    def get_vertices_from_v_group(self, bm, obj, v_group="", vert_type="BMESH"): # vert_type = ["BMESH", "MESH"]
-        vertices = []
-        if v_group not in obj.vertex_groups:
-            return vertices
-
-        group_index = obj.vertex_groups[v_group].index
-        for bm_vert in bm.verts:
-            vert = obj.data.vertices[bm_vert.index]
-            for group in vert.groups:
-                if group.group == group_index:
-                    if vert_type == "BMESH":
-                        vertices.append(bm_vert)
-                    elif vert_type == "MESH":
-                        vertices.append(vert)
-        return vertices
-
     def get_init_vert_pos(self, obj, vert):
         if obj.data.shape_keys:
             return obj.data.shape_keys.key_blocks[0].data[vert.index].co
@@ -186,166 +175,139 @@ class CreatureExport(bpy.types.Operator):
             return uv_data.uv
         return None
 
-    def get_sprite_data_by_name(self, name):
-        sprite_name = name
-        slot_index = 0
-        if "_COA_SLOT_" in name:
-            sprite_name = name.split("_COA_SLOT_")[0]
-            slot_index = int(name.split("_COA_SLOT_")[1])
+    def get_deformed_meshes(self, anim_name):
+        ### slots need displacements in an animation if their mesh has shapekeys or one of their bones is scaled in it
+        deformed_meshes = []
+        scaled_bones = self.bone_scaled.get(anim_name, [])
         for sprite in self.sprite_data:
-            if sprite.name == sprite_name:
-                return sprite, sprite.slots[slot_index]
-        return None, None
-
-    def check_mesh_deformation(self, context):
-        anim_collections = self.sprite_object.coa_anim_collections
-        mesh_deformed = {}
-        for anim_index, anim in enumerate(anim_collections):
-            if anim.name not in ["NO ACTION"]:
-                if anim.name == "Restpose":
-                    if "default" in anim_collections:
-                        continue
-                anim_name = anim.name if anim.name != "Restpose" else "default"
-
-                for sprite in self.sprite_data:
-                    for i, slot in enumerate(sprite.slots):
-                        sprite_name = sprite.name if len(sprite.slots) <= 1 else sprite.name + "_" + str(i).zfill(3)
+            mesh_is_scaled = any(bone_name in sprite.object.vertex_groups for bone_name in scaled_bones)
+            for i, slot in enumerate(sprite.slots):
+                sprite_name = sprite.name if len(sprite.slots) <= 1 else sprite.name + "_" + str(i).zfill(3)
+                shape_keys = slot["slot"].shape_keys
+                mesh_contains_shapekeys = shape_keys != None and len(shape_keys.key_blocks) > 1
+                if mesh_contains_shapekeys or mesh_is_scaled:
+                    deformed_meshes.append(sprite_name)
+        return deformed_meshes
+
+    def get_deform_slots(self):
+        ### slots that can be deformed in any animation. Only for these the deformation input is recorded while sampling
+        deform_slots = set()
+        for sprite in self.sprite_data:
+            sprite_object = bpy.data.objects[sprite.name]
+            has_bone_groups = any(v_group.name in self.armature.data.bones for v_group in sprite.object.vertex_groups)
+            for i, slot in enumerate(sprite.slots):
+                slot_name = sprite.name + "_" + str(i).zfill(3) if sprite_object.coa_type == "SLOT" else sprite.name
+                shape_keys = slot["slot"].shape_keys
+                if has_bone_groups or (shape_keys != None and len(shape_keys.key_blocks) > 1):
+                    deform_slots.add(slot_name)
+        return deform_slots
+
+    def sample_animation(self, context, anim, anim_name, deform_slots):
+        ### evaluates every frame of the active animation once. Bone data, bone scale flags and the input of the mesh
+        ### deformation are recorded together, because displacements depend on bones that are scaled on any frame
+        frames = []
+        bone_scaled = []
+        for frame in range(anim.frame_end+1):
+            context.scene.frame_set(frame)
+            frame_data = {"bones": OrderedDict(), "bone_scales": {}, "armature_matrix": self.armature.matrix_world.copy(), "slots": {}}
+
+            # bone relevant data
+            for pbone in self.armature.pose.bones:
+                start_pt = self.get_bone_head_tail(pbone, local=False)["head"]
+                end_pt = self.get_bone_head_tail(pbone, local=False)["tail"]
+                frame_data["bones"][pbone.name] = {"start_pt": [round(start_pt.x, 3), round(start_pt.y, 3)],
+                                                   "end_pt": [round(end_pt.x, 3), round(end_pt.y, 3)]}
+
+                bone_scale = pbone.matrix.to_scale()
+                frame_data["bone_scales"][pbone.name] = bone_scale
+                if Vector((round(bone_scale.x,1), round(bone_scale.y,1), round(bone_scale.z,1))) != Vector((1, 1, 1)):
+                    if pbone.name not in bone_scaled:
+                        bone_scaled.append(pbone.name)
+
+            # slot relevant data
+            for sprite in self.sprite_data:
+                sprite_object = bpy.data.objects[sprite.name]
+                for i, slot in enumerate(sprite.slots):
+                    slot_name = sprite.name + "_" + str(i).zfill(3) if sprite_object.coa_type == "SLOT" else sprite.name
+                    if sprite.object.data != slot["slot"]:
+                        context.scene.update()
                         sprite.object.data = slot["slot"]
-
-                        mesh_contains_shapekeys = False
-                        mesh_is_scaled = False
-
-                        if sprite.object.data.shape_keys != None and len(sprite.object.data.shape_keys.key_blocks) > 1:
-                            mesh_contains_shapekeys = True
-                        if anim_name in self.bone_scaled:
-                            for bone_name in self.bone_scaled[anim_name]:
-                                if bone_name in sprite.object.vertex_groups:
-                                    mesh_is_scaled = True
-                                    break
-
-                        if mesh_contains_shapekeys or mesh_is_scaled:
-                            if anim_name not in mesh_deformed:
-                                mesh_deformed[anim_name] = []
-                            mesh_deformed[anim_name].append(sprite_name)
-        return mesh_deformed
-
-
-
-    def check_and_store_bone_scaling(self, context):
-        anim_collections = self.sprite_object.coa_anim_collections
-        bone_scaled = {}
-        for anim_index, anim in enumerate(anim_collections):
-            if anim.name not in ["NO ACTION"]:
-                if anim.name == "Restpose":
-                    if "default" in anim_collections:
-                        continue
-                anim_name = anim.name if anim.name != "Restpose" else "default"
-                self.sprite_object.coa_anim_collections_index = anim_index  ### set animation
-
-                for frame in range(anim.frame_end+1):
-                    context.scene.frame_set(frame)
-                    for bone in self.armature.pose.bones:
-                        bone_scale = bone.matrix.to_scale()
-                        bone_scale = Vector((round(bone_scale.x,1), round(bone_scale.y,1), round(bone_scale.z,1)))
-                        if bone_scale != Vector((1, 1, 1)):
-                            if anim_name not in bone_scaled:
-                                bone_scaled[anim_name] = []
-                            bone_scaled[anim_name].append(bone.name)
-        return bone_scaled
-
+                    slot_data = {"active": i == sprite_object.coa_slot_index, "opacity": round(sprite_object.coa_alpha*100, 1)}
+                    if slot_name in deform_slots:
+                        slot_data["vert_coords"] = self.shape_key_cache.get_mixed_vertex_data(sprite.object, sprite.object.data)
+                        slot_data["matrix_world"] = sprite.object.matrix_world.copy()
+                    frame_data["slots"][slot_name] = slot_data
+            frames.append(frame_data)
+
+            self.export_progress_current += 1
+            current_progress = self.export_progress_current/self.export_progress_total
+            context.window_manager.progress_update(current_progress)
+        if len(bone_scaled) > 0:
+            self.bone_scaled[anim_name] = bone_scaled
+        return frames
 
     def store_bone_weights(self):
+        ### reads the bone weights of every slot mesh once. Each entry holds flat arrays of vertex index, bone index and
+        ### weight, shared by the mesh deformation and the region export
         bone_weights = {}
         for sprite in self.sprite_data:
             for i, slot in enumerate(sprite.slots):
                 sprite_name = sprite.name if len(sprite.slots) <= 1 else sprite.name + "_" + str(i).zfill(3)
-
-                sprite.object.data = slot["slot"]
-
-                for bone in self.armature.data.bones:
-                    for vert in slot["slot"].vertices:
-                        weight = self.get_bone_weight(sprite.object, vert, bone)
-                        if weight > 0:
-                            if sprite_name not in bone_weights:
-                                bone_weights[sprite_name] = {bone.name:{}}
-                            elif bone.name not in bone_weights[sprite_name]:
-                                bone_weights[sprite_name][bone.name] = {}
-                            bone_weights[sprite_name][bone.name][str(vert.index)] = weight
+                bone_weights[sprite_name] = get_bone_weight_arrays(sprite.object, slot["slot"], self.bone_indices)
         return bone_weights
 
-    def get_bone_weight(self, obj, vert, bone):
-        if bone.name not in obj.vertex_groups:
-            return 0.0
-        else:
-            v_group = obj.vertex_groups[bone.name]
-            for group in vert.groups:
-                group_name = obj.vertex_groups[group.group].name
-
-                if group_name == v_group.name:
-                    return group.weight
-        return 0
-
     def lerp(self, val1, val2, interpolation):
         return val1 * (1 - interpolation) + val2 * interpolation
 
-    def scale_verts_by_bone(self, pbone, armature, mesh_object, vert_co, weight=1.0):
-        # verts = mesh_object.data.vertices
-        bone = armature.data.bones[pbone.name]
-        bone_head = self.init_bone_positions[bone.name]["head"]
-        bone_tail = self.init_bone_positions[bone.name]["tail"]
+    def scale_verts_by_bone(self, bone_name, bone_scale, armature_matrix, mesh_matrix, vert_coords, weights):
+        ### scales all vertices with a weight of the bone at once. vert_coords is an array of local vertex coordinates
+        bone_head = self.init_bone_positions[bone_name]["head"]
+        bone_tail = self.init_bone_positions[bone_name]["tail"]
         bone_axis_x = (bone_tail - bone_head).normalized().xz
         bone_axis_y = bone_axis_x.orthogonal().normalized()
 
-        world_axis_x = Vector((bone_axis_x.dot(Vector((1, 0))), bone_axis_y.dot(Vector((1, 0)))))
-        world_axis_y = Vector((bone_axis_x.dot(Vector((0, 1))), bone_axis_y.dot(Vector((0, 1)))))
-
-        bone_system_origin = (mesh_object.matrix_world.inverted() * (armature.matrix_world * bone_head)).xz
-
-        bone_scale = pbone.matrix.to_scale()
-        bone_scale_2d = Vector(( self.lerp( 1.0, bone_scale.y, weight), self.lerp(1.0, bone_scale.x, weight) ))
-
-        vert_delta_co = vert_co.xz
-        vert_delta_co -= bone_system_origin
-        vert_delta_co = Vector((bone_axis_x.dot(vert_delta_co), bone_axis_y.dot(vert_delta_co)))
-        vert_delta_co = Vector((vert_delta_co.x * bone_scale_2d.x, vert_delta_co.y * bone_scale_2d.y))
-        vert_delta_co = Vector((world_axis_x.dot(vert_delta_co), world_axis_y.dot(vert_delta_co)))
-        vert_delta_co += bone_system_origin
-
-        scaled_vert_co = Vector((vert_delta_co.x, 0, vert_delta_co.y))
-        return scaled_vert_co
-
-    def get_shapekey_vert_data(self, obj, obj_name, verts, anim, relative=True):
-        default_vert_positions = []
-        verts = sorted(verts, key=lambda vert: vert.index, reverse=False)
-        for i,vert in enumerate(verts):
-            default_vert_positions.append(obj.matrix_world * vert.co)
-
-        verts = []
-        index = int(obj.active_shape_key_index)
-        shape_key = obj.shape_key_add("tmp_mixed_mesh", from_mix=True)
-        for i, vert in enumerate(default_vert_positions):
-            # shapekey_vert = obj.matrix_world * shape_key.data[i].co
-            shapekey_vert = shape_key.data[i].co
-            # scale bones only when vert has bone weights and bone is scaled at any time in animation
-            for bone_name in self.bone_weights[obj_name]:
-                bone = self.armature.pose.bones[bone_name]
-                if anim.name in self.bone_scaled and bone.name in self.bone_scaled[anim.name] and bone.name in obj.vertex_groups:
-                    if str(i) in self.bone_weights[obj_name][bone.name]:
-                        bone_weight = self.bone_weights[obj_name][bone.name][str(i)]
-                        scaled_vert = self.scale_verts_by_bone(bone, self.armature, obj, shapekey_vert, bone_weight)
-                        shapekey_vert = scaled_vert
-            shapekey_vert = (obj.matrix_world * shapekey_vert)
-
-            if relative:
-                offset = (shapekey_vert - vert) * self.armature_export_scale
-            else:
-                offset = shapekey_vert * self.armature_export_scale
-            verts.append(round(offset.x, 3))
-            verts.append(round(offset.z, 3))
-        obj.shape_key_remove(shape_key)
-        obj.active_shape_key_index = index
-
-        return verts
+        bone_system_origin = (mesh_matrix.inverted() * (armature_matrix * bone_head)).xz
+
+        scale_x = self.lerp(1.0, bone_scale.y, weights)
+        scale_y = self.lerp(1.0, bone_scale.x, weights)
+
+        axis_x = np.array(bone_axis_x)
+        axis_y = np.array(bone_axis_y)
+        origin = np.array(bone_system_origin)
+
+        vert_delta_co = vert_coords[:, [0, 2]] - origin
+        local_x = vert_delta_co.dot(axis_x) * scale_x
+        local_y = vert_delta_co.dot(axis_y) * scale_y
+        vert_delta_co = local_x[:, np.newaxis] * axis_x + local_y[:, np.newaxis] * axis_y + origin
+
+        scaled_vert_coords = np.zeros_like(vert_coords)
+        scaled_vert_coords[:, 0] = vert_delta_co[:, 0]
+        scaled_vert_coords[:, 2] = vert_delta_co[:, 1]
+        return np.where((weights > 0)[:, np.newaxis], scaled_vert_coords, vert_coords)
+
+    def get_shapekey_vert_data(self, mesh, obj_name, slot_data, frame_data, anim_name, relative=True):
+        ### computes the displacements of a slot from the deformation input recorded while sampling the frame
+        default_vert_coords = get_vertex_coords(mesh.vertices, len(mesh.vertices))
+        shapekey_vert_coords = slot_data["vert_coords"]
+
+        # scale bones only when vert has bone weights and bone is scaled at any time in animation
+        if obj_name in self.bone_weights and anim_name in self.bone_scaled:
+            rows, bone_indices, weights = self.bone_weights[obj_name]
+            weighted = weights > 0
+            for bone_index in np.unique(bone_indices[weighted]).tolist():
+                bone_name = self.armature.data.bones[bone_index].name
+                if bone_name in self.bone_scaled[anim_name]:
+                    bone_mask = weighted & (bone_indices == bone_index)
+                    bone_weights = np.zeros(len(mesh.vertices), dtype=np.float64)
+                    bone_weights[rows[bone_mask]] = weights[bone_mask]
+                    shapekey_vert_coords = self.scale_verts_by_bone(bone_name, frame_data["bone_scales"][bone_name], frame_data["armature_matrix"], slot_data["matrix_world"], shapekey_vert_coords, bone_weights)
+
+        matrix_world = np.array(slot_data["matrix_world"])
+        offsets = shapekey_vert_coords.dot(matrix_world[:3, :3].T) + matrix_world[:3, 3]
+        if relative:
+            offsets -= default_vert_coords.dot(matrix_world[:3, :3].T) + matrix_world[:3, 3]
+        offsets *= self.armature_export_scale
+        return np.round(offsets[:, [0, 2]], 3).ravel().tolist()
 
     def create_dupli_atlas_objects(self, context):
         atlas_objects = []
@@ -370,11 +332,9 @@ class CreatureExport(bpy.types.Operator):
             for mesh_data in meshes:
                 atlas_sprite = mesh_data["obj"]
                 name = mesh_data["name"]
+                ### bone weights are read from the slot meshes, the atlas object only needs its slot group
                 for v_group in atlas_sprite.vertex_groups:
-                    if v_group.name not in self.armature.data.bones:
-                        atlas_sprite.vertex_groups.remove(v_group)
-                    else:
-                        v_group.name = "BONE_VGROUP_" + v_group.name
+                    atlas_sprite.vertex_groups.remove(v_group)
                 verts = []
                 for vert in atlas_sprite.data.vertices:
                     verts.append(vert.index)
@@ -415,6 +375,15 @@ class CreatureExport(bpy.types.Operator):
         width = left - right
         return {"width":width, "height":height}
 
+    def get_slot_vertex_groups(self, merged_atlas_obj):
+        ### maps the vertex group index of every slot in the merged atlas object to its sprite, slot and group name
+        slot_groups = OrderedDict()
+        for sprite in self.sprite_data:
+            for i, slot in enumerate(sprite.slots):
+                v_group_name = sprite.name if len(sprite.slots) <= 1 else sprite.name + "_COA_SLOT_" + str(i).zfill(3)
+                slot_groups[merged_atlas_obj.vertex_groups[v_group_name].index] = (sprite, slot, v_group_name)
+        return slot_groups
+
     def create_mesh_data(self, context, merged_atlas_obj):
         points = []
         uvs = []
@@ -426,62 +395,59 @@ class CreatureExport(bpy.types.Operator):
         bpy.ops.mesh.reveal()
         bpy.ops.mesh.quads_convert_to_tris(quad_method='BEAUTY', ngon_method='BEAUTY')
 
-        current_face_index = 0
-
         vertex_index = 0
 
         self.sprite_data.reverse()
-        for sprite in self.sprite_data:
-            for j, slot in enumerate(sprite.slots):
-                sprite.object.data = slot["slot"]
-                v_group_name = sprite.name if len(sprite.slots) <= 1 else sprite.name + "_COA_SLOT_" + str(j).zfill(3)
-                v_group = merged_atlas_obj.vertex_groups[v_group_name]
-
-                bm = bmesh.from_edit_mesh(merged_atlas_obj.data)
-
-                sprite, slot = self.get_sprite_data_by_name(v_group.name)
-
-                uv_layer = bm.loops.layers.uv.active
-                vertices = self.get_vertices_from_v_group(bm, merged_atlas_obj, v_group.name)
-                vertices.sort(key=lambda v: v.index)
-
-                start_pt_index = float("inf")
-                end_pt_index = 0
-
-                uv_dimensions = self.get_uv_dimensions(bm, vertices, uv_layer)
-                merged_atlas_obj[v_group.name] = uv_dimensions
-
-                for i, vert in enumerate(bm.verts):
-                    if vert in vertices:
-                        start_pt_index = min(vertex_index, start_pt_index)
-                        end_pt_index = max(vertex_index, end_pt_index)
-                        slot["start_pt_index"] = start_pt_index
-                        slot["end_pt_index"] = end_pt_index
-
-                        # get point data
-                        coords = self.get_init_vert_pos(merged_atlas_obj, vert)
-                        coords = (coords).xzy * self.armature_export_scale
-                        points.append(round(coords.x, 3))
-                        points.append(round(coords.y, 3))
-
-
-                        # get uv data
-                        uv = self.get_uv_from_vert_first(uv_layer, vert)
-                        uvs.append(round(uv[0], 3))
-                        uvs.append(round(uv[1] + 1 - uv[1]*2, 3))
-                        self.remapped_indices[vert.index] = vertex_index
-                        vertex_index += 1
-
-                # get indices data
-                for j, face in enumerate(bm.faces):
-                    if j == 0:
-                        slot["start_index"] = current_face_index
-                    for vert in face.verts:
-                        if vert in vertices:
-                            current_face_index += 1
-                            indices.append(self.remapped_indices[vert.index])
-                        slot["end_index"] = current_face_index
+        slot_groups = self.get_slot_vertex_groups(merged_atlas_obj)
 
+        bm = bmesh.from_edit_mesh(merged_atlas_obj.data)
+        uv_layer = bm.loops.layers.uv.active
+        deform_layer = bm.verts.layers.deform.verify()
+
+        ### bucket all vertices and face corners by their slot vertex group in one pass
+        slot_verts = {group_index: [] for group_index in slot_groups}
+        slot_face_verts = {group_index: [] for group_index in slot_groups}
+        vert_slots = {}
+        for vert in bm.verts:
+            for group_index in vert[deform_layer].keys():
+                if group_index in slot_verts:
+                    slot_verts[group_index].append(vert)
+                    vert_slots[vert.index] = group_index
+                    break
+        for face in bm.faces:
+            for vert in face.verts:
+                if vert.index in vert_slots:
+                    slot_face_verts[vert_slots[vert.index]].append(vert.index)
+
+        for group_index, (sprite, slot, v_group_name) in slot_groups.items():
+            sprite.object.data = slot["slot"]
+            vertices = slot_verts[group_index]
+
+            uv_dimensions = self.get_uv_dimensions(bm, vertices, uv_layer)
+            merged_atlas_obj[v_group_name] = uv_dimensions
+
+            if len(vertices) > 0:
+                slot["start_pt_index"] = vertex_index
+                slot["end_pt_index"] = vertex_index + len(vertices) - 1
+            for vert in vertices:
+                # get point data
+                coords = self.get_init_vert_pos(merged_atlas_obj, vert)
+                coords = (coords).xzy * self.armature_export_scale
+                points.append(round(coords.x, 3))
+                points.append(round(coords.y, 3))
+
+                # get uv data
+                uv = self.get_uv_from_vert_first(uv_layer, vert)
+                uvs.append(round(uv[0], 3))
+                uvs.append(round(uv[1] + 1 - uv[1]*2, 3))
+                self.remapped_indices[vert.index] = vertex_index
+                vertex_index += 1
+
+            # get indices data
+            if len(bm.faces) > 0:
+                slot["start_index"] = len(indices)
+                indices += [self.remapped_indices[vert_index] for vert_index in slot_face_verts[group_index]]
+                slot["end_index"] = len(indices)
 
         bpy.ops.object.mode_set(mode="OBJECT")
         return points, uvs, indices
@@ -489,10 +455,6 @@ class CreatureExport(bpy.types.Operator):
     def create_region_data(self, context, merged_atlas_obj):
         regions = OrderedDict()
 
-        context.scene.objects.active = merged_atlas_obj
-        bpy.ops.object.mode_set(mode="EDIT")
-        bm = bmesh.from_edit_mesh(merged_atlas_obj.data)
-
         region_id = 0
         for sprite in self.sprite_data:
             for i, slot in enumerate(sprite.slots):
@@ -507,27 +469,18 @@ class CreatureExport(bpy.types.Operator):
                 regions[name]["weights"] = OrderedDict()
 
                 # get root bone weights
-                for vert in slot["slot"].vertices:
-                    if self.root_bone_name not in regions[name]["weights"]:
-                        regions[name]["weights"][self.root_bone_name] = []
-                    regions[name]["weights"][self.root_bone_name].append(0)
-
-                slot_name = sprite.name + "_COA_SLOT_" + str(i).zfill(3) if len(sprite.slots) > 1 else sprite.name
-                vertices = self.get_vertices_from_v_group(bm, merged_atlas_obj, slot_name, vert_type="MESH")
-
-                for bone in self.armature.data.bones:
-                    bone_v_group_name = "BONE_VGROUP_"+bone.name
-                    regions[name]["weights"][bone.name] = []
-                    for i, vert in enumerate(vertices):
-                        regions[name]["weights"][bone.name].append(0)
-                        for group in vert.groups:
-                            v_group_name = merged_atlas_obj.vertex_groups[group.group].name
-                            if v_group_name == bone_v_group_name:
-                                vert_index = self.remapped_indices[vert.index] - slot["start_pt_index"]
-                                regions[name]["weights"][bone.name][vert_index] = round(group.weight, 3)
+                vert_count = len(slot["slot"].vertices)
+                regions[name]["weights"][self.root_bone_name] = [0] * vert_count
+
+                # slot vertices keep their order in the merged atlas object, so the slot mesh weights apply directly
+                bone_weights = [[0] * vert_count for bone in self.armature.data.bones]
+                rows, bone_indices, weights = self.bone_weights[name]
+                for vert_index, bone_index, weight in zip(rows.tolist(), bone_indices.tolist(), weights.tolist()):
+                    bone_weights[bone_index][vert_index] = round(weight, 3)
+                for bone, bone_weight_list in zip(self.armature.data.bones, bone_weights):
+                    regions[name]["weights"][bone.name] = bone_weight_list
 
                 region_id += 1
-        bpy.ops.object.mode_set(mode="OBJECT")
         return regions
 
     def create_skeleton_data(self):
@@ -609,9 +562,83 @@ class CreatureExport(bpy.types.Operator):
                             return True
         return False
 
+    def resample_reduced_track(self, values):
+        # the runtime needs a sample on every frame, so no frame is dropped. Samples between the keys reduce_keyframes keeps
+        # are replaced by the interpolation of those keys, which turns changes within tolerance into constant and linear runs
+        values = np.array(values, dtype=np.float64).reshape(len(values), -1)
+        keys = reduce_keyframes(np.arange(len(values)), values, self.scene.coa_export_reduce_tolerance_pos)
+        for start, end in zip(keys[:-1], keys[1:]):
+            if end - start > 1:
+                progress = np.arange(1, end - start) / float(end - start)
+                values[start+1:end] = values[start] + (values[end] - values[start]) * progress[:, np.newaxis]
+        return np.round(values, 3).tolist()
+
+    def reduce_bone_frames(self, bones):
+        # the start_pt and end_pt of each bone are reduced as one track
+        frames = list(bones.keys())
+        if len(frames) <= 2:
+            return
+        for bone_name in bones[frames[0]]:
+            track = [bones[frame][bone_name]["start_pt"] + bones[frame][bone_name]["end_pt"] for frame in frames]
+            for frame, values in zip(frames, self.resample_reduced_track(track)):
+                bones[frame][bone_name]["start_pt"] = values[:2]
+                bones[frame][bone_name]["end_pt"] = values[2:]
+
+    def reduce_mesh_displacements(self, meshes):
+        # the runtime needs a sample on every frame. Every run of frames with displacements is reduced like a bone track and
+        # displacements are dropped for meshes that stay within tolerance during the whole animation
+        frames = list(meshes.keys())
+        slot_names = []
+        for frame in frames:
+            slot_names += [slot_name for slot_name in meshes[frame] if slot_name not in slot_names]
+        for slot_name in slot_names:
+            run = []
+            for frame in frames + [None]:
+                if frame != None and slot_name in meshes[frame] and meshes[frame][slot_name]["use_local_displacements"]:
+                    run.append(frame)
+                    continue
+                if len(run) > 2:
+                    track = [meshes[run_frame][slot_name]["local_displacements"] for run_frame in run]
+                    for run_frame, values in zip(run, self.resample_reduced_track(track)):
+                        meshes[run_frame][slot_name]["local_displacements"] = values
+                run = []
+
+        tolerance = self.scene.coa_export_reduce_tolerance_pos
+        max_displacement = {}
+        for frame in meshes:
+            for slot_name in meshes[frame]:
+                if meshes[frame][slot_name]["use_local_displacements"]:
+                    displacement = max([abs(value) for value in meshes[frame][slot_name]["local_displacements"]] + [0.0])
+                    max_displacement[slot_name] = max(max_displacement.get(slot_name, 0.0), displacement)
+        for slot_name in max_displacement:
+            if max_displacement[slot_name] <= tolerance:
+                for frame in meshes:
+                    meshes[frame][slot_name]["use_local_displacements"] = False
+                    del meshes[frame][slot_name]["local_displacements"]
+
+    def delta_encode_slot_frames(self, animation):
+        # drops slot entries inside runs of frames where a slot does not change. The first and last frame of each run stay, so
+        # the runtime can fill the dropped frames from the frames around them. The first and last frame of the animation stay
+        # complete and meshes with displacements are kept on every frame, because the runtime needs a sample on every frame for them
+        for channel in ["meshes", "uv_swaps", "mesh_opacities"]:
+            frames = list(animation[channel].keys())
+            dropped = []
+            for i in range(1, len(frames) - 1):
+                last_data = animation[channel][frames[i-1]]
+                next_data = animation[channel][frames[i+1]]
+                for slot_name, value in animation[channel][frames[i]].items():
+                    if not value.get("use_local_displacements", False) and last_data.get(slot_name) == value and next_data.get(slot_name) == value:
+                        dropped.append((frames[i], slot_name))
+            for frame, slot_name in dropped:
+                del animation[channel][frame][slot_name]
+            for frame in frames:
+                if len(animation[channel][frame]) == 0:
+                    del animation[channel][frame]
+
     def create_animation_data(self, context):
-        animation = OrderedDict()
+        # animations are sampled and generated one by one as (name, data) pairs while the json file is written
         anim_collections = self.sprite_object.coa_anim_collections
+        deform_slots = self.get_deform_slots()
         for anim_index, anim in enumerate(anim_collections):
             if anim.name not in ["NO ACTION"]:
                 if anim.name == "Restpose":
@@ -621,6 +648,7 @@ class CreatureExport(bpy.types.Operator):
                 anim_name = anim.name if anim.name != "Restpose" else "default"
                 self.sprite_object.coa_anim_collections_index = anim_index  ### set animation
 
+                animation = OrderedDict()
                 animation[anim_name] = OrderedDict()
                 animation[anim_name]["bones"] = OrderedDict()
                 animation[anim_name]["meshes"] = OrderedDict()
@@ -636,20 +664,14 @@ class CreatureExport(bpy.types.Operator):
                             animation[anim_name]["coa_tools_events"][str(timeline_event.frame)].append({"type": event.type, "key": event.value})
 
 
-                for frame in range(anim.frame_end+1):
-
-                    context.scene.frame_set(frame)
+                ### the scene is evaluated once per frame. Which meshes need displacements is only known afterwards
+                frames = self.sample_animation(context, anim, anim_name, deform_slots)
+                self.mesh_deformed[anim_name] = self.get_deformed_meshes(anim_name)
 
+                for frame, frame_data in enumerate(frames):
                     # bone relevant data
-                    for pbone in self.armature.pose.bones:
-                        start_pt = self.get_bone_head_tail(pbone, local=False)["head"]
-                        end_pt = self.get_bone_head_tail(pbone, local=False)["tail"]
-
-                        bake_animation = self.scene.coa_export_bake_anim and frame%self.scene.coa_export_bake_steps == 0
-                        if str(frame) not in animation[anim_name]["bones"]:
-                            animation[anim_name]["bones"][str(frame)] = OrderedDict()
-                        animation[anim_name]["bones"][str(frame)][pbone.name] = {"start_pt": [round(start_pt.x, 3), round(start_pt.y, 3)],
-                                                                                 "end_pt": [round(end_pt.x, 3), round(end_pt.y, 3)]}
+                    if len(frame_data["bones"]) > 0:
+                        animation[anim_name]["bones"][str(frame)] = frame_data["bones"]
 
                     # mesh relevant data
                     animation[anim_name]["meshes"][str(frame)] = OrderedDict()
@@ -660,36 +682,35 @@ class CreatureExport(bpy.types.Operator):
 
                         for i, slot in enumerate(sprite.slots):
                             slot_name = sprite.name + "_" + str(i).zfill(3) if sprite_object.coa_type == "SLOT" else sprite.name
-                            if sprite.object.data != slot["slot"]:
-                                context.scene.update()
-                                sprite.object.data = slot["slot"]
+                            slot_data = frame_data["slots"][slot_name]
                             # collect shapekey animation
-                            use_local_displacements = True if anim_name in self.mesh_deformed and slot_name in self.mesh_deformed[anim_name] else False
+                            use_local_displacements = slot_name in self.mesh_deformed[anim_name]
                             use_post_displacements = False
                             animation[anim_name]["meshes"][str(frame)][slot_name] = {"use_dq": True}
                             animation[anim_name]["meshes"][str(frame)][slot_name]["use_local_displacements"] = use_local_displacements
                             animation[anim_name]["meshes"][str(frame)][slot_name]["use_post_displacements"] = use_post_displacements
 
                             if use_local_displacements:
-                                local_displacements = self.get_shapekey_vert_data(sprite.object, slot_name, sprite.object.data.vertices, anim, relative=True)
+                                local_displacements = self.get_shapekey_vert_data(slot["slot"], slot_name, slot_data, frame_data, anim_name, relative=True)
                                 animation[anim_name]["meshes"][str(frame)][slot_name]["local_displacements"] = local_displacements
                             if use_post_displacements:
-                                post_displacements = self.get_shapekey_vert_data(sprite.object, slot_name, sprite.object.data.vertices, anim, relative=True)
+                                post_displacements = self.get_shapekey_vert_data(slot["slot"], slot_name, slot_data, frame_data, anim_name, relative=True)
                                 animation[anim_name]["meshes"][str(frame)][slot_name]["post_displacements"] = post_displacements
 
                             # collect slot swapping data
                             enabled = True# if sprite.object.coa_type == "MESH" else True
-                            scale = [1, 1] if i == sprite_object.coa_slot_index else [-1, -1]
+                            scale = [1, 1] if slot_data["active"] else [-1, -1]
                             animation[anim_name]["uv_swaps"][str(frame)][slot_name] = {"local_offset": [0, 0], "global_offset": [0, 0], "scale": scale, "enabled": enabled}
 
                             # collect mesh opacity and tint data
-                            animation[anim_name]["mesh_opacities"][str(frame)][slot_name] = {"opacity": round(sprite_object.coa_alpha*100, 1)}
-
+                            animation[anim_name]["mesh_opacities"][str(frame)][slot_name] = {"opacity": slot_data["opacity"]}
 
-                    self.export_progress_current += 1
-                    current_progress = self.export_progress_current/self.export_progress_total
-                    context.window_manager.progress_update(current_progress)
-        return animation
+                if self.scene.coa_export_reduce_keys:
+                    self.reduce_bone_frames(animation[anim_name]["bones"])
+                    self.reduce_mesh_displacements(animation[anim_name]["meshes"])
+                if self.scene.coa_export_delta_frames:
+                    self.delta_encode_slot_frames(animation[anim_name])
+                yield anim_name, animation[anim_name]
 
     def write_json_file(self):
         # get export, project and json path
@@ -697,27 +718,39 @@ class CreatureExport(bpy.types.Operator):
         json_path = os.path.join(export_path, self.project_name + "_data.json")
         zip_path = os.path.join(export_path, self.project_name + "_data.zip")
 
-        # write json file
-        if self.reduce_size:
-            json_file = json.dumps(self.json_data, separators=(',', ':'))
-        else:
-            json_file = json.dumps(self.json_data, indent="  ", sort_keys=False)
-
-        text_file = open(json_path, "w")
-        text_file.write(json_file)
-        text_file.close()
-
-        zip_file = zipfile.ZipFile(zip_path, 'w', zipfile.ZIP_DEFLATED)
-        zip_file.write(json_path, os.path.basename(json_path))
-        zip_file.close()
-
-    def save_texture_atlas(self, context, img_atlas, img_path, atlas_name):
-        context.scene.render.image_settings.color_mode = "RGBA"
-        compression_rate = int(context.scene.render.image_settings.compression)
-        context.scene.render.image_settings.compression = 100
+        # the json data is serialized once and streamed into the zip entry and the optional loose json file.
+        # animations are sampled while writing, so both files are written under a temporary name and only replace the
+        # previous export once they are complete
+        zip_temp_path = zip_path + ".tmp"
+        json_temp_path = json_path + ".tmp"
+        json_file = open(json_temp_path, "w") if self.scene.coa_export_json_file else None
+        success = False
+        try:
+            with ZipStreamWriter(zip_temp_path, level=self.scene.coa_export_zip_compression) as zip_file:
+                files = [zip_file.open(os.path.basename(json_path))]
+                if json_file != None:
+                    files.append(json_file)
+                write_json(WriterTee(files), self.json_data, minify=self.reduce_size, indent="  ")
+            success = True
+        finally:
+            if json_file != None:
+                json_file.close()
+                if not success:
+                    os.remove(json_temp_path)
+        os.replace(zip_temp_path, zip_path)
+        if json_file != None:
+            os.replace(json_temp_path, json_path)
+
+    def save_texture_atlas(self, context, atlas, img_path, atlas_name):
         texture_path = os.path.join(img_path, atlas_name + "_atlas.png")
-        img_atlas.save_render(texture_path)
-        context.scene.render.image_settings.compression = compression_rate
+        self.image_writer.add_pixels(texture_path, atlas.pixels)
+
+        ### the mesh uvs are relative, so atlas variants only need downsampled pixels
+        for variant_scale in get_variant_scales(self.scene.coa_atlas_variant_scales):
+            width = max(1, int(round(atlas.width * variant_scale)))
+            height = max(1, int(round(atlas.height * variant_scale)))
+            texture_path = os.path.join(img_path, atlas_name + "_atlas" + get_variant_suffix(variant_scale) + ".png")
+            self.image_writer.add_pixels(texture_path, TextureAtlasGenerator.downsample_pixels(atlas.pixels, width, height))
 
     def setup_progress(self, context):
         self.export_progress_total = 0
@@ -735,8 +768,11 @@ class CreatureExport(bpy.types.Operator):
 
     def execute(self, context):
         self.reduce_size = context.scene.coa_minify_json
-        bpy.ops.ed.undo_push(message="Start Export")
-        bpy.ops.ed.undo_push(message="Start Export")
+        ### undo is not available in background mode. Scene changes are discarded anyways when blender exits
+        use_undo = not bpy.app.background
+        if use_undo:
+            bpy.ops.ed.undo_push(message="Start Export")
+            bpy.ops.ed.undo_push(message="Start Export")
         self.json_data = self.setup_json_data()
         self.scene = context.scene
 
@@ -753,50 +789,79 @@ class CreatureExport(bpy.types.Operator):
         # collect sprite data and armature for later usage
         self.sprite_data, self.armature = self.prepare_armature_and_sprites_for_export(context, scene)
         # do precalculations to check various things. makes the exporter overall faster
-        self.bone_scaled = self.check_and_store_bone_scaling(context)
+        self.bone_indices = get_bone_index_map(self.armature) ### bone name -> index lookup used for weight export
         self.bone_weights = self.store_bone_weights()
-        self.mesh_deformed = self.check_mesh_deformation(context)
+
+        ### sample the on-screen size of all sprites, so the atlas only stores the visible texture resolution
+        screen_densities = None
+        if self.scene.coa_atlas_resolution_planning:
+            screen_densities = get_sprite_screen_densities(context, self.sprite_object, [sprite.object for sprite in self.sprite_data], self.armature)
+            if screen_densities == None:
+                self.report({"WARNING"}, "Resolution planning needs a scene camera. Sprites are exported at the sprite output scale.")
 
         self.sprite_object.coa_anim_collections_index = 0
         self.setup_progress(context)
         for ob in context.scene.objects:
             ob.select = False
         atlas_objects = self.create_dupli_atlas_objects(context)
+        max_scales = None
+        if screen_densities != None:
+            atlas_densities = {ob.name: screen_densities.get(ob["coa_sprite_object_name"]) for ob in atlas_objects}
+            max_scales = get_max_texture_scales(atlas_objects, atlas_densities, self.scene.coa_atlas_quality_margin)
 
         # generate and save atlas data
+        if self.scene.coa_atlas_multi_page:
+            self.report({"WARNING"}, "The Creature export does not support Multi Page Atlas. All sprites are packed into one atlas page.")
         width = self.scene.coa_atlas_resolution_x if self.scene.coa_atlas_mode == "LIMIT_SIZE" else 16384
         height = self.scene.coa_atlas_resolution_y if self.scene.coa_atlas_mode == "LIMIT_SIZE" else 16384
-        img_atlas, merged_atlas_obj, atlas = TextureAtlasGenerator.generate_uv_layout(
-            name="COA_UV_ATLAS",
-            objects=atlas_objects,
-            width=2,
-            height=2,
-            max_width=width,
-            max_height=height,
-            margin=self.scene.coa_atlas_island_margin,
-            texture_bleed=self.scene.coa_export_texture_bleed,
-            square=self.scene.coa_export_square_atlas,
-            output_scale=self.sprite_scale
-        )
-
-        self.save_texture_atlas(context, img_atlas, self.export_path, self.project_name)
-
-        # collect all relevant json data for export
-        points, uvs, indices = self.create_mesh_data(context, merged_atlas_obj)
-        self.json_data["mesh"]["points"] = points
-        self.json_data["mesh"]["uvs"] = uvs
-        self.json_data["mesh"]["indices"] = indices
-        self.json_data["mesh"]["regions"] = self.create_region_data(context, merged_atlas_obj)
-        self.json_data["skeleton"] = self.create_skeleton_data()
-        self.json_data["animation"] = self.create_animation_data(context)
-
-
-        self.write_json_file()
+        try:
+            img_atlas, merged_atlas_obj, atlas = TextureAtlasGenerator.generate_uv_layout(
+                name="COA_UV_ATLAS",
+                objects=atlas_objects,
+                width=2,
+                height=2,
+                max_width=width,
+                max_height=height,
+                margin=self.scene.coa_atlas_island_margin,
+                texture_bleed=self.scene.coa_export_texture_bleed,
+                square=self.scene.coa_export_square_atlas,
+                output_scale=self.sprite_scale,
+                algorithm=self.scene.coa_atlas_packing,
+                scale_precision=self.scene.coa_atlas_scale_precision,
+                allow_rotation=self.scene.coa_atlas_allow_rotation,
+                max_scales=max_scales
+            )
+        except ValueError as error:
+            ### the textures do not fit into the max atlas size at any scale
+            if use_undo:
+                bpy.ops.ed.undo()
+            else:
+                for ob in atlas_objects:
+                    bpy.data.objects.remove(ob, do_unlink=True)
+            context.window_manager.progress_end()
+            self.report({"ERROR"}, str(error))
+            return {"CANCELLED"}
+
+        ### the atlas png is encoded in the background while the animation data is exported. Leaving the block waits for it
+        with ImageWriter(compression=self.scene.coa_export_png_compression) as self.image_writer:
+            self.save_texture_atlas(context, atlas, self.export_path, self.project_name)
+
+            # collect all relevant json data for export
+            points, uvs, indices = self.create_mesh_data(context, merged_atlas_obj)
+            self.json_data["mesh"]["points"] = points
+            self.json_data["mesh"]["uvs"] = uvs
+            self.json_data["mesh"]["indices"] = indices
+            self.json_data["mesh"]["regions"] = self.create_region_data(context, merged_atlas_obj)
+            self.json_data["skeleton"] = self.create_skeleton_data()
+            self.json_data["animation"] = JsonDictStream(self.create_animation_data(context))
+
+            self.write_json_file()
 
         # cleanup scene and add an undo history step
-        bpy.ops.ed.undo()
-        bpy.ops.ed.undo_push(message="Export Creature")
-        self.report({"INFO"}, "Export successful.")
+        if use_undo:
+            bpy.ops.ed.undo()
+            bpy.ops.ed.undo_push(message="Export Creature")
+        self.report({"INFO"}, "Export successful. Atlas occupancy: " + str(round(atlas.occupancy * 100, 1)) + "%")
 
         context.window_manager.progress_end()
         return {"FINISHED"}
@@ -20,7 +20,6 @@ Created by Andreas Esau
 '''
 
 import bpy
-import bmesh
 import json
 from bpy.props import FloatProperty, IntProperty, BoolProperty, StringProperty, CollectionProperty, FloatVectorProperty, EnumProperty, IntVectorProperty
 from collections import OrderedDict
@@ -29,6 +28,12 @@ import math
 from mathutils import Vector,Matrix, Quaternion, Euler
 import shutil
 from . texture_atlas_generator import TextureAtlasGenerator
+from . atlas_packer import PACKING_ALGORITHMS
+from . binary_writer import write_binary
+from . image_writer import ImageWriter
+from . resolution_planner import get_sprite_screen_densities, get_max_texture_scales
+from . export_helper import KeyframeIndex, ShapeKeyMixCache, ExportCache, JsonStream, write_json, reduce_keyframes, get_data_hash, get_variant_scales, get_variant_suffix, get_vertex_coords, get_export_vertex_indices, get_bone_index_map, get_vertex_group_arrays, get_group_bone_indices
+import numpy as np
 
 json_data = OrderedDict({
             "info":"Generated with COA Tools",
@@ -95,6 +100,20 @@ vert_coords_default = {}
 tex_pathes = {}
 img_names = {} ### exported image names
 tmp_slots_data = {}
+binary_output = False
+SKIN_CACHE_VERSION = 1 ### increase whenever the generated skin data changes
+
+### json output is rounded to keep files small. Binary output stores float32 values and keeps their full precision
+def round_value(value, digits):
+    if binary_output:
+        return float(np.float32(value))
+    return round(value, digits)
+
+### keyframe values are compared at the json precision, so float noise of full precision binary values does not add keys
+def key_values_differ(last_values, values, digits):
+    if last_values == None or len(last_values) != len(values):
+        return True
+    return any(round(last_value, digits) != round(value, digits) for last_value, value in zip(last_values, values))
 
 def setup_armature_data(root_bone):
     armature_data = OrderedDict({
@@ -160,121 +179,145 @@ def copy_textures(self,sprites,texture_dir_path):
                     if os.path.isfile(src_path):
                         shutil.copyfile(src_path,dst_path)
                     else:
-                        img.save_render(dst_path)
-
-
-
-def remove_base_sprite(obj):
-    bpy.context.scene.objects.active = obj
-    obj.hide = False
-    bpy.ops.object.mode_set(mode="EDIT")
-    bm = bmesh.from_edit_mesh(obj.data)
-    bm.verts.ensure_lookup_table()
-    verts = []
-
-    if "coa_base_sprite" in obj.vertex_groups and obj.data.coa_hide_base_sprite:
-        v_group_idx = obj.vertex_groups["coa_base_sprite"].index
-        for i,vert in enumerate(obj.data.vertices):
-            for g in vert.groups:
-                if g.group == v_group_idx:
-                    verts.append(bm.verts[i])
-                    break
-
-    bpy.ops.mesh.reveal()
-    bpy.ops.mesh.select_all(action='SELECT')
-    bpy.ops.mesh.quads_convert_to_tris(quad_method='BEAUTY', ngon_method='BEAUTY')
-
-
-    bmesh.ops.delete(bm,geom=verts,context=1)
-    bm = bmesh.update_edit_mesh(obj.data)
-    bpy.ops.object.mode_set(mode="OBJECT")
+                        self.image_writer.add_image(dst_path, img)
 
 
 
 ##### get mesh data like vertices, edges, triangles and uvs   ##### Start
 
-def get_mixed_vertex_data(obj):
-    shapes = obj.data.shape_keys
-    verts = []
-    index = int(obj.active_shape_key_index)
-    shape_key = obj.shape_key_add("tmp_mixed_mesh",from_mix=True)
-    for vert in shape_key.data:
-        coord = obj.matrix_world * vert.co
-        verts.append([vert.co[0],vert.co[1],vert.co[2]])
-    obj.shape_key_remove(shape_key)
-    obj.active_shape_key_index = index
-    return verts
+### triangulates a polygon given by its 2d points. returns triangles as index triples in the winding order of the polygon
+def triangulate_polygon(points):
+    def cross(o, a, b):
+        return (a[0]-o[0])*(b[1]-o[1]) - (a[1]-o[1])*(b[0]-o[0])
+    def distance(a, b):
+        return math.hypot(a[0]-b[0], a[1]-b[1])
+
+    count = len(points)
+    if count == 3:
+        return [(0, 1, 2)]
+    if count == 4:
+        ### split along the shorter diagonal
+        if distance(points[0], points[2]) <= distance(points[1], points[3]):
+            return [(0, 1, 2), (0, 2, 3)]
+        return [(0, 1, 3), (1, 2, 3)]
+
+    ### ear clipping for ngons
+    area = 0.0
+    for i in range(count):
+        area += points[i-1][0]*points[i][1] - points[i][0]*points[i-1][1]
+    orientation = 1.0 if area >= 0 else -1.0
+    indices = list(range(count))
+    triangles = []
+    def is_ear(a, b, c):
+        if cross(points[a], points[b], points[c]) * orientation <= 0:
+            return False
+        for j in indices:
+            if j not in (a, b, c):
+                p = points[j]
+                if cross(points[a], points[b], p) * orientation >= 0 and cross(points[b], points[c], p) * orientation >= 0 and cross(points[c], points[a], p) * orientation >= 0:
+                    return False
+        return True
+    while len(indices) > 3:
+        for i in range(len(indices)):
+            a, b, c = indices[i-1], indices[i], indices[(i+1) % len(indices)]
+            if is_ear(a, b, c):
+                triangles.append((a, b, c))
+                indices.pop(i)
+                break
+        else:
+            ### degenerated polygon. fall back to a fan
+            for i in range(1, len(indices)-1):
+                triangles.append((indices[0], indices[i], indices[i+1]))
+            return triangles
+    triangles.append(tuple(indices))
+    return triangles
+
+### reads all mesh data that is needed for a display in bulk. No mode switches and no mesh copies needed
+def get_mesh_arrays(obj, mesh):
+    vert_indices = get_export_vertex_indices(obj, mesh)
+    vert_count = len(vert_indices)
+    remap = np.full(len(mesh.vertices), -1, dtype=np.int64)
+    remap[vert_indices] = np.arange(vert_count)
+
+    loop_verts = np.empty(len(mesh.loops), dtype=np.int64)
+    mesh.loops.foreach_get("vertex_index", loop_verts)
+    loop_starts = np.empty(len(mesh.polygons), dtype=np.int64)
+    mesh.polygons.foreach_get("loop_start", loop_starts)
+    loop_totals = np.empty(len(mesh.polygons), dtype=np.int64)
+    mesh.polygons.foreach_get("loop_total", loop_totals)
+    coords = get_vertex_coords(mesh.vertices, len(mesh.vertices))
+
+    ### triangulate all faces that do not contain skipped vertices
+    triangles = []
+    for loop_start, loop_total in zip(loop_starts.tolist(), loop_totals.tolist()):
+        face_loop_verts = loop_verts[loop_start:loop_start+loop_total]
+        face_verts = remap[face_loop_verts]
+        if (face_verts < 0).any():
+            continue
+        if loop_total == 3:
+            triangles.append(face_verts)
+        else:
+            points = coords[face_loop_verts][:, [0, 2]].tolist()
+            for triangle in triangulate_polygon(points):
+                triangles.append(face_verts[list(triangle)])
+    triangles = np.array(triangles, dtype=np.int64).reshape(-1, 3)
+
+    ### edges are encoded as single keys. boundary edges are used by exactly one triangle, all others are user edges
+    def get_edge_keys(edges):
+        edges = np.sort(edges, axis=1)
+        return edges[:, 0] * max(1, vert_count) + edges[:, 1]
+    tri_edge_keys, tri_edge_count = np.unique(get_edge_keys(np.concatenate([triangles[:, [0, 1]], triangles[:, [1, 2]], triangles[:, [2, 0]]])), return_counts=True)
+    mesh_edges = np.empty(len(mesh.edges)*2, dtype=np.int64)
+    mesh.edges.foreach_get("vertices", mesh_edges)
+    mesh_edges = remap[mesh_edges].reshape(-1, 2)
+    mesh_edges = mesh_edges[(mesh_edges >= 0).all(axis=1)]
+    wire_edge_keys = np.setdiff1d(get_edge_keys(mesh_edges), tri_edge_keys)
+    edge_keys = tri_edge_keys[tri_edge_count == 1]
+    user_edge_keys = np.union1d(tri_edge_keys[tri_edge_count != 1], wire_edge_keys)
+
+    ### get uv of the first loop of each vertex
+    uvs = np.zeros((vert_count, 2), dtype=np.float64)
+    if mesh.uv_layers.active != None:
+        loop_uvs = np.empty(len(mesh.loops)*2, dtype=np.float64)
+        mesh.uv_layers.active.data.foreach_get("uv", loop_uvs)
+        loop_uvs = loop_uvs.reshape(-1, 2)
+        first_loops = np.full(len(mesh.vertices), -1, dtype=np.int64)
+        first_loops[loop_verts[::-1]] = np.arange(len(loop_verts))[::-1]
+        first_loops = first_loops[vert_indices]
+        uvs[first_loops >= 0] = loop_uvs[first_loops[first_loops >= 0]]
+
+    return {"vert_indices": vert_indices,
+            "triangles": triangles,
+            "edges": np.stack([edge_keys // max(1, vert_count), edge_keys % max(1, vert_count)], axis=1),
+            "user_edges": np.stack([user_edge_keys // max(1, vert_count), user_edge_keys % max(1, vert_count)], axis=1),
+            "uvs": uvs}
 
 ### get vertices information
 def convert_vertex_data_to_pixel_space(verts):
-    data = []
-    for vert in verts:
-        for i,coord in enumerate(vert):
-            if i in [0,2]:
-                multiplier = 1
-                if i == 2:
-                    multiplier = -1
-                value = round(multiplier*coord*100,2)
-                data.append(value)
-    return data
-
-### get edge information
-def get_edge_data(bm,only_outer_edges=True):
-    edges = []
-    for edge in bm.edges:
-            if (edge.is_boundary and only_outer_edges) or (not edge.is_boundary and not only_outer_edges):
-                for i,vert in enumerate(edge.verts):
-                    edges.append(vert.index)
-    return edges
-
-### get triangle information
-def get_triangle_data(bm):
-    triangles = []
-    for face in bm.faces:
-        for i,vert in enumerate(face.verts):
-            triangles.append(vert.index)
-    return triangles
+    verts = np.asarray(verts, dtype=np.float64).reshape(-1, 3)
+    data = np.empty((len(verts), 2), dtype=np.float64)
+    data[:, 0] = verts[:, 0]*100
+    data[:, 1] = -1*verts[:, 2]*100
+    return [round_value(value, 2) for value in data.ravel().tolist()]
 
-### get mesh vertex corrseponding uv vertex
-def uv_from_vert_first(uv_layer, v):
-    for l in v.link_loops:
-        uv_data = l[uv_layer]
-        return uv_data.uv
-    return None
+### get edge and triangle information
+def get_index_data(indices):
+    return indices.ravel().tolist()
 
 ### get uv information
-def get_uv_data(bm):
-    uvs = []
-    uv_layer = bm.loops.layers.uv.active
-
+def get_uv_data(uv_coords):
     ### first get the total dimensions of the uv
-    left = 0
-    top = 0
-    bottom = 1
-    right = 1
-    for vert in bm.verts:
-        uv_first = uv_from_vert_first(uv_layer, vert)
-        for i, val in enumerate(uv_first):
-            if i == 0:
-                left = max(left, val)
-                right = min(right, val)
-            else:
-                top = max(top, val)
-                bottom = min(bottom, val)
+    left = max(0, float(uv_coords[:, 0].max())) if len(uv_coords) > 0 else 0
+    right = min(1, float(uv_coords[:, 0].min())) if len(uv_coords) > 0 else 1
+    top = max(0, float(uv_coords[:, 1].max())) if len(uv_coords) > 0 else 0
+    bottom = min(1, float(uv_coords[:, 1].min())) if len(uv_coords) > 0 else 1
     height = top - bottom
     width = left - right
     ### get uv coordinates and map them from 0 to 1 to total dimension that have been calculated before
-    for vert in bm.verts:
-        uv_first = uv_from_vert_first(uv_layer, vert)
-        for i,val in enumerate(uv_first):
-            if i == 1:
-                value = -val + height
-                final_value = round((value + bottom) / height, 3)
-                uvs.append(final_value)
-            else:
-                value = val
-                final_value = round((value - right)/width, 3)
-                uvs.append(final_value)
+    uvs = []
+    for u, v in uv_coords.tolist():
+        uvs.append(round_value((u - right)/width, 3))
+        uvs.append(round_value((-v + height + bottom) / height, 3))
     return uvs
 
 def get_modulate_color(sprite):
@@ -285,22 +328,18 @@ def get_modulate_color(sprite):
 
 ##### get mesh data like vertices, edges, triangles and uvs   ##### End
 
-def get_bone_with_most_influence(self, sprite):
-    vertex_groups = sprite.vertex_groups
-    max_weight = 0
-    bone = None
-    for v_group in vertex_groups:
-        if v_group.name in self.armature.data.bones:
-            total_weight = 0
-            for i,vert in enumerate(sprite.data.vertices):
-                try:
-                    total_weight += v_group.weight(vert.index)
-                except:
-                    pass
-            if total_weight > max_weight:
-                max_weight = float(total_weight)
-                bone = self.armature.data.bones[v_group.name]
-    return bone
+def get_bone_with_most_influence(self, sprite, mesh=None):
+    mesh = sprite.data if mesh == None else mesh
+    rows, groups, weights = get_vertex_group_arrays(mesh)
+    group_bones = get_group_bone_indices(sprite, self.bone_indices)
+    if len(groups) == 0 or len(group_bones) == 0:
+        return None
+    total_weights = np.bincount(groups, weights=weights, minlength=len(group_bones))[:len(group_bones)]
+    total_weights[group_bones < 0] = 0
+    group_index = int(np.argmax(total_weights))
+    if total_weights[group_index] > 0:
+        return self.armature.data.bones[int(group_bones[group_index])]
+    return None
 
 ### get slot data
 def get_slot_data(self,sprites):
@@ -328,22 +367,6 @@ def get_slot_data(self,sprites):
                 slot["color"] = color
     return slot_data
 
-def normalize_weights(obj, armature, threshold):
-    for vert in obj.data.vertices:
-        weight_total = 0.0
-        groups = []
-        for group in vert.groups:
-            vgroup = obj.vertex_groups[group.group]
-            group_name = vgroup.name
-            if (group.weight > threshold and armature == None) or (group.weight > threshold and armature != None and group_name in armature.data.bones):
-                groups.append(group)
-
-        for group in groups:
-            vgroup = obj.vertex_groups[group.group]
-            weight_total += group.weight
-        for group in groups:
-            group.weight = 1*(group.weight/weight_total)
-
 ### get bone data
 def create_cleaned_armature_copy(self,armature,sprites):
     context = bpy.context
@@ -490,52 +513,69 @@ def bone_is_constraint_target(bone,armature):
 
 
 ### get skin data
+### hash of everything the display data of a skin slot is generated from
+def get_skin_slot_hash(self,sprite,sprite_data,scale,vert_coords):
+    mesh = sprite_data
+    sprite_data_name = sprite_data.name
+    loop_verts = np.empty(len(mesh.loops), dtype=np.int32)
+    mesh.loops.foreach_get("vertex_index", loop_verts)
+    loop_totals = np.empty(len(mesh.polygons), dtype=np.int32)
+    mesh.polygons.foreach_get("loop_total", loop_totals)
+    edges = np.empty(len(mesh.edges)*2, dtype=np.int32)
+    mesh.edges.foreach_get("vertices", edges)
+    uvs = np.empty(0, dtype=np.float32)
+    if mesh.uv_layers.active != None:
+        uvs = np.empty(len(mesh.loops)*2, dtype=np.float32)
+        mesh.uv_layers.active.data.foreach_get("uv", uvs)
+    rows, groups, weights = get_vertex_group_arrays(mesh)
+    mat, tex, img = get_sprite_image_data(sprite_data)
+
+    return get_data_hash(SKIN_CACHE_VERSION, sprite.name, mesh.name, scale, binary_output, self.scene.coa_export_image_mode, self.scene.coa_project_name,
+                         mesh.coa_hide_base_sprite, [v_group.name for v_group in sprite.vertex_groups],
+                         img.name if img != None else None, img.filepath if img != None else None, tuple(img.size) if img != None else None,
+                         img_names.get(sprite_data_name), atlas_data.get(sprite_data_name),
+                         np.array(sprite.matrix_local), np.array(sprite.matrix_world), self.armature_hash,
+                         vert_coords, loop_verts, loop_totals, edges, uvs, rows, groups, weights)
+
+def get_armature_hash(armature):
+    if armature == None:
+        return None
+    return get_data_hash([bone.name for bone in armature.data.bones], np.array([np.array(bone.matrix_local) for bone in armature.data.bones]))
+
 def get_skin_slot(self,sprite,armature,scale,slot_data=None):
     context = bpy.context
     sprite_name = str(sprite.name)
-    sprite_data_name = sprite.data.name if slot_data == None else slot_data.name
-    ### make a sprite duplicate and make it active
-    if slot_data == None:
-        sprite_data = sprite.data.copy()
-    else:
-        sprite_data = slot_data.copy()
-    sprite = sprite.copy()
-    sprite.data = sprite_data
-    self.scene.objects.link(sprite)
-    self.scene.objects.active = sprite
-
-    ### normalize weights
-    normalize_weights(sprite, armature, 0.0)
-    for area in context.screen.areas:
-            if area.type == "VIEW_3D":
-                for region in area.regions:
-                    override = context.copy()
-                    override["object"] = sprite
-                    override["edit_object"] = sprite
-                    #bpy.ops.object.vertex_group_clean(override, group_select_mode='BONE_DEFORM', keep_single=True)
-                    bpy.ops.object.vertex_group_clean(override, group_select_mode='ALL', keep_single=True)
-    ###
-
-    global tmp_sprites
-    tmp_slots_data[sprite_data_name] = {"data":sprite_data,"object":sprite,"name":sprite_data_name}
+    sprite_data = sprite.data if slot_data == None else slot_data
+    sprite_data_name = sprite_data.name
+
+    vert_indices = get_export_vertex_indices(sprite, sprite_data)
+    vert_coords = self.shape_key_cache.get_mixed_vertex_data(sprite, sprite_data)
+    vert_coords_default[sprite_data_name] = vert_coords[vert_indices]
+
+    tmp_slots_data[sprite_data_name] = {"data":sprite_data,"object":sprite,"name":sprite_data_name,"vert_indices":vert_indices}
 
     ### get sprite material, texture and img data
     mat, tex, img = get_sprite_image_data(sprite_data)
     tex_path = os.path.join(self.scene.coa_project_name+"_texture" , img_names[sprite_data_name])
     tex_pathes[sprite_name] = tex_path
-    ### delete basesprite mesh in sprite duplicate
-    remove_base_sprite(sprite)
 
-    ### get display data of a sprite
-    bpy.ops.object.mode_set(mode="EDIT")
-    bm = bmesh.from_edit_mesh(sprite.data)
+    ### unchanged slots are served from the skin cache
+    if self.skin_cache != None:
+        cache_key = get_skin_slot_hash(self,sprite,sprite_data,scale,vert_coords)
+        display_data = self.skin_cache.get(cache_key)
+        if display_data != None:
+            return display_data
+
+    ### read all mesh data at once. The hidden base sprite is skipped and faces are triangulated in memory
+    mesh_arrays = get_mesh_arrays(sprite, sprite_data)
+    vert_count = len(vert_indices)
 
     ### generate display data dictionary
     display_data = OrderedDict()
 
     ### get general skin information
     display_data["name"] = sprite_data_name#sprite_name
-    if len(sprite.data.vertices) != 4:
+    if vert_count != 4:
         display_data["type"] = "mesh"
         if self.scene.coa_export_image_mode == "IMAGES":
             display_data["path"] = img_names[sprite_data_name]
@@ -547,23 +587,20 @@ def get_skin_slot(self,sprite,armature,scale,slot_data=None):
             display_data["width"] = atlas_data[sprite_data_name]["width"]
             display_data["height"] = atlas_data[sprite_data_name]["height"]
 
-        verts = get_mixed_vertex_data(sprite)
-        vert_coords_default[sprite_name] = verts
-        display_data["vertices"] = convert_vertex_data_to_pixel_space(verts)
+        display_data["vertices"] = convert_vertex_data_to_pixel_space(vert_coords_default[sprite_data_name])
 
-        bm = bmesh.from_edit_mesh(sprite.data)
-        display_data["userEdges"] = get_edge_data(bm,only_outer_edges=False)
-        display_data["edges"] = get_edge_data(bm)
-        display_data["triangles"] = get_triangle_data(bm)
-        display_data["uvs"] = get_uv_data(bm)
+        display_data["userEdges"] = get_index_data(mesh_arrays["user_edges"])
+        display_data["edges"] = get_index_data(mesh_arrays["edges"])
+        display_data["triangles"] = get_index_data(mesh_arrays["triangles"])
+        display_data["uvs"] = get_uv_data(mesh_arrays["uvs"])
 
     if armature != None:
         armature.data.pose_position = "REST"
         bpy.context.scene.update()
 
-        if len(sprite.data.vertices) != 4:
+        if vert_count != 4:
             ### write mesh bone data
-            weights, bones = get_bone_weight_data(self,sprite,armature)
+            weights, bones = get_bone_weight_data(self,sprite,sprite_data,armature,vert_indices)
 
             display_data["weights"] = weights
 
@@ -571,26 +608,26 @@ def get_skin_slot(self,sprite,armature,scale,slot_data=None):
             for bone in bones:
                 mat = get_bone_matrix(armature,bone["bone"],relative=False)
                 display_data["bonePose"].append(bone["index"]+1)
-                display_data["bonePose"].append(round(mat[0][0],3))
-                display_data["bonePose"].append(round(mat[0][1],3))
-                display_data["bonePose"].append(round(mat[1][0],3))
-                display_data["bonePose"].append(round(mat[1][1],3))
-                display_data["bonePose"].append(round(mat[1][3] * scale ,3))#pos x
-                display_data["bonePose"].append(round(-mat[0][3] *scale ,3))#pos y
+                display_data["bonePose"].append(round_value(mat[0][0],3))
+                display_data["bonePose"].append(round_value(mat[0][1],3))
+                display_data["bonePose"].append(round_value(mat[1][0],3))
+                display_data["bonePose"].append(round_value(mat[1][1],3))
+                display_data["bonePose"].append(round_value(mat[1][3] * scale ,3))#pos x
+                display_data["bonePose"].append(round_value(-mat[0][3] *scale ,3))#pos y
             armature.data.pose_position = "POSE"
             bpy.context.scene.update()
 
-            w = round(sprite.matrix_local[0][0], 3)
-            x = round(sprite.matrix_local[0][2], 3)
-            y = round(sprite.matrix_local[2][0], 3)
-            z = round(sprite.matrix_local[2][2], 3)
-            sca_x = round(sprite.matrix_local.to_translation()[0]*scale, 3)
-            sca_y = round(-sprite.matrix_local.to_translation()[2]*scale, 3)
+            w = round_value(sprite.matrix_local[0][0], 3)
+            x = round_value(sprite.matrix_local[0][2], 3)
+            y = round_value(sprite.matrix_local[2][0], 3)
+            z = round_value(sprite.matrix_local[2][2], 3)
+            sca_x = round_value(sprite.matrix_local.to_translation()[0]*scale, 3)
+            sca_y = round_value(-sprite.matrix_local.to_translation()[2]*scale, 3)
             display_data["slotPose"] = [w,x,y,z, sca_x, sca_y]
         else:
             ### write sprite bone data
-            bone = get_bone_with_most_influence(self, sprite)
-            sprite_center_pos = get_mesh_center(sprite, 1.0)
+            bone = get_bone_with_most_influence(self, sprite, sprite_data)
+            sprite_center_pos = get_mesh_center(sprite, get_vertex_coords(sprite_data.vertices, len(sprite_data.vertices))[vert_indices], 1.0)
             if bone != None:
                 bone_pos = get_bone_matrix(self.armature, bone, relative=False).to_translation()
                 p_bone = self.armature.pose.bones[bone.name]
@@ -602,20 +639,19 @@ def get_skin_slot(self,sprite,armature,scale,slot_data=None):
                 angle = 0
 
             display_data["transform"] = OrderedDict()
-            display_data["transform"]["x"] = round(sprite_pos_final.y,3)
-            display_data["transform"]["y"] = round(-sprite_pos_final.x,3)
+            display_data["transform"]["x"] = round_value(sprite_pos_final.y,3)
+            display_data["transform"]["y"] = round_value(-sprite_pos_final.x,3)
 
 
             if angle != 0:
-                display_data["transform"]["skX"] = -round(angle, 2)
-                display_data["transform"]["skY"] = -round(angle, 2)
+                display_data["transform"]["skX"] = -round_value(angle, 2)
+                display_data["transform"]["skY"] = -round_value(angle, 2)
             if atlas_data[sprite_data_name]["output_scale"] != 1.0:
-                display_data["transform"]["scX"] = round(1.0 / atlas_data[sprite_data_name]["output_scale"], 2)
-                display_data["transform"]["scY"] = round(1.0 / atlas_data[sprite_data_name]["output_scale"], 2)
-
-    bpy.ops.object.mode_set(mode="OBJECT")
+                display_data["transform"]["scX"] = round_value(1.0 / atlas_data[sprite_data_name]["output_scale"], 2)
+                display_data["transform"]["scY"] = round_value(1.0 / atlas_data[sprite_data_name]["output_scale"], 2)
 
-    #bpy.data.objects.remove(sprite,do_unlink=True)
+    if self.skin_cache != None:
+        self.skin_cache.set(cache_key, display_data)
     return display_data
 
 
@@ -653,7 +689,8 @@ def get_driver_bone_target(driver):
             targets.append(v.targets[0].bone_target)
     return targets
 
-def get_bone_matrix(armature,bone,relative=True):
+### remaps the pose matrix of a bone into the dragonbones bone space
+def calc_bone_matrix(armature,bone,relative=True):
     pose_bone = armature.pose.bones[bone.name]
 
     m = Matrix() ### inverted posebone origin matrix
@@ -666,12 +703,7 @@ def get_bone_matrix(armature,bone,relative=True):
         mat_bone_space = m * pose_bone.matrix
     else:
         if relative:
-            #if bone.use_inherit_rotation and bone.use_inherit_scale:
-            # mat_bone_space = pose_bone.parent.matrix.inverted() * pose_bone.matrix
-            mat_bone_space = pose_bone.matrix
-            for parent in pose_bone.parent_recursive:
-                pose_bone_matrix = parent.matrix.inverted() * mat_bone_space
-                mat_bone_space = pose_bone.parent.matrix.inverted() * pose_bone.matrix
+            mat_bone_space = pose_bone.parent.matrix.inverted() * pose_bone.matrix
         else:
             mat_bone_space = m * pose_bone.matrix
     #### remap matrix
@@ -691,34 +723,55 @@ def get_bone_matrix(armature,bone,relative=True):
     mat_bone_space = loc_mat * rot_mat * scale_mat
     return mat_bone_space
 
-def get_mesh_center(sprite, scale):
-    average_vert = Vector((0,0,0))
-    for i,vert in enumerate(sprite.data.vertices):
-        average_vert += vert.co
-    average_vert /= len(sprite.data.vertices)
+class BonePoseCache:
+    ### bone space matrix and its decomposition of every bone, evaluated once for the current frame and pose position of an armature
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self.state = None
+        self.poses = {}
+
+    def get_pose(self,armature,bone,relative=True):
+        state = (bpy.context.scene.frame_current, armature.name, armature.data.pose_position)
+        if state != self.state:
+            self.state = state
+            self.poses = {}
+
+        relative = relative and bone.parent != None ### root bones are the same in both spaces
+        key = (bone.name, relative)
+        if key not in self.poses:
+            mat = calc_bone_matrix(armature,bone,relative)
+            loc, rot, scale = mat.decompose()
+            pose = {}
+            pose["matrix"] = mat
+            pose["loc"] = loc
+            pose["angle"] = -round_value(math.degrees(rot.to_euler().z),2)
+            pose["scale"] = scale
+            self.poses[key] = pose
+        return self.poses[key]
+
+bone_pose_cache = BonePoseCache()
+
+def get_bone_matrix(armature,bone,relative=True):
+    return bone_pose_cache.get_pose(armature,bone,relative)["matrix"].copy()
+
+def get_mesh_center(sprite, coords, scale):
+    average_vert = Vector(np.asarray(coords).mean(axis=0).tolist())
     pos = (sprite.matrix_world * average_vert) * scale
-    pos_2d = Vector((pos[0], pos[2]))
     return pos
 
 def get_bone_pos(armature,bone,scale,relative=True):
-    loc, rot, sca = get_bone_matrix(armature, bone, relative).decompose()
+    loc = bone_pose_cache.get_pose(armature,bone,relative)["loc"]
 
     pos_2d = Vector((loc[1],-loc[0])) * scale # flip x and y and negate x to fit dragonbones coordinate system
     return pos_2d
 
 def get_bone_angle(armature,bone,relative=True):
-    loc, rot, scale = get_bone_matrix(armature,bone,relative).decompose()
-    rot_x = round(math.degrees(rot.to_euler().x),2)
-    rot_y = round(math.degrees(rot.to_euler().y),2)
-    rot_z = -round(math.degrees(rot.to_euler().z),2)
-#    if get_bone_scale(armature,bone)[0] < 0:
-#        rot_z = - rot_z
-    return rot_z
+    return bone_pose_cache.get_pose(armature,bone,relative)["angle"]
 
 def get_bone_scale(armature,bone,relative=True):
-    mat = get_bone_matrix(armature,bone)
-    loc, rot, scale = get_bone_matrix(armature, bone, relative).decompose()
-    return scale
+    return bone_pose_cache.get_pose(armature,bone,relative)["scale"].copy()
 
 def get_bone_data(self,armature,sprite_object,scale):
 
@@ -735,21 +788,21 @@ def get_bone_data(self,armature,sprite_object,scale):
         pos = get_bone_pos(armature,bone,scale)
         bone_default_pos[bone.name] = Vector(pos)
         if pos != Vector((0,0)):
-            data["transform"]["x"] = round(pos[0], 2)
-            data["transform"]["y"] = round(pos[1], 2)
+            data["transform"]["x"] = round_value(pos[0], 2)
+            data["transform"]["y"] = round_value(pos[1], 2)
 
         ### get bone angle    
         angle = get_bone_angle(armature,bone) if not bone_uses_constraints[pbone.name] else get_bone_angle(armature,bone,relative=False)
         bone_default_rot[bone.name] = angle
         if angle != 0:
-            data["transform"]["skX"] = round(angle, 2)
-            data["transform"]["skY"] = round(angle, 2)
+            data["transform"]["skX"] = round_value(angle, 2)
+            data["transform"]["skY"] = round_value(angle, 2)
 
         ### get bone scale
         sca = get_bone_scale(armature,bone) if not bone_uses_constraints[pbone.name] else get_bone_scale(armature,bone,relative=False)
         if sca != Vector((1.0,1.0,1.0)):
-            data["transform"]["scX"] = round(sca[0], 2)
-            data["transform"]["scY"] = round(sca[1], 2)
+            data["transform"]["scX"] = round_value(sca[0], 2)
+            data["transform"]["scY"] = round_value(sca[1], 2)
 
         if int(bone.use_inherit_rotation) != 1 or bone_uses_constraints[pbone.name]:
             data["inheritRotation"] = int(bone.use_inherit_rotation) if not bone_uses_constraints[pbone.name] else 0
@@ -767,108 +820,100 @@ def get_bone_data(self,armature,sprite_object,scale):
 
     return bone_data
 
-def get_bone_index(self,armature,bone_name):
-    armature_bones = []
-    for bone in armature.data.bones:
-        armature_bones.append(bone)
-
-    for i,bone in enumerate(armature_bones):
-        if bone_name == bone.name:
-            return i
+### get weight data. Weights of bone groups are normalized and groups without weight skipped
+def get_bone_weight_data(self,obj,mesh,armature,vert_indices):
+    vert_count = len(vert_indices)
+    rows, groups, weights = get_vertex_group_arrays(mesh, vert_indices)
+    group_bones = get_group_bone_indices(obj, self.bone_indices)
+    bone_indices = group_bones[groups] if len(groups) > 0 else np.zeros(0, dtype=np.int64)
+
+    is_bone = bone_indices >= 0
+    keep = is_bone & (weights > 0.0)
+
+    ### keep a single group assignment if all weights are zero
+    has_weight = np.bincount(rows[keep], minlength=vert_count) > 0
+    first_group = np.ones(len(rows), dtype=bool)
+    first_group[1:] = rows[1:] != rows[:-1]
+    zero_group = first_group & is_bone & ~has_weight[rows]
+    weights = np.where(zero_group, 0.0, weights)
+    keep |= zero_group
+
+    rows = rows[keep]
+    bone_indices = bone_indices[keep]
+    weights = weights[keep]
+
+    ### normalize weights per vertex
+    weight_total = np.bincount(rows, weights=weights, minlength=vert_count)[rows]
+    weights = np.where(weight_total > 0, weights / np.where(weight_total > 0, weight_total, 1.0), weights)
+
+    ### every vertex is written as [group count, bone index, weight, bone index, weight, ...]
+    group_count = np.bincount(rows, minlength=vert_count)
+    groups_before = np.cumsum(group_count) - group_count
+    count_pos = np.arange(vert_count) + 2 * groups_before
+    group_pos = count_pos[rows] + 1 + 2 * (np.arange(len(rows)) - groups_before[rows])
+
+    data = [0] * (vert_count + 2 * len(rows))
+    for pos, count in zip(count_pos.tolist(), group_count.tolist()):
+        data[pos] = count
+    for pos, bone_index in zip(group_pos.tolist(), (bone_indices + 1).tolist()):
+        data[pos] = bone_index
+    for pos, weight in zip((group_pos + 1).tolist(), [round_value(weight, 3) for weight in weights.tolist()]):
+        data[pos] = weight
 
-### get weight data
-def get_bone_weight_data(self,obj,armature):
-    data = []
-    bone_names = []
     bones = []
-    for vert in obj.data.vertices:
-        groups = []
-        for group in vert.groups:
-            group_name = obj.vertex_groups[group.group].name
-            if group_name in armature.data.bones:
-                groups.append({"group":group,"group_name":group_name})
-
-        data.append(len(groups))
-        for group in groups:
-            b_index = get_bone_index(self,armature,group["group_name"])
-            bone_index = b_index+1
-            data.append(bone_index)
-            bone_weight = round(group["group"].weight,3)
-            data.append(bone_weight)
-
-            if group["group_name"] not in bone_names:
-                bone_names.append(group["group_name"])
-
-    armature_bones = []
-    for bone in armature.data.bones:
-        armature_bones.append(bone)
-
-    for i,bone in enumerate(armature_bones):
-        if bone.name in bone_names:
-            bone = armature.data.bones[bone.name]
-            bones.append({"index":i,"bone":bone})
+    for i in np.unique(bone_indices).tolist():
+        bones.append({"index":i,"bone":armature.data.bones[i]})
     return data, bones
 
-### Export Animations
-### get objs and bones that are keyed on given frame    
-def bone_key_on_frame(bone,frame,animation_data,type="LOCATION"): ### LOCATION, ROTATION, SCALE, ANY
-    action = animation_data.action if animation_data != None else None
-    type = "."+type.lower()
-    if action != None:
-        for fcurve in action.fcurves:
-            if bone.name in fcurve.data_path and (type in fcurve.data_path or type == ".any"):
-                for keyframe in fcurve.keyframe_points:
-                    if keyframe.co[0] == frame:
-                        return True
-    return False
-
-def property_key_on_frame(obj,prop_names,frame,type="PROPERTY"):
-    if type == "SHAPEKEY":
-        obj = obj.shape_keys
-
-    if obj != None and obj.animation_data != None:
-    ### check if property has a key set
-        action = obj.animation_data.action
-        if action != None:
-            for fcurve in action.fcurves:
-                for prop_name in prop_names:
-                    if prop_name in fcurve.data_path:
-                        for keyframe in fcurve.keyframe_points:
-                            if keyframe.co[0] == frame:
-                                return True
-    ### check if property has a bone driver and bone has a key set
-        for driver in obj.animation_data.drivers:
-            for prop_name in prop_names:
-                if prop_name in driver.data_path:
-                    for var in driver.driver.variables:
-                        armature = var.targets[0].id
-                        if armature != None:
-                            bone_target = var.targets[0].bone_target
-                            if bone_target in armature.data.bones:
-                                bone = armature.data.bones[bone_target]
-                                pbone = armature.pose.bones[bone_target]
-                                key_on_frame = bone_key_on_frame(bone,frame,armature.animation_data,type="ANY")
-                                if key_on_frame:
-                                    return key_on_frame
-                                for const in pbone.constraints:
-                                    if const.type == "ACTION":
-                                        bone = armature.data.bones[const.subtarget] if const.subtarget in armature.data.bones else None
-                                        if bone != None:
-                                            key_on_frame = bone_key_on_frame(bone,frame,armature.animation_data,type="ANY")
-                                        if key_on_frame:
-                                            return key_on_frame
-    return False
-
+### drops keys of a track that the tween of the previous key reconstructs within tolerance and merges their durations
+def reduce_keyframe_track(track, value_names, tolerance, max_delta=None):
+    if len(track) <= 2 or any("curve" not in key for key in track):
+        return track
+    times = [0]
+    for key in track[:-1]:
+        times.append(times[-1] + key["duration"])
+    values = []
+    for key in track:
+        key_values = []
+        for name in value_names:
+            if type(key[name]) == list:
+                key_values += key[name]
+            else:
+                key_values.append(key[name])
+        values.append(key_values)
+    if len(set(len(key_values) for key_values in values)) > 1:
+        return track
+
+    keys = reduce_keyframes(times, values, tolerance, curves=[key["curve"] for key in track], max_delta=max_delta)
+    reduced_track = []
+    for i, key_index in enumerate(keys):
+        key = track[key_index]
+        if i < len(keys)-1:
+            key["duration"] = times[keys[i+1]] - times[key_index]
+        reduced_track.append(key)
+    return reduced_track
+
+def reduce_animation_data(self, anim_data):
+    pos_tolerance = self.scene.coa_export_reduce_tolerance_pos
+    rot_tolerance = self.scene.coa_export_reduce_tolerance_rot
+    scale_tolerance = self.scene.coa_export_reduce_tolerance_scale
+    for track in anim_data["bone"]:
+        track["translateFrame"] = reduce_keyframe_track(track["translateFrame"], ["x","y"], pos_tolerance)
+        track["rotateFrame"] = reduce_keyframe_track(track["rotateFrame"], ["rotate"], rot_tolerance, max_delta=180)
+        track["scaleFrame"] = reduce_keyframe_track(track["scaleFrame"], ["x","y"], scale_tolerance)
+    for track in anim_data["ffd"]:
+        track["frame"] = reduce_keyframe_track(track["frame"], ["vertices"], pos_tolerance)
+
+### Export Animations. Animations are generated one by one while the json file is written
 def get_animation_data(self,sprite_object,armature,armature_orig):
     context = bpy.context
     scale = 1/get_addon_prefs(context).sprite_import_export_scale
     anims = sprite_object.coa_anim_collections
 
-    animations = []
-
     for anim_index,anim in enumerate(anims):
         if anim.name not in ["NO ACTION","Restpose"]:
             sprite_object.coa_anim_collections_index = anim_index ### set animation
+            bone_pose_cache.clear() ### poses of the previous action are invalid now
 
             anim_data = animation_data.copy()
             anim_data["duration"] = anim.frame_end
@@ -879,6 +924,8 @@ def get_animation_data(self,sprite_object,armature,armature_orig):
             anim_data["zOrder"] = {}
             anim_data["ffd"] = []
 
+            ### collect all keyed frames of the current actions once. Per frame checks are simple lookups then
+            keyframe_index = KeyframeIndex()
 
             ### append all slots to list
             slot_keyframe_duration = {}
@@ -900,31 +947,27 @@ def get_animation_data(self,sprite_object,armature,armature_orig):
                             ffd_keyframe_duration[slot2.mesh.name] = {"ffd_duration":0}
                             ffd_last_frame_values[slot2.mesh.name] = None
 
-            ### check if slot has animation data. if so, store for later usage                
+            ### check if slot has shapekey animation. if so, store for later usage
             SHAPEKEY_ANIMATION = {}
-            for i in range(anim.frame_end+1):
-                frame = anim.frame_end-i
-                for slot in self.sprites:
-                    if slot.type == "MESH":
+            anim_frames = set(range(anim.frame_end+1))
+            for slot in self.sprites:
+                if slot.type == "MESH":
 
-                        slot_data = []
-                        if slot.coa_type == "MESH":
-                            slot_data = [tmp_slots_data[slot.data.name]]
-                        elif slot.coa_type == "SLOT":
-                            for slot2 in slot.coa_slot:
-                                slot_data.append(tmp_slots_data[slot2.mesh.name])
+                    slot_data = []
+                    if slot.coa_type == "MESH":
+                        slot_data = [tmp_slots_data[slot.data.name]]
+                    elif slot.coa_type == "SLOT":
+                        for slot2 in slot.coa_slot:
+                            slot_data.append(tmp_slots_data[slot2.mesh.name])
 
-                for item in slot_data:
-                    data = item["data"]
-                    data_name = item["name"]
+                    for item in slot_data:
+                        data = item["data"]
+                        data_name = item["name"]
 
-                    key_blocks = []
-                    if data.shape_keys != None:
-                        for key in data.shape_keys.key_blocks:
-                            key_blocks.append(key.name)
-                    if property_key_on_frame(data,key_blocks,frame,type="SHAPEKEY"):
-                        SHAPEKEY_ANIMATION[slot.name] = True
-                        break
+                        if data.shape_keys != None:
+                            key_blocks = [key.name for key in data.shape_keys.key_blocks]
+                            if not anim_frames.isdisjoint(keyframe_index.get_property_frames(data,key_blocks,type="SHAPEKEY")):
+                                SHAPEKEY_ANIMATION[data_name] = True
 
 
             ### append all bones to list
@@ -945,22 +988,22 @@ def get_animation_data(self,sprite_object,armature,armature_orig):
                         slot_keyframe_duration[slot.name]["color_duration"] += 1
                         slot_keyframe_duration[slot.name]["display_duration"] += 1
 
-                        if property_key_on_frame(slot,["coa_alpha","coa_modulate_color"],frame):
+                        if keyframe_index.property_key_on_frame(slot,["coa_alpha","coa_modulate_color"],frame):
 
                             keyframe_data = {}
                             keyframe_data["duration"] = slot_keyframe_duration[slot.name]["color_duration"]
                             keyframe_data["tweenEasing"] = 0
                             keyframe_data["value"] = get_modulate_color(slot)
 
-                            anim_data["slot"][j]["colorFrame"].insert(0,keyframe_data)
+                            anim_data["slot"][j]["colorFrame"].append(keyframe_data)
                             slot_keyframe_duration[slot.name]["color_duration"] = 0
 
-                        if property_key_on_frame(slot,["coa_slot_index"],frame) or frame in [0,anim.frame_end]:
+                        if keyframe_index.property_key_on_frame(slot,["coa_slot_index"],frame) or frame in [0,anim.frame_end]:
                             keyframe_data = {}
                             keyframe_data["duration"] = slot_keyframe_duration[slot.name]["display_duration"]
                             keyframe_data["value"] = slot.coa_slot_index
 
-                            anim_data["slot"][j]["displayFrame"].insert(0,keyframe_data)
+                            anim_data["slot"][j]["displayFrame"].append(keyframe_data)
                             slot_keyframe_duration[slot.name]["display_duration"] = 0
 
 
@@ -980,34 +1023,34 @@ def get_animation_data(self,sprite_object,armature,armature_orig):
                         bake_anim = self.scene.coa_export_bake_anim and frame%self.scene.coa_export_bake_steps==0
 
                         ### bone position
-                        if bone_key_on_frame(bone_orig,frame,armature_orig.animation_data,type="LOCATION") or frame in [0,anim.frame_end] or const_len > 0 or in_ik_chain or bake_anim:
+                        if keyframe_index.bone_key_on_frame(bone_orig,frame,armature_orig.animation_data,type="LOCATION") or frame in [0,anim.frame_end] or const_len > 0 or in_ik_chain or bake_anim:
                             bone_pos = get_bone_pos(armature,bone,scale) - self.armature_restpose[bone.name]["bone_pos"]
 
                             keyframe_data = {}
                             keyframe_data["duration"] = bone_keyframe_duration[bone.name]["pos_duration"]
                             keyframe_data["curve"] = [.5,0,.5,1] if bake_anim == False else [0,0,1,1]
-                            keyframe_data["x"] = round(bone_pos[0],2)
-                            keyframe_data["y"] = round(bone_pos[1],2)
+                            keyframe_data["x"] = round_value(bone_pos[0],2)
+                            keyframe_data["y"] = round_value(bone_pos[1],2)
 
-                            if frame in [0, anim.frame_end] or (bone_keyframe_duration[bone.name]["last_pos"] != [keyframe_data["x"], keyframe_data["y"]]):
+                            if frame in [0, anim.frame_end] or key_values_differ(bone_keyframe_duration[bone.name]["last_pos"], [keyframe_data["x"], keyframe_data["y"]], 2):
                                 ### if previous keyframe differs and keyframe duration is greater 1 add an extra keyframe inbetween
-                                if bone_keyframe_duration[bone.name]["pos_duration"] > 1 and bone_keyframe_duration[bone.name]["last_pos"] != [keyframe_data["x"], keyframe_data["y"]]:
+                                if bone_keyframe_duration[bone.name]["pos_duration"] > 1 and key_values_differ(bone_keyframe_duration[bone.name]["last_pos"], [keyframe_data["x"], keyframe_data["y"]], 2):
                                     if const_len > 0 or in_ik_chain:
                                         keyframe_data_last = {}
                                         keyframe_data_last["duration"] = bone_keyframe_duration[bone.name]["pos_duration"]-1
                                         keyframe_data_last["curve"] = [.5, 0, .5, 1] if bake_anim == False else [0, 0, 1, 1]
                                         keyframe_data_last["x"] = bone_keyframe_duration[bone.name]["last_pos"][0]
                                         keyframe_data_last["y"] = bone_keyframe_duration[bone.name]["last_pos"][1]
-                                        anim_data["bone"][j]["translateFrame"].insert(0, keyframe_data_last)
+                                        anim_data["bone"][j]["translateFrame"].append(keyframe_data_last)
 
                                         keyframe_data["duration"] = 1
 
-                                anim_data["bone"][j]["translateFrame"].insert(0, keyframe_data)
+                                anim_data["bone"][j]["translateFrame"].append(keyframe_data)
                                 bone_keyframe_duration[bone.name]["pos_duration"] = 0
                                 bone_keyframe_duration[bone.name]["last_pos"] = [keyframe_data["x"], keyframe_data["y"]]
 
                         ### bone rotation
-                        if bone_key_on_frame(bone_orig,frame,armature_orig.animation_data,type="ROTATION") or frame in [0,anim.frame_end] or const_len > 0 or in_ik_chain or bake_anim:
+                        if keyframe_index.bone_key_on_frame(bone_orig,frame,armature_orig.animation_data,type="ROTATION") or frame in [0,anim.frame_end] or const_len > 0 or in_ik_chain or bake_anim:
 
                             # bone_rot = math.fmod(get_bone_angle(armature,bone) - self.armature_restpose[bone.name]["bone_rot"], 360)
                             if not bone_uses_constraints[bone.name]:
@@ -1023,50 +1066,50 @@ def get_animation_data(self,sprite_object,armature,armature_orig):
                             keyframe_data = {}
                             keyframe_data["duration"] = bone_keyframe_duration[bone.name]["rot_duration"]
                             keyframe_data["curve"] = [.5,0,.5,1] if bake_anim == False else [0,0,1,1]
-                            keyframe_data["rotate"] = round(bone_rot, 2)
+                            keyframe_data["rotate"] = round_value(bone_rot, 2)
 
-                            if (frame in [0,anim.frame_end]) or (bone_keyframe_duration[bone.name]["last_rot"] != keyframe_data["rotate"]):
+                            if (frame in [0,anim.frame_end]) or key_values_differ(bone_keyframe_duration[bone.name]["last_rot"], [keyframe_data["rotate"]], 2):
                                 ### if previous keyframe differs and keyframe duration is greater 1 add an extra keyframe inbetween
-                                if bone_keyframe_duration[bone.name]["rot_duration"] > 1 and (bone_keyframe_duration[bone.name]["last_rot"] != keyframe_data["rotate"]):
+                                if bone_keyframe_duration[bone.name]["rot_duration"] > 1 and key_values_differ(bone_keyframe_duration[bone.name]["last_rot"], [keyframe_data["rotate"]], 2):
                                     if const_len > 0 or in_ik_chain:
                                         keyframe_data_last = {}
                                         keyframe_data_last["duration"] = bone_keyframe_duration[bone.name]["rot_duration"] - 1
                                         keyframe_data_last["curve"] = [.5, 0, .5, 1] if bake_anim == False else [0, 0, 1, 1]
-                                        keyframe_data_last["rotate"] = round(bone_keyframe_duration[bone.name]["last_rot"], 2)
-                                        anim_data["bone"][j]["rotateFrame"].insert(0, keyframe_data_last)
+                                        keyframe_data_last["rotate"] = round_value(bone_keyframe_duration[bone.name]["last_rot"][0], 2)
+                                        anim_data["bone"][j]["rotateFrame"].append(keyframe_data_last)
 
                                         keyframe_data["duration"] = 1
 
-                                anim_data["bone"][j]["rotateFrame"].insert(0, keyframe_data)
+                                anim_data["bone"][j]["rotateFrame"].append(keyframe_data)
                                 bone_keyframe_duration[bone.name]["rot_duration"] = 0
-                                bone_keyframe_duration[bone.name]["last_rot"] = keyframe_data["rotate"]
+                                bone_keyframe_duration[bone.name]["last_rot"] = [keyframe_data["rotate"]]
 
                         ### bone scale
-                        if bone_key_on_frame(bone_orig,frame,armature_orig.animation_data,type="SCALE") or frame in [0,anim.frame_end] or const_len > 0 or in_ik_chain or bake_anim:
+                        if keyframe_index.bone_key_on_frame(bone_orig,frame,armature_orig.animation_data,type="SCALE") or frame in [0,anim.frame_end] or const_len > 0 or in_ik_chain or bake_anim:
 
                             bone_scale = get_bone_scale(armature,bone,relative=True) if not bone_uses_constraints[bone.name] else get_bone_scale(armature,bone,relative=False)
 
                             keyframe_data = {}
                             keyframe_data["duration"] = bone_keyframe_duration[bone.name]["scale_duration"]
                             keyframe_data["curve"] = [.5,0,.5,1] if bake_anim == False else [0,0,1,1]
-                            keyframe_data["x"] = round(bone_scale[0],2)
-                            keyframe_data["y"] = round(bone_scale[1],2)
+                            keyframe_data["x"] = round_value(bone_scale[0],2)
+                            keyframe_data["y"] = round_value(bone_scale[1],2)
 
-                            if (frame in [0,anim.frame_end]) or (bone_keyframe_duration[bone.name]["last_scale"] != [keyframe_data["x"], keyframe_data["y"]]):
+                            if (frame in [0,anim.frame_end]) or key_values_differ(bone_keyframe_duration[bone.name]["last_scale"], [keyframe_data["x"], keyframe_data["y"]], 2):
 
                                 ### if previous keyframe differs and keyframe duration is greater 1 add an extra keyframe inbetween
-                                if bone_keyframe_duration[bone.name]["scale_duration"] > 1 and (bone_keyframe_duration[bone.name]["last_scale"] != [keyframe_data["x"], keyframe_data["y"]]):
+                                if bone_keyframe_duration[bone.name]["scale_duration"] > 1 and key_values_differ(bone_keyframe_duration[bone.name]["last_scale"], [keyframe_data["x"], keyframe_data["y"]], 2):
                                     if const_len > 0 or in_ik_chain:
                                         keyframe_data_last = {}
                                         keyframe_data_last["duration"] = bone_keyframe_duration[bone.name]["scale_duration"]-1
                                         keyframe_data_last["curve"] = [.5,0,.5,1] if bake_anim == False else [0,0,1,1]
                                         keyframe_data_last["x"] = bone_keyframe_duration[bone.name]["last_scale"][0]
                                         keyframe_data_last["y"] = bone_keyframe_duration[bone.name]["last_scale"][1]
-                                        anim_data["bone"][j]["scaleFrame"].insert(0,keyframe_data_last)
+                                        anim_data["bone"][j]["scaleFrame"].append(keyframe_data_last)
 
                                         keyframe_data["duration"] = 1
 
-                                anim_data["bone"][j]["scaleFrame"].insert(0,keyframe_data)
+                                anim_data["bone"][j]["scaleFrame"].append(keyframe_data)
                                 bone_keyframe_duration[bone.name]["scale_duration"] = 0
                                 bone_keyframe_duration[bone.name]["last_scale"] = [keyframe_data["x"], keyframe_data["y"]]
 
@@ -1094,7 +1137,7 @@ def get_animation_data(self,sprite_object,armature,armature_orig):
                                 key_blocks = []
                                 for key in data.shape_keys.key_blocks:
                                     key_blocks.append(key.name)
-                                if property_key_on_frame(data,key_blocks,frame,type="SHAPEKEY") or (frame in [0,anim.frame_end] and data_name in SHAPEKEY_ANIMATION):# or bake_anim:
+                                if keyframe_index.property_key_on_frame(data,key_blocks,frame,type="SHAPEKEY") or (frame in [0,anim.frame_end] and data_name in SHAPEKEY_ANIMATION):# or bake_anim:
                                     ffd_data = {}
                                     ffd_data["duration"] = ffd_keyframe_duration[data_name]["ffd_duration"]
                                     ffd_data["curve"] = [.5,0,.5,1] if bake_anim == False else [0,0,1,1]
@@ -1103,14 +1146,12 @@ def get_animation_data(self,sprite_object,armature,armature_orig):
 #                                    else:
 #                                        ffd_data["tweenEasing"] = 0
 
-                                    verts = get_mixed_vertex_data(item["object"])
-                                    verts_relative = []
-                                    for i,co in enumerate(verts):
-                                        verts_relative.append(Vector(co) - Vector(vert_coords_default[slot.name][i]))
+                                    verts = self.shape_key_cache.get_mixed_vertex_data(item["object"], data)[item["vert_indices"]]
+                                    verts_relative = verts - vert_coords_default[data_name]
 
                                     ffd_data["vertices"] = convert_vertex_data_to_pixel_space(verts_relative)
 
-                                    if (frame in [0, anim.frame_end]) or (ffd_last_frame_values[data_name] != ffd_data["vertices"]):
+                                    if (frame in [0, anim.frame_end]) or key_values_differ(ffd_last_frame_values[data_name], ffd_data["vertices"], 2):
                                         # ### if previous keyframe differs and keyframe duration is greater 1 add an extra keyframe inbetween
                                         # if ffd_data["duration"] > 1 and (ffd_last_frame_values[data_name] != ffd_data["vertices"]):
                                         #     ffd_data_last = {}
@@ -1118,15 +1159,29 @@ def get_animation_data(self,sprite_object,armature,armature_orig):
                                         #     ffd_data_last["curve"] = [.5,0,.5,1]
                                         #     ffd_data_last["vertices"] = ffd_last_frame_values[data_name]
                                         #
-                                        #     anim_data["ffd"][j]["frame"].insert(0,ffd_data_last)
+                                        #     anim_data["ffd"][j]["frame"].append(ffd_data_last)
                                         #     ffd_data["duration"] = 1
 
-                                        anim_data["ffd"][j]["frame"].insert(0,ffd_data)
+                                        anim_data["ffd"][j]["frame"].append(ffd_data)
                                         ffd_keyframe_duration[data_name]["ffd_duration"] = 0
                                         ffd_last_frame_values[data_name] = ffd_data["vertices"]
                             j += 1
 
 
+            ### frames were collected from the last to the first frame
+            for track in anim_data["slot"]:
+                track["colorFrame"].reverse()
+                track["displayFrame"].reverse()
+            for track in anim_data["bone"]:
+                track["translateFrame"].reverse()
+                track["rotateFrame"].reverse()
+                track["scaleFrame"].reverse()
+            for track in anim_data["ffd"]:
+                track["frame"].reverse()
+
+            if self.scene.coa_export_reduce_keys:
+                reduce_animation_data(self, anim_data)
+
             ### cleanup animation data
             delete_keys = []
             for key in anim_data:
@@ -1149,8 +1204,7 @@ def get_animation_data(self,sprite_object,armature,armature_orig):
             for key in delete_keys:
                 del anim_data[key]
 
-            animations.append(anim_data)
-    return animations
+            yield anim_data
 
 
 class DragonBonesExport(bpy.types.Operator):
@@ -1221,9 +1275,20 @@ class DragonBonesExport(bpy.types.Operator):
             self.sprite_object.coa_anim_collections_index = self.animation_index
         context.scene.frame_current = self.frame_current
 
+    def cleanup_scene(self,context,coa_nla_mode):
+        self.set_init_state(context) ### restore initial object selection
+        if self.armature != None:
+            bpy.data.objects.remove(self.armature) ### delete copied armature
+        bone_pose_cache.clear()
+        self.scene.coa_nla_mode = coa_nla_mode
+
     def execute(self, context):
         global tmp_slots_data
+        global binary_output
         tmp_slots_data = {}
+        binary_output = context.scene.coa_export_data_format == "BINARY"
+        bone_pose_cache.clear()
+        self.shape_key_cache = ShapeKeyMixCache()
 
         self.get_init_state(context)
         self.scene = context.scene
@@ -1242,11 +1307,14 @@ class DragonBonesExport(bpy.types.Operator):
         self.sprites = sorted(self.sprites, key=lambda obj: obj.location[1], reverse=True) ### sort objects based on the z depth. needed for draw order
 
         self.armature = create_cleaned_armature_copy(self,self.armature_orig,self.sprites) ### create a cleaned copy of the armature that contains only deform bones and which has applied copy transform constraints
+        self.bone_indices = get_bone_index_map(self.armature) if self.armature != None else {} ### bone name -> index lookup used for weight export
+        self.armature_hash = get_armature_hash(self.armature)
 
         ### get export, project and json path
         export_path = bpy.path.abspath(self.scene.coa_export_path)
         texture_dir_path = os.path.join(export_path , self.scene.coa_project_name+"_texture")
         json_path = os.path.join(export_path,self.scene.coa_project_name+"_ske.json")
+        bin_path = os.path.join(export_path,self.scene.coa_project_name+"_ske.bin")
 
         ### check if export dir exists
         if not os.path.exists(export_path):
@@ -1254,67 +1322,82 @@ class DragonBonesExport(bpy.types.Operator):
             return{'CANCELLED'}
 
 
-        ### export texture atlas
-        if self.scene.coa_export_image_mode == "ATLAS":
-            sprites = [sprite for sprite in self.sprites if sprite.type == "MESH"]
-            if len(sprites) > 0:
-                generate_texture_atlas(self, sprites,self.scene.coa_project_name,export_path,
-                                       img_width=self.scene.coa_atlas_resolution_x,
-                                       img_height=self.scene.coa_atlas_resolution_y,
-                                       sprite_scale=self.scene.coa_sprite_scale,
-                                       margin=self.scene.coa_atlas_island_margin)
-
-        ### create texture directory
-        if self.scene.coa_export_image_mode == "IMAGES":
-            if os.path.exists(texture_dir_path):
-                shutil.rmtree(texture_dir_path)
-            os.makedirs(texture_dir_path)
-
-        ### copy all textures to texture directory
-        copy_textures(self,self.sprites,texture_dir_path)
-
-        ### create json data
-        if self.armature != None:
-            self.armature.data.pose_position = "REST"
-            self.armature_orig.data.pose_position = "REST"
-
-        self.json_data = setup_json_project(self.scene.coa_project_name) ### create base template
-        self.json_data["armature"] =  [setup_armature_data(self.sprite_object)] ### create base armature
-        self.json_data["armature"][0]["frameRate"] = self.scene.render.fps
-        self.json_data["armature"][0]["slot"] = get_slot_data(self,self.sprites)
-        self.json_data["armature"][0]["skin"] = get_skin_data(self,self.sprites,self.armature,self.scale)
-        self.json_data["armature"][0]["bone"] = get_bone_data(self,self.armature,self.sprite_object,self.scale) if self.armature != None else [{"name":self.sprite_object.name}]
-
-        if self.armature != None:
-            self.armature.data.pose_position = "POSE"
-            self.armature_orig.data.pose_position = "POSE"
-        self.json_data["frameRate"] = self.scene.render.fps
-        self.json_data["armature"][0]["animation"] = get_animation_data(self,self.sprite_object,self.armature,self.armature_orig)
-
-        ### write and store json file
-        if self.reduce_size:
-            json_file = json.dumps(self.json_data,separators=(',',':'))
-        else:
-            json_file = json.dumps(self.json_data, indent="\t", sort_keys=False)
-
-        text_file = open(json_path, "w")
-        text_file.write(json_file)
-        text_file.close()
-
-
+        ### png files are encoded in the background while the skeleton data is exported. Leaving the block waits for them
+        with ImageWriter(compression=self.scene.coa_export_png_compression) as self.image_writer:
+            ### export texture atlas
+            self.atlas_occupancy = None
+            if self.scene.coa_export_image_mode == "ATLAS":
+                sprites = [sprite for sprite in self.sprites if sprite.type == "MESH"]
+                ### sample the on-screen size of all sprites, so the atlas only stores the visible texture resolution
+                self.screen_densities = None
+                if self.scene.coa_atlas_resolution_planning and len(sprites) > 0:
+                    self.screen_densities = get_sprite_screen_densities(context, self.sprite_object, sprites, self.armature_orig)
+                    if self.screen_densities == None:
+                        self.report({"WARNING"},"Resolution planning needs a scene camera. Sprites are exported at the sprite output scale.")
+                if len(sprites) > 0:
+                    try:
+                        generate_texture_atlas(self, sprites,self.scene.coa_project_name,export_path,
+                                               img_width=self.scene.coa_atlas_resolution_x,
+                                               img_height=self.scene.coa_atlas_resolution_y,
+                                               sprite_scale=self.scene.coa_sprite_scale,
+                                               margin=self.scene.coa_atlas_island_margin)
+                    except ValueError as error:
+                        ### the textures do not fit into the max atlas size at any scale
+                        self.cleanup_scene(context,coa_nla_mode)
+                        self.report({"ERROR"},str(error))
+                        return {"CANCELLED"}
+
+            ### create texture directory
+            if self.scene.coa_export_image_mode == "IMAGES":
+                if os.path.exists(texture_dir_path):
+                    shutil.rmtree(texture_dir_path)
+                os.makedirs(texture_dir_path)
+
+            ### copy all textures to texture directory
+            copy_textures(self,self.sprites,texture_dir_path)
+
+            ### create json data
+            if self.armature != None:
+                self.armature.data.pose_position = "REST"
+                self.armature_orig.data.pose_position = "REST"
+
+            self.json_data = setup_json_project(self.scene.coa_project_name) ### create base template
+            self.json_data["armature"] =  [setup_armature_data(self.sprite_object)] ### create base armature
+            self.json_data["armature"][0]["frameRate"] = self.scene.render.fps
+            self.json_data["armature"][0]["slot"] = get_slot_data(self,self.sprites)
+            self.skin_cache = None
+            if self.scene.coa_export_use_cache:
+                self.skin_cache = ExportCache(os.path.join(export_path, ".coa_cache", self.scene.coa_project_name + "_skin.json"))
+            self.json_data["armature"][0]["skin"] = get_skin_data(self,self.sprites,self.armature,self.scale)
+            if self.skin_cache != None:
+                self.skin_cache.save()
+            self.json_data["armature"][0]["bone"] = get_bone_data(self,self.armature,self.sprite_object,self.scale) if self.armature != None else [{"name":self.sprite_object.name}]
+
+            if self.armature != None:
+                self.armature.data.pose_position = "POSE"
+                self.armature_orig.data.pose_position = "POSE"
+            self.json_data["frameRate"] = self.scene.render.fps
+            self.json_data["armature"][0]["animation"] = JsonStream(get_animation_data(self,self.sprite_object,self.armature,self.armature_orig))
+
+            ### write and store json or binary file
+            if binary_output:
+                bin_file = open(bin_path, "wb")
+                write_binary(bin_file, self.json_data)
+                bin_file.close()
+            else:
+                text_file = open(json_path, "w")
+                write_json(text_file, self.json_data, minify=self.reduce_size, indent="\t")
+                text_file.close()
 
 
         ### cleanup scene
-        self.set_init_state(context) ### restore initial object selection
-        if self.armature != None:
-            bpy.data.objects.remove(self.armature) ### delete copied armature
+        self.cleanup_scene(context,coa_nla_mode)
 
-        for key in tmp_slots_data:
-            bpy.data.objects.remove(tmp_slots_data[key]["object"], do_unlink=True)
-
-        self.scene.coa_nla_mode = coa_nla_mode
-
-        self.report({"INFO"},"Export successful.")
+        if self.atlas_occupancy != None:
+            occupancy = ", ".join([str(round(value * 100, 1)) + "%" for value in self.atlas_occupancy])
+            self.report({"INFO"},"Export successful. Atlas pages: " + str(len(self.atlas_occupancy)) + ", occupancy: " + occupancy)
+        else:
+            self.report({"INFO"},"Export successful.")
         return {"FINISHED"}
 
 
@@ -1333,9 +1416,26 @@ class COAExportPanel(bpy.types.Panel):
     bpy.types.Scene.coa_sprite_scale = bpy.props.FloatProperty(default=1.0, min=0.1, max=1.0, name="Sprite Output Scale", description="Define the Sprite Output Scale", step=0.1)
     bpy.types.Scene.coa_atlas_resolution_x = bpy.props.IntProperty(default=1024,name="Resolution X",min=8,subtype="PIXEL")
     bpy.types.Scene.coa_atlas_resolution_y = bpy.props.IntProperty(default=1024, name="Resolution Y",min=8,subtype="PIXEL")
+    bpy.types.Scene.coa_atlas_packing = bpy.props.EnumProperty(default="MAXRECTS", name="Packing", description="Algorithm used to place the textures in the atlas.", items=PACKING_ALGORITHMS)
+    bpy.types.Scene.coa_atlas_allow_rotation = bpy.props.BoolProperty(default=False, name="Allow Rotation", description="Lets the packer rotate sprites by 90 degrees to fill the atlas tighter. The runtime has to support rotated atlas regions.")
+    bpy.types.Scene.coa_atlas_multi_page = bpy.props.BoolProperty(default=False, name="Multi Page Atlas", description="Puts sprites that do not fit into the max atlas size on additional atlas pages instead of scaling all sprites down. Only used by the DragonBones export.")
+    bpy.types.Scene.coa_atlas_resolution_planning = bpy.props.BoolProperty(default=False, name="Resolution Planning", description="Samples all animations through the scene camera and exports every sprite only at the largest resolution it is shown at.")
+    bpy.types.Scene.coa_atlas_quality_margin = bpy.props.FloatProperty(default=0.1, min=0.0, max=1.0, name="Quality Margin", description="Resolution added on top of the largest on-screen size of a sprite when resolution planning is used.", subtype="FACTOR")
+    bpy.types.Scene.coa_atlas_scale_precision = bpy.props.FloatProperty(default=0.01, min=0.001, max=0.1, name="Scale Precision", description="Precision of the search for the largest sprite scale that fits into the atlas, if the sprites do not fit at full scale.", step=0.1, precision=3)
     bpy.types.Scene.coa_atlas_island_margin = bpy.props.IntProperty(default=1, name="Texture Island Margin",min=1,subtype="PIXEL")
     bpy.types.Scene.coa_export_bake_anim = bpy.props.BoolProperty(default=False, name="Bake Animation")
     bpy.types.Scene.coa_export_bake_steps = bpy.props.IntProperty(default=1, min=1, name="Bake Steps",description="Set key every x Frame.")
+    bpy.types.Scene.coa_export_reduce_keys = bpy.props.BoolProperty(default=False, name="Reduce Keyframes", description="Removes sampled keyframes that are reconstructed by the interpolation of their neighbours within the given tolerance.")
+    bpy.types.Scene.coa_export_reduce_tolerance_pos = bpy.props.FloatProperty(default=0.5, min=0.0, name="Position Tolerance", subtype="PIXEL", description="Maximum position and mesh deformation error in pixels.")
+    bpy.types.Scene.coa_export_reduce_tolerance_rot = bpy.props.FloatProperty(default=0.5, min=0.0, name="Rotation Tolerance", description="Maximum rotation error in degrees.")
+    bpy.types.Scene.coa_export_reduce_tolerance_scale = bpy.props.FloatProperty(default=0.01, min=0.0, name="Scale Tolerance", description="Maximum scale error.")
+    bpy.types.Scene.coa_export_delta_frames = bpy.props.BoolProperty(default=False, name="Delta Frames", description="Drops Creature slot data inside runs of frames where it does not change. The first and last frame of each run, the first and last frame of an animation and meshes with displacements are always written. The runtime has to fill the dropped frames from the frames around them.")
+    bpy.types.Scene.coa_export_zip_compression = bpy.props.IntProperty(default=6, min=0, max=9, name="Zip Compression", description="Deflate level of the Creature data zip. Lower values write faster, higher values write smaller files.")
+    bpy.types.Scene.coa_export_json_file = bpy.props.BoolProperty(default=True, name="Write Json File", description="Writes the Creature data as loose json file next to the data zip.")
+    bpy.types.Scene.coa_export_data_format = bpy.props.EnumProperty(default="JSON", name="Data Format", description="File format of the exported skeleton data.", items=(("JSON","Json","Json text file"),("BINARY","Binary","Binary file with typed arrays and a string table. Loads faster in runtimes that support it.")))
+    bpy.types.Scene.coa_export_use_cache = bpy.props.BoolProperty(default=False, name="Use Skin Cache", description="Reuses the skin data of meshes that did not change since the last export. The cache is stored in the .coa_cache folder of the export path.")
+    bpy.types.Scene.coa_atlas_variant_scales = bpy.props.StringProperty(default="", name="Atlas Variants", description="Comma separated list of additional atlas scales like 0.5, 0.25. Each variant is written with an @0.5x suffix and uses the layout of the full size atlas.")
+    bpy.types.Scene.coa_export_png_compression = bpy.props.IntProperty(default=100, min=0, max=100, name="PNG Compression", subtype="PERCENTAGE", description="Compression of the exported png files. Lower values write faster, higher values write smaller files.")
     bpy.types.Scene.coa_minify_json = bpy.props.BoolProperty(default=True, name="Minify Json File", description="Minifies the json file for a fast loading file. Good if used in Web Applications.")
     bpy.types.Scene.coa_export_square_atlas = bpy.props.BoolProperty(default=True, name="Force Square Texture Atlas", description="This option makes sure the exported Atlas is always perfectly squared.")
     bpy.types.Scene.coa_export_texture_bleed = bpy.props.IntProperty(default=0, min=0, name="Texture Bleeding", subtype="PIXEL", description="Defines how far the texture extends the mesh boundaries.")
@@ -1365,9 +1465,19 @@ class COAExportPanel(bpy.types.Panel):
         if self.scene.coa_atlas_mode == "LIMIT_SIZE":
             subcol.prop(self.scene, "coa_atlas_resolution_x", text="X")
             subcol.prop(self.scene, "coa_atlas_resolution_y", text="Y")
+            subcol.prop(self.scene, "coa_atlas_scale_precision")
+        subcol.prop(self.scene, "coa_atlas_resolution_planning")
+        if self.scene.coa_atlas_resolution_planning:
+            subcol.prop(self.scene, "coa_atlas_quality_margin", slider=True)
+        subcol.prop(self.scene, "coa_atlas_packing")
         subcol.prop(self.scene, "coa_atlas_island_margin")
         subcol.prop(self.scene, "coa_export_texture_bleed")
+        subcol.prop(self.scene, "coa_atlas_variant_scales")
+        subcol.prop(self.scene, "coa_export_png_compression")
         subcol.prop(self.scene, "coa_export_square_atlas")
+        subcol.prop(self.scene, "coa_atlas_allow_rotation")
+        if self.scene.coa_runtime_format == "DRAGONBONES":
+            subcol.prop(self.scene, "coa_atlas_multi_page")
 
         box_col.label(text="Data Settings:")
         subrow = box_col.row(align=True)
@@ -1375,7 +1485,22 @@ class COAExportPanel(bpy.types.Panel):
             subrow.prop(self.scene, "coa_export_bake_anim")
             if self.scene.coa_export_bake_anim:
                 subrow.prop(self.scene, "coa_export_bake_steps")
-        box_col.prop(self.scene, "coa_minify_json")
+        if self.scene.coa_runtime_format == "DRAGONBONES":
+            box_col.prop(self.scene, "coa_export_use_cache")
+        box_col.prop(self.scene, "coa_export_reduce_keys")
+        if self.scene.coa_export_reduce_keys:
+            subcol = box_col.column(align=True)
+            subcol.prop(self.scene, "coa_export_reduce_tolerance_pos")
+            subcol.prop(self.scene, "coa_export_reduce_tolerance_rot")
+            subcol.prop(self.scene, "coa_export_reduce_tolerance_scale")
+        if self.scene.coa_runtime_format == "CREATURE":
+            box_col.prop(self.scene, "coa_export_delta_frames")
+            box_col.prop(self.scene, "coa_export_zip_compression")
+            box_col.prop(self.scene, "coa_export_json_file")
+        if self.scene.coa_runtime_format == "DRAGONBONES":
+            box_col.prop(self.scene, "coa_export_data_format")
+        if self.scene.coa_runtime_format != "DRAGONBONES" or self.scene.coa_export_data_format == "JSON":
+            box_col.prop(self.scene, "coa_minify_json")
         box_col.prop(self.scene, "coa_armature_scale")
 
         if self.scene.coa_runtime_format == "CREATURE":
@@ -1388,6 +1513,22 @@ class COAExportPanel(bpy.types.Panel):
 
 
 
+def get_variant_sprite_data(sprite, scale_x, scale_y):
+    ### scales the rectangle of a SubTexture to an atlas variant. Both edges are rounded, so neighbouring sprites keep their order
+    if scale_x == 1.0 and scale_y == 1.0:
+        return sprite
+    x = int(round(sprite["x"] * scale_x))
+    y = int(round(sprite["y"] * scale_y))
+    ### the frame of a rotated sprite spans its height along the atlas x axis
+    width, height = (sprite["height"], sprite["width"]) if sprite.get("rotated", False) else (sprite["width"], sprite["height"])
+    atlas_width = int(round((sprite["x"] + width) * scale_x)) - x
+    atlas_height = int(round((sprite["y"] + height) * scale_y)) - y
+    variant_sprite = dict(sprite)
+    variant_sprite["x"] = x
+    variant_sprite["y"] = y
+    variant_sprite["width"], variant_sprite["height"] = (atlas_height, atlas_width) if sprite.get("rotated", False) else (atlas_width, atlas_height)
+    return variant_sprite
+
 def generate_texture_atlas(self, sprites, atlas_name, img_path, img_width=512, img_height=1024, sprite_scale=1.0, margin=1):
     global atlas_data
     atlas_data = {}
@@ -1409,6 +1550,7 @@ def generate_texture_atlas(self, sprites, atlas_name, img_path, img_width=512, i
                     slots.append({"sprite":sprite,"slot":slot.mesh})
 
     ### loop over all slots and create an object with slot assigned
+    dupli_sprites = []
     for slot in slots:
         dupli_sprite = slot["sprite"].copy()
         dupli_sprite.data = slot["slot"].copy()
@@ -1439,62 +1581,65 @@ def generate_texture_atlas(self, sprites, atlas_name, img_path, img_width=512, i
         for group in dupli_sprite.vertex_groups:
             dupli_sprite.vertex_groups.remove(group)
 
-        ### assign mesh as vertex group    
-        dupli_sprite.vertex_groups.new(name=slot["slot"].name)
-        bpy.ops.object.mode_set(mode="EDIT")
-        bpy.ops.mesh.reveal()
-        bpy.ops.mesh.select_all(action='SELECT')
-        for area in context.screen.areas:
-            if area.type == "VIEW_3D":
-                for region in area.regions:
-                    if region.type == "WINDOW":
-                        override = context.copy()
-                        override["area"] = area
-                        override["edit_object"] = dupli_sprite
-                        override["active_object"] = dupli_sprite
-                        override["object"] = dupli_sprite
-                        override["region"] = region
-                        bpy.ops.object.vertex_group_assign(override)
-                        break
-
-        bpy.ops.object.mode_set(mode="OBJECT")
-
-    img_atlas, tex_atlas_obj, atlas = TextureAtlasGenerator.generate_uv_layout(name="COA_UV_ATLAS", objects=context.selected_objects, width=16, height=16, max_width=img_width, max_height=img_height, margin=margin, texture_bleed=0, square=False, output_scale=sprite_scale)
-    img_width = atlas.width
-    img_height = atlas.height
-
-    ### get uv coordinates
-    bpy.ops.object.mode_set(mode="EDIT")
-
-    bm = bmesh.from_edit_mesh(tex_atlas_obj.data)
-    uv_layer = bm.loops.layers.uv["COA_UV_ATLAS"]
-
+        ### reveal mesh and assign it as vertex group
+        for item in list(dupli_sprite.data.vertices) + list(dupli_sprite.data.edges) + list(dupli_sprite.data.polygons):
+            item.hide = False
+        v_group = dupli_sprite.vertex_groups.new(name=slot["slot"].name)
+        v_group.add([vert.index for vert in dupli_sprite.data.vertices], 1.0, "REPLACE")
+        dupli_sprites.append(dupli_sprite)
+
+    group_names = {dupli_sprite.name: slot["slot"].name for dupli_sprite, slot in zip(dupli_sprites, slots)}
+    max_scales = None
+    if self.screen_densities != None:
+        screen_densities = {dupli_sprite.name: self.screen_densities.get(slot["sprite"].name) for dupli_sprite, slot in zip(dupli_sprites, slots)}
+        max_scales = get_max_texture_scales(dupli_sprites, screen_densities, self.scene.coa_atlas_quality_margin)
+    try:
+        img_atlases, tex_atlas_obj, atlas_pages = TextureAtlasGenerator.generate_uv_layout_pages(name="COA_UV_ATLAS", objects=dupli_sprites, width=16, height=16, max_width=img_width, max_height=img_height, margin=margin, texture_bleed=0, square=False, output_scale=sprite_scale, algorithm=self.scene.coa_atlas_packing, scale_precision=self.scene.coa_atlas_scale_precision, multi_page=self.scene.coa_atlas_multi_page, allow_rotation=self.scene.coa_atlas_allow_rotation, max_scales=max_scales)
+    except ValueError:
+        ### packing failed before the slot duplicates were joined
+        for dupli_sprite in dupli_sprites:
+            bpy.data.objects.remove(dupli_sprite, do_unlink=True)
+        raise
+    self.atlas_occupancy = [atlas.occupancy for atlas in atlas_pages]
+
+    ### find the atlas page of each vertex group. The uvs of each group are relative to its page
+    group_pages = {}
+    group_rotated = {}
+    group_scales = {}
+    for page_index, atlas in enumerate(atlas_pages):
+        for slot in atlas.texture_slots:
+            group_pages[group_names[slot.texture_data.object_name]] = page_index
+            group_rotated[group_names[slot.texture_data.object_name]] = slot.rotated
+            group_scales[group_names[slot.texture_data.object_name]] = slot.texture_data.scale
+
+    ### get uv coordinates of each vertex group
+    mesh = tex_atlas_obj.data
+    uv_layer = mesh.uv_layers["COA_UV_ATLAS"]
+    vert_uvs = {}
+    for loop in mesh.loops:
+        if loop.vertex_index not in vert_uvs:
+            vert_uvs[loop.vertex_index] = uv_layer.data[loop.index].uv
+    group_verts = {}
+    for vert in mesh.vertices:
+        for group in vert.groups:
+            if group.group not in group_verts:
+                group_verts[group.group] = []
+            group_verts[group.group].append(vert.index)
 
-    sprite_data = []
+    sprite_data = [[] for atlas in atlas_pages]
 
     for group in tex_atlas_obj.vertex_groups:
-        for area in context.screen.areas:
-            if area.type == "VIEW_3D":
-                for region in area.regions:
-                    if region.type == "WINDOW":
-                        override = context.copy()
-                        override["area"] = area
-                        override["edit_object"] = tex_atlas_obj
-                        override["active_object"] = tex_atlas_obj
-                        override["object"] = tex_atlas_obj
-                        override["region"] = region
-                        bpy.ops.object.vertex_group_set_active(override, group=group.name)
-                        bpy.ops.mesh.select_all(action='DESELECT')
-                        bpy.ops.object.vertex_group_select(override)
-                        break
-        bmesh.update_edit_mesh(tex_atlas_obj.data)
+        page_index = group_pages.get(group.name, 0)
+        atlas = atlas_pages[page_index]
+        img_width = atlas.width
+        img_height = atlas.height
         x = 1.0
         y = 1.0
         width = 0.0
         height = 0.0
-        for vert in bm.verts:
-            if vert.select:
-                uv = uv_from_vert_first(uv_layer,vert)
+        for vert_index in group_verts.get(group.index, []):
+            if vert_index in vert_uvs:
+                uv = vert_uvs[vert_index]
                 x = min(uv[0], x)
                 y = min(1 - uv[1], y)
                 width = max(uv[0], width)
@@ -1507,39 +1652,58 @@ def generate_texture_atlas(self, sprites, atlas_name, img_path, img_width=512, i
         width_px = abs(int(img_width*width))
         height_px = abs(int(img_height*height))
 
+        ### rotated sprites are stored 90 degrees clockwise, like TexturePacker does. x and y are the top left corner of the
+        ### rotated rectangle in the atlas, width and height are the unrotated frame size the runtime swaps itself
+        rotated = group_rotated.get(group.name, False)
+        if rotated:
+            width_px, height_px = height_px, width_px
+
         sprite = {}
         sprite["name"] = group.name
         sprite["x"] = x_px
         sprite["y"] = y_px
         sprite["width"] = width_px
         sprite["height"] = height_px
-        sprite_data.append(sprite)
-        atlas_data[group.name] = {"width": width_px, "height": height_px, "output_scale":atlas.output_scale}
+        if rotated:
+            sprite["rotated"] = True
+        sprite_data[page_index].append(sprite)
+        atlas_data[group.name] = {"width": width_px, "height": height_px, "output_scale":group_scales.get(group.name, atlas.output_scale)}
+
+    ### write a texture atlas json and image for each page. All pages share the atlas name, so runtimes merge them.
+    ### variants reuse the packed layout and downsample the composited atlas pixels
+    for variant_scale in [1.0] + get_variant_scales(self.scene.coa_atlas_variant_scales):
+        variant_suffix = get_variant_suffix(variant_scale) if variant_scale != 1.0 else ""
+        for page_index, atlas in enumerate(atlas_pages):
+            page_name = atlas_name + "_tex" if page_index == 0 else atlas_name + "_tex_" + str(page_index)
+            page_name += variant_suffix
+            page_width = max(1, int(round(atlas.width * variant_scale)))
+            page_height = max(1, int(round(atlas.height * variant_scale)))
+
+            ### collect sprite atlas data
+            texture_atlas = {}
+            texture_atlas["width"] = page_width
+            texture_atlas["height"] = page_height
+            texture_atlas["imagePath"] = page_name + ".png"
+            texture_atlas["name"] = self.scene.coa_project_name
+            if variant_scale != 1.0:
+                texture_atlas["scale"] = variant_scale
+            texture_atlas["SubTexture"] = [get_variant_sprite_data(sprite, page_width / atlas.width, page_height / atlas.height) for sprite in sprite_data[page_index]]
+
+            if self.reduce_size:
+                json_file = json.dumps(texture_atlas,separators=(',',':'))
+            else:
+                json_file = json.dumps(texture_atlas, indent="\t", sort_keys=False)
 
-    bpy.ops.object.mode_set(mode="OBJECT")
-    ### collect sprite atlas data
-    texture_atlas = {}
-    texture_atlas["width"] = img_width
-    texture_atlas["height"] = img_height
-    texture_atlas["imagePath"] = atlas_name + "_tex.png"
-    texture_atlas["name"] = self.scene.coa_project_name
-    texture_atlas["SubTexture"] = sprite_data
-
-    if self.reduce_size:
-        json_file = json.dumps(texture_atlas,separators=(',',':'))
-    else:
-        json_file = json.dumps(texture_atlas, indent="\t", sort_keys=False)
-
-    json_path = os.path.join(img_path,atlas_name+"_tex.json")
-    text_file = open(json_path, "w")
-    text_file.write(json_file)
-    text_file.close()
-
-    compression_rate = int(context.scene.render.image_settings.compression)
-    context.scene.render.image_settings.compression = 100
-    texture_path = os.path.join(img_path,atlas_name+"_tex.png")
-    img_atlas.save_render(texture_path)
-    context.scene.render.image_settings.compression = compression_rate
+            json_path = os.path.join(img_path,page_name+".json")
+            text_file = open(json_path, "w")
+            text_file.write(json_file)
+            text_file.close()
+
+            texture_path = os.path.join(img_path,page_name+".png")
+            if variant_scale != 1.0:
+                self.image_writer.add_pixels(texture_path, TextureAtlasGenerator.downsample_pixels(atlas.pixels, page_width, page_height))
+            else:
+                self.image_writer.add_pixels(texture_path, atlas.pixels)
 
 
     bpy.data.objects.remove(tex_atlas_obj, do_unlink=True)
\ No newline at end of file
@@ -1,42 +1,167 @@
 import bpy
+import os
+import re
+import json
+import hashlib
+from collections import OrderedDict
+import numpy as np
 from ... functions import *
 
-def property_key_on_frame(obj,prop_names,frame,type="PROPERTY"):
-    if type == "SHAPEKEY":
-        obj = obj.shape_keys
-
-    if obj != None and obj.animation_data != None:
-    ### check if property has a key set
-        action = obj.animation_data.action
-        if action != None:
-            for fcurve in action.fcurves:
-                for prop_name in prop_names:
-                    if prop_name in fcurve.data_path:
-                        for keyframe in fcurve.keyframe_points:
-                            if keyframe.co[0] == frame:
-                                return True
-    ### check if property has a bone driver and bone has a key set
-        for driver in obj.animation_data.drivers:
+def get_bone_name_from_data_path(data_path):
+    if data_path.startswith('pose.bones["') and '"]' in data_path:
+        return data_path[len('pose.bones["'):data_path.rfind('"]')]
+    return None
+
+def get_channel_from_data_path(data_path): ### LOCATION, ROTATION, SCALE or None
+    prop_name = data_path[data_path.rfind("].")+2:] if "]." in data_path else data_path
+    for channel in ["location", "rotation", "scale"]:
+        if prop_name.startswith(channel):
+            return channel.upper()
+    return None
+
+class ActionKeyframes:
+    ### collects all keyed frames of an action in one pass over its fcurves
+    def __init__(self, action):
+        self.data_paths = {}
+        self.bones = {}
+        for fcurve in action.fcurves:
+            frames = set(keyframe.co[0] for keyframe in fcurve.keyframe_points)
+            if fcurve.data_path not in self.data_paths:
+                self.data_paths[fcurve.data_path] = set()
+            self.data_paths[fcurve.data_path] |= frames
+
+            bone_name = get_bone_name_from_data_path(fcurve.data_path)
+            if bone_name != None:
+                if bone_name not in self.bones:
+                    self.bones[bone_name] = {"LOCATION": set(), "ROTATION": set(), "SCALE": set(), "ANY": set()}
+                channel = get_channel_from_data_path(fcurve.data_path)
+                if channel != None:
+                    self.bones[bone_name][channel] |= frames
+                self.bones[bone_name]["ANY"] |= frames
+
+    def get_bone_frames(self, bone_name, type="ANY"): ### LOCATION, ROTATION, SCALE, ANY
+        if bone_name in self.bones:
+            return self.bones[bone_name][type]
+        return frozenset()
+
+    def get_property_frames(self, prop_names):
+        frames = set()
+        for data_path in self.data_paths:
             for prop_name in prop_names:
-                if prop_name in driver.data_path:
-                    for var in driver.driver.variables:
-                        armature = var.targets[0].id
-                        if armature != None:
-                            bone_target = var.targets[0].bone_target
-                            if bone_target in armature.data.bones:
-                                bone = armature.data.bones[bone_target]
-                                pbone = armature.pose.bones[bone_target]
-                                key_on_frame = bone_key_on_frame(bone,frame,armature.animation_data,type="ANY")
-                                if key_on_frame:
-                                    return key_on_frame
-                                for const in pbone.constraints:
-                                    if const.type == "ACTION":
-                                        bone = armature.data.bones[const.subtarget] if const.subtarget in armature.data.bones else None
-                                        if bone != None:
-                                            key_on_frame = bone_key_on_frame(bone,frame,armature.animation_data,type="ANY")
-                                        if key_on_frame:
-                                            return key_on_frame
-    return False
+                if prop_name in data_path:
+                    frames |= self.data_paths[data_path]
+                    break
+        return frames
+
+class KeyframeIndex:
+    ### lookup of keyed frames per channel. Has to be recreated whenever the active actions change.
+    def __init__(self):
+        self.actions = {}
+        self.properties = {}
+
+    def get_action_keyframes(self, action):
+        if action == None:
+            return None
+        if action.name not in self.actions:
+            self.actions[action.name] = ActionKeyframes(action)
+        return self.actions[action.name]
+
+    def get_bone_frames(self, bone, animation_data, type="ANY"):
+        action = animation_data.action if animation_data != None else None
+        keyframes = self.get_action_keyframes(action)
+        if keyframes != None:
+            return keyframes.get_bone_frames(bone.name, type)
+        return frozenset()
+
+    def bone_key_on_frame(self, bone, frame, animation_data, type="LOCATION"): ### LOCATION, ROTATION, SCALE, ANY
+        return frame in self.get_bone_frames(bone, animation_data, type)
+
+    def get_property_frames(self, obj, prop_names, type="PROPERTY"):
+        if type == "SHAPEKEY":
+            obj = obj.shape_keys
+        if obj == None or obj.animation_data == None:
+            return frozenset()
+
+        key = (obj.as_pointer(), tuple(prop_names))
+        if key in self.properties:
+            return self.properties[key]
+
+        ### frames on which the property itself has a key set
+        frames = set()
+        keyframes = self.get_action_keyframes(obj.animation_data.action)
+        if keyframes != None:
+            frames |= keyframes.get_property_frames(prop_names)
+
+        ### frames on which a bone driving the property has a key set
+        for driver in obj.animation_data.drivers:
+            if not any(prop_name in driver.data_path for prop_name in prop_names):
+                continue
+            for var in driver.driver.variables:
+                armature = var.targets[0].id
+                if armature == None or getattr(armature, "type", None) != "ARMATURE":
+                    continue
+                bone_target = var.targets[0].bone_target
+                if bone_target in armature.data.bones:
+                    bone = armature.data.bones[bone_target]
+                    pbone = armature.pose.bones[bone_target]
+                    frames |= self.get_bone_frames(bone, armature.animation_data)
+                    for const in pbone.constraints:
+                        if const.type == "ACTION" and const.subtarget in armature.data.bones:
+                            frames |= self.get_bone_frames(armature.data.bones[const.subtarget], armature.animation_data)
+
+        self.properties[key] = frames
+        return frames
+
+    def property_key_on_frame(self, obj, prop_names, frame, type="PROPERTY"):
+        return frame in self.get_property_frames(obj, prop_names, type)
+
+def get_vertex_coords(data, count):
+    coords = np.empty(count*3, dtype=np.float64)
+    data.foreach_get("co", coords)
+    return coords.reshape(count, 3)
+
+### get vertex indices that are exported. vertices of a hidden base sprite are skipped
+def get_export_vertex_indices(obj, mesh):
+    count = len(mesh.vertices)
+    keep = np.ones(count, dtype=bool)
+    if "coa_base_sprite" in obj.vertex_groups and mesh.coa_hide_base_sprite:
+        v_group_idx = obj.vertex_groups["coa_base_sprite"].index
+        for vert in mesh.vertices:
+            for g in vert.groups:
+                if g.group == v_group_idx and g.weight > 0:
+                    keep[vert.index] = False
+                    break
+    return np.flatnonzero(keep)
+
+def get_bone_index_map(armature):
+    return {bone.name: i for i, bone in enumerate(armature.data.bones)}
+
+### collects all vertex group assignments in one pass. Returns flat arrays of row (position in vert_indices), group index and weight
+def get_vertex_group_arrays(mesh, vert_indices=None):
+    rows = []
+    groups = []
+    weights = []
+    vertices = mesh.vertices
+    if vert_indices is None:
+        vert_indices = range(len(vertices))
+    for row, vert_index in enumerate(vert_indices):
+        for group in vertices[vert_index].groups:
+            rows.append(row)
+            groups.append(group.group)
+            weights.append(group.weight)
+    return np.array(rows, dtype=np.int64), np.array(groups, dtype=np.int64), np.array(weights, dtype=np.float64)
+
+### maps the vertex group indices of an object to bone indices. Groups that are no bones get -1
+def get_group_bone_indices(obj, bone_indices):
+    return np.array([bone_indices.get(v_group.name, -1) for v_group in obj.vertex_groups], dtype=np.int64)
+
+### reads all bone weights of a mesh at once. Returns flat arrays of vertex index, bone index and weight of every bone group assignment
+def get_bone_weight_arrays(obj, mesh, bone_indices):
+    rows, groups, weights = get_vertex_group_arrays(mesh)
+    group_bones = get_group_bone_indices(obj, bone_indices)
+    bones = group_bones[groups] if len(groups) > 0 else np.zeros(0, dtype=np.int64)
+    is_bone = bones >= 0
+    return rows[is_bone], bones[is_bone], weights[is_bone]
 
 def remove_base_sprite(obj):
     active_object = bpy.context.active_object
@@ -63,4 +188,248 @@ def remove_base_sprite(obj):
     bmesh.ops.delete(bm,geom=verts,context=1)
     bm = bmesh.update_edit_mesh(obj.data)
     bpy.ops.object.mode_set(mode="OBJECT")
-    bpy.context.scene.objects.active = active_object
\ No newline at end of file
+    bpy.context.scene.objects.active = active_object
+
+def get_vertex_group_weights(obj, mesh, v_group_name):
+    weights = np.zeros(len(mesh.vertices), dtype=np.float64)
+    if v_group_name in obj.vertex_groups:
+        group_index = obj.vertex_groups[v_group_name].index
+        for vert in mesh.vertices:
+            for group in vert.groups:
+                if group.group == group_index:
+                    weights[vert.index] = group.weight
+                    break
+    return weights
+
+class ShapeKeyMixCache:
+    ### evaluates the shapekey mix of a mesh without the need of adding a temporary from_mix shapekey.
+    ### Key block coordinates are read once per mesh and the last mix is reused as long as the key values do not change.
+    def __init__(self):
+        self.key_coords = {}
+        self.group_weights = {}
+        self.mixes = {}
+
+    def get_key_coords(self, mesh, key_block):
+        key = (mesh.name, key_block.name)
+        if key not in self.key_coords:
+            self.key_coords[key] = get_vertex_coords(key_block.data, len(mesh.vertices))
+        return self.key_coords[key]
+
+    def get_group_weights(self, obj, mesh, v_group_name):
+        key = (obj.name, mesh.name, v_group_name)
+        if key not in self.group_weights:
+            self.group_weights[key] = get_vertex_group_weights(obj, mesh, v_group_name)
+        return self.group_weights[key]
+
+    ### obj provides the vertex groups shapekeys can be masked with. The returned array is shared and read only
+    def get_mixed_vertex_data(self, obj, mesh):
+        if mesh.shape_keys == None or len(mesh.shape_keys.key_blocks) == 0:
+            verts = get_vertex_coords(mesh.vertices, len(mesh.vertices))
+            verts.flags.writeable = False
+            return verts
+
+        shape_keys = mesh.shape_keys
+        state = tuple((key_block.value, key_block.mute) for key_block in shape_keys.key_blocks)
+        key = (obj.name, mesh.name)
+        if key in self.mixes and self.mixes[key][0] == state:
+            return self.mixes[key][1]
+
+        reference_key = shape_keys.reference_key
+        verts = np.array(self.get_key_coords(mesh, reference_key))
+        for key_block in shape_keys.key_blocks:
+            if key_block == reference_key or key_block.mute or key_block.value == 0.0:
+                continue
+            relative_key = key_block.relative_key if key_block.relative_key != None else reference_key
+            delta = (self.get_key_coords(mesh, key_block) - self.get_key_coords(mesh, relative_key)) * key_block.value
+            if key_block.vertex_group != "":
+                delta *= self.get_group_weights(obj, mesh, key_block.vertex_group)[:, np.newaxis]
+            verts += delta
+        verts.flags.writeable = False
+        self.mixes[key] = (state, verts)
+        return verts
+
+### evaluates a dragonbones style bezier curve [x1, y1, x2, y2] running from (0,0) to (1,1) at the positions x
+def eval_bezier_curve(curve, x):
+    x1, y1, x2, y2 = curve
+    x = np.asarray(x, dtype=np.float64)
+    if x1 == y1 and x2 == y2:
+        return x
+    lower = np.zeros_like(x)
+    upper = np.ones_like(x)
+    for i in range(24):
+        t = (lower + upper) * 0.5
+        curve_x = 3 * (1-t)**2 * t * x1 + 3 * (1-t) * t**2 * x2 + t**3
+        below = curve_x < x
+        lower = np.where(below, t, lower)
+        upper = np.where(below, upper, t)
+    t = (lower + upper) * 0.5
+    return 3 * (1-t)**2 * t * y1 + 3 * (1-t) * t**2 * y2 + t**3
+
+### returns the indices of the keys that are needed to reconstruct all sampled values within tolerance.
+### curves holds the curve that interpolates from each key to the next one, None interpolates linear.
+### Keys whose values differ more than max_delta are never merged into one segment, e.g. rotations the runtime would wrap.
+def reduce_keyframes(times, values, tolerance, curves=None, max_delta=None):
+    times = np.asarray(times, dtype=np.float64)
+    values = np.asarray(values, dtype=np.float64).reshape(len(times), -1)
+    count = len(times)
+    if count <= 2:
+        return list(range(count))
+
+    def segment_fits(start, end):
+        if end - start <= 1:
+            return True
+        if max_delta != None and np.any(np.abs(values[end] - values[start]) > max_delta):
+            return False
+        progress = (times[start+1:end] - times[start]) / (times[end] - times[start])
+        if curves != None and curves[start] != None:
+            progress = eval_bezier_curve(curves[start], progress)
+        interpolated = values[start] + (values[end] - values[start]) * progress[:, np.newaxis]
+        return bool(np.all(np.abs(interpolated - values[start+1:end]) <= tolerance))
+
+    keys = [0]
+    start = 0
+    while start < count - 1:
+        ### grow the segment in doubling steps and bisect the last step once it does not fit anymore
+        end = start + 1
+        step = 1
+        failed = None
+        while end < count - 1:
+            next_end = min(end + step, count - 1)
+            if segment_fits(start, next_end):
+                end = next_end
+                step *= 2
+            else:
+                failed = next_end
+                break
+        if failed != None:
+            while failed - end > 1:
+                middle = (end + failed) // 2
+                if segment_fits(start, middle):
+                    end = middle
+                else:
+                    failed = middle
+        keys.append(end)
+        start = end
+    return keys
+
+class JsonStream:
+    ### json array whose items are generated while the file is written. Only one item has to be in memory at a time
+    def __init__(self, items):
+        self.items = items
+
+class JsonDictStream(JsonStream):
+    ### json object whose (key, value) pairs are generated while the file is written
+    pass
+
+JSON_STREAM_PLACEHOLDER = re.compile(r'"__coa_json_stream_(\d+)__"')
+
+class WriterTee:
+    ### forwards every write to several files, so the data is serialized only once for all of them
+    def __init__(self, files):
+        self.files = files
+
+    def write(self, text):
+        for file in self.files:
+            file.write(text)
+
+### writes data the same way json.dumps does, but JsonStream values are written item by item
+def write_json(file, data, minify=False, indent="\t"):
+    write_json_value(file, data, minify, indent, "")
+
+def write_json_value(file, data, minify, indent, line_indent):
+    streams = []
+    def default(obj):
+        if isinstance(obj, JsonStream):
+            streams.append(obj)
+            return "__coa_json_stream_" + str(len(streams)-1) + "__"
+        raise TypeError(repr(obj) + " is not JSON serializable")
+
+    if minify:
+        text = json.dumps(data, separators=(',', ':'), default=default)
+    else:
+        text = json.dumps(data, indent=indent, sort_keys=False, default=default)
+
+    def write_text(text):
+        file.write(text if minify else text.replace("\n", "\n" + line_indent))
+
+    pos = 0
+    for match in JSON_STREAM_PLACEHOLDER.finditer(text):
+        write_text(text[pos:match.start()])
+        line = text[text.rfind("\n", 0, match.start())+1:match.start()]
+        stream_indent = line_indent + line[:len(line) - len(line.lstrip())]
+        write_json_stream(file, streams[int(match.group(1))], minify, indent, stream_indent)
+        pos = match.end()
+    write_text(text[pos:])
+
+def write_json_stream(file, stream, minify, indent, line_indent):
+    is_dict = isinstance(stream, JsonDictStream)
+    file.write("{" if is_dict else "[")
+    empty = True
+    for item in stream.items:
+        if not empty:
+            file.write(",")
+        if not minify:
+            file.write("\n" + line_indent + indent)
+        if is_dict:
+            key, item = item
+            file.write(json.dumps(key) + (":" if minify else ": "))
+        write_json_value(file, item, minify, indent, line_indent + indent)
+        empty = False
+    if not empty and not minify:
+        file.write("\n" + line_indent)
+    file.write("}" if is_dict else "]")
+
+### hash of all given values. numpy arrays are hashed by their raw data
+def get_data_hash(*values):
+    hasher = hashlib.sha1()
+    for value in values:
+        if isinstance(value, np.ndarray):
+            hasher.update((str(value.dtype) + str(value.shape)).encode("utf-8"))
+            hasher.update(np.ascontiguousarray(value).tobytes())
+        else:
+            hasher.update(repr(value).encode("utf-8"))
+    return hasher.hexdigest()
+
+class ExportCache:
+    ### json file that stores generated export data by a hash of its input. Entries that are not used by an export are dropped on save
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        self.used_entries = OrderedDict()
+        if os.path.isfile(path):
+            try:
+                with open(path, "r") as cache_file:
+                    self.entries = json.load(cache_file, object_pairs_hook=OrderedDict)
+            except (OSError, ValueError):
+                self.entries = {}
+
+    def get(self, key):
+        if key in self.entries:
+            self.used_entries[key] = self.entries[key]
+            return self.entries[key]
+        return None
+
+    def set(self, key, value):
+        self.used_entries[key] = value
+
+    def save(self):
+        cache_dir = os.path.dirname(self.path)
+        if not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+        with open(self.path, "w") as cache_file:
+            json.dump(self.used_entries, cache_file, separators=(',', ':'))
+
+def get_variant_scales(text):
+    ### parses a comma separated list of atlas variant scales like "0.5, 0.25". Invalid and duplicate values are skipped
+    scales = []
+    for value in text.replace(";", ",").split(","):
+        try:
+            scale = float(value)
+        except ValueError:
+            continue
+        if 0.0 < scale < 1.0 and scale not in scales:
+            scales.append(scale)
+    return sorted(scales, reverse=True)
+
+def get_variant_suffix(scale):
+    return "@" + ("%g" % scale) + "x"
@@ -0,0 +1,86 @@
+'''
+Writes png files directly from pixel buffers, without the render pipeline. Encoding runs in a thread pool, zlib releases
+the gil while compressing, so several images are encoded at the same time.
+'''
+
+import os
+import zlib
+import struct
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+
+
+def get_zlib_level(compression):
+    ### maps the 0-100 compression of blenders image settings to a zlib level
+    return int(round(min(max(compression, 0), 100) * 0.09))
+
+
+def get_png_chunk(chunk_type, data):
+    chunk = chunk_type + data
+    return struct.pack(">I", len(data)) + chunk + struct.pack(">I", zlib.crc32(chunk) & 0xffffffff)
+
+
+def encode_png(pixels, compression=100):
+    ### pixels is a float (height, width, 4) rgba array with rows stored bottom up, like blender image pixels
+    height, width = pixels.shape[:2]
+    rows = np.clip(pixels[::-1] * 255.0 + 0.5, 0, 255).astype(np.uint8).reshape((height, width * 4))
+
+    ### every row uses the "up" filter, which stores the difference to the row above
+    filtered = np.empty((height, width * 4 + 1), dtype=np.uint8)
+    filtered[:, 0] = 2
+    filtered[0, 1:] = rows[0]
+    filtered[1:, 1:] = rows[1:] - rows[:-1]
+
+    header = struct.pack(">IIBBBBB", width, height, 8, 6, 0, 0, 0)
+    data = zlib.compress(filtered.tobytes(), get_zlib_level(compression))
+    return b"\x89PNG\r\n\x1a\n" + get_png_chunk(b"IHDR", header) + get_png_chunk(b"IDAT", data) + get_png_chunk(b"IEND", b"")
+
+
+def write_png(path, pixels, compression=100):
+    data = encode_png(pixels, compression)
+    with open(path, "wb") as png_file:
+        png_file.write(data)
+    return path
+
+
+def get_image_pixels(image):
+    ### reads the pixels of a blender image at once. Has to run on the main thread
+    width, height = image.size
+    return np.array(image.pixels[:], dtype=np.float32).reshape((height, width, image.channels))
+
+
+class ImageWriter:
+    ### collects png files to write and encodes them in a thread pool. Call wait() or use it as context manager to
+    ### make sure all files are written
+    def __init__(self, compression=100, max_workers=None):
+        self.compression = compression
+        self.executor = ThreadPoolExecutor(max_workers=max_workers or os.cpu_count() or 1)
+        self.jobs = []
+
+    def add_pixels(self, path, pixels):
+        self.jobs.append(self.executor.submit(write_png, path, pixels, self.compression))
+
+    def add_image(self, path, image):
+        pixels = get_image_pixels(image)
+        if pixels.shape[2] == 3:
+            pixels = np.concatenate((pixels, np.ones(pixels.shape[:2] + (1,), dtype=np.float32)), axis=2)
+        self.add_pixels(path, pixels)
+
+    def wait(self):
+        ### returns the written paths. Raises the first error of an encoding job
+        paths = [job.result() for job in self.jobs]
+        self.jobs = []
+        return paths
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        try:
+            if exc_type == None:
+                self.wait()
+        finally:
+            self.shutdown()
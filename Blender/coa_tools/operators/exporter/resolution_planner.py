@@ -0,0 +1,100 @@
+'''
+Resolution planning for texture atlases. Samples all animations to find the largest size every sprite is shown at
+through the export camera, so the atlas only stores the texture resolution that is actually visible.
+'''
+
+import math
+import numpy as np
+from mathutils import Vector
+from . texture_atlas_generator import TextureAtlasGenerator
+from . export_helper import get_vertex_coords
+
+
+def get_matrix_scale_2d(matrix):
+    ### largest stretch of a matrix in the x/z plane all sprites lie in
+    return float(np.linalg.norm(np.array(((matrix[0][0], matrix[0][2]), (matrix[2][0], matrix[2][2]))), 2))
+
+
+def get_camera_pixel_density(scene, camera, location):
+    ### returns the rendered pixels per blender unit of the camera at the given world location
+    render = scene.render
+    resolution = max(render.resolution_x, render.resolution_y) * render.resolution_percentage / 100.0
+    if camera.data.type == "ORTHO":
+        view_size = camera.data.ortho_scale
+    else:
+        view_dir = (camera.matrix_world.to_3x3() * Vector((0, 0, -1))).normalized()
+        distance = max((location - camera.matrix_world.to_translation()).dot(view_dir), camera.data.clip_start)
+        view_size = 2 * distance * math.tan(camera.data.angle * 0.5)
+    return resolution / view_size
+
+
+def get_bone_deform_scale(pbone):
+    ### stretch of the vertices a pose bone deforms, relative to its rest pose
+    return get_matrix_scale_2d(pbone.matrix * pbone.bone.matrix_local.inverted())
+
+
+def get_deform_bones(sprite, armature):
+    if armature == None or not any(modifier.type == "ARMATURE" for modifier in sprite.modifiers):
+        return []
+    return [armature.pose.bones[v_group.name] for v_group in sprite.vertex_groups if v_group.name in armature.pose.bones]
+
+
+def get_sprite_screen_densities(context, sprite_object, sprites, armature=None):
+    ### samples every frame of all animations and returns the largest on-screen pixels per local blender unit of each
+    ### sprite by name. Returns None if the scene has no camera
+    scene = context.scene
+    camera = scene.camera
+    if camera == None:
+        return None
+
+    sprites = [sprite for sprite in sprites if sprite.type == "MESH"]
+    deform_bones = {sprite.name: get_deform_bones(sprite, armature) for sprite in sprites}
+    densities = {sprite.name: 0.0 for sprite in sprites}
+
+    def sample():
+        for sprite in sprites:
+            bones = deform_bones[sprite.name]
+            bone_scale = max(get_bone_deform_scale(pbone) for pbone in bones) if len(bones) > 0 else 1.0
+            density = get_camera_pixel_density(scene, camera, sprite.matrix_world.to_translation())
+            density *= get_matrix_scale_2d(sprite.matrix_world) * bone_scale
+            densities[sprite.name] = max(densities[sprite.name], density)
+
+    frame_current = scene.frame_current
+    anim_index = sprite_object.coa_anim_collections_index
+    sample()
+    for i, anim in enumerate(sprite_object.coa_anim_collections):
+        if anim.name not in ["NO ACTION"]:
+            sprite_object.coa_anim_collections_index = i ### set animation
+            for frame in range(anim.frame_end+1):
+                scene.frame_set(frame)
+                sample()
+    sprite_object.coa_anim_collections_index = anim_index
+    scene.frame_set(frame_current)
+    return densities
+
+
+def get_texture_density(obj):
+    ### returns the texture pixels per local blender unit of a mesh. The smaller density of both axes is used, so the
+    ### planned scale is large enough for both
+    texture_data = TextureAtlasGenerator.get_texture_bounds(obj, 1.0)
+    if texture_data == None or len(obj.data.vertices) == 0:
+        return None
+    coords = get_vertex_coords(obj.data.vertices, len(obj.data.vertices))
+    extent = coords.max(axis=0) - coords.min(axis=0)
+    src_width = texture_data.bounds_src[2] - texture_data.bounds_src[0]
+    src_height = texture_data.bounds_src[3] - texture_data.bounds_src[1]
+    densities = [size / length for size, length in ((src_width, extent[0]), (src_height, extent[2])) if size > 0 and length > 0]
+    return min(densities) if len(densities) > 0 else None
+
+
+def get_max_texture_scales(objects, screen_densities, quality_margin=0.1, min_scale=0.1):
+    ### returns the scale each object's texture is needed at, by object name. screen_densities are keyed by object name.
+    ### quality_margin adds resolution on top of the visible size, scales are kept between min_scale and 1.0
+    max_scales = {}
+    for obj in objects:
+        screen_density = screen_densities.get(obj.name)
+        texture_density = get_texture_density(obj)
+        if screen_density == None or texture_density == None:
+            continue
+        max_scales[obj.name] = min(max(screen_density / texture_density * (1.0 + quality_margin), min_scale), 1.0)
+    return max_scales
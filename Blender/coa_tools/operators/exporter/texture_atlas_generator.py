@@ -1,24 +1,33 @@
 import bpy
 from mathutils import Vector
-from mathutils.geometry import intersect_line_line_2d
 import math
+import numpy as np
+from . atlas_packer import search_pack_scale
+from . export_helper import get_data_hash
 
 
 class TextureData:
-    def __init__(self, img_name, texture_object, bounds_px, bounds_rel, width, height):
+    def __init__(self, img_name, texture_object, bounds_px, bounds_rel, width, height, bounds_src=None, max_scale=None,
+                 scale=1.0):
         self.img_name = img_name
         self.texture_object = texture_object
+        self.object_name = texture_object.name if texture_object != None else None
         self.bounds_px = bounds_px
         self.bounds_rel = bounds_rel
         self.width = width
         self.height = height
+        self.bounds_src = bounds_src if bounds_src != None else bounds_px
+        self.max_scale = max_scale ### largest scale the texture is needed at. None if it is not limited
+        self.scale = scale
 
 
 class TextureSlot:
-    def __init__(self, x, y, texture_data):
+    def __init__(self, x, y, texture_data, shared=False, rotated=False):
         self.x = x
         self.y = y
         self.texture_data = texture_data
+        self.shared = shared
+        self.rotated = rotated
 
 
 class TextureAtlas:
@@ -31,19 +40,10 @@ class TextureAtlas:
         self.margin = margin
         self.square = square
         self.texture_slots = []
-        self.create_new_slot(self.margin, self.margin)
         self.output_scale = output_scale
-
-    def create_new_slot(self, x, y):
-        texture_slot = TextureSlot(x, y, None)
-        self.texture_slots.append(texture_slot)
-        self.texture_slots = sorted(self.texture_slots, key=lambda slot: slot.x, reverse=True)
-        self.texture_slots = sorted(self.texture_slots, key=lambda slot: slot.y, reverse=False)
-        return texture_slot
-
-    def cleanup_slots(self):
-        del self.texture_slots[:]
-        self.create_new_slot(self.margin, self.margin)
+        self.occupancy = 0.0
+        self.restarts = 0
+        self.pixels = None
 
 
 class TextureAtlasGenerator:
@@ -75,193 +75,342 @@ class TextureAtlasGenerator:
                 top_right_y = max(top_right_y, uv.uv[1])
 
             bounds_rel = [bottom_left_x, bottom_left_y, top_right_x, top_right_y]
-            bounds_px = [img_size[0] * bottom_left_x, img_size[1] * bottom_left_y, img_size[0] * top_right_x,
-                         img_size[1] * top_right_y]
-
-            for i, value in enumerate(bounds_px):
-                bounds_px[i] = int(bounds_px[i] * output_scale)
-            width = abs((bounds_px[2] - bounds_px[0]))
-            height = abs((bounds_px[3] - bounds_px[1]))
-            texture_data = TextureData(texture.image.name, obj, bounds_px, bounds_rel, width, height)
-            return texture_data
+            bounds_src = [img_size[0] * bottom_left_x, img_size[1] * bottom_left_y, img_size[0] * top_right_x,
+                          img_size[1] * top_right_y]
+            texture_data = TextureData(texture.image.name, obj, bounds_src, bounds_rel, 0, 0, bounds_src)
+            return TextureAtlasGenerator.scale_texture_data(texture_data, output_scale)
         return None
 
     @staticmethod
-    def get_sorted_texture_data(objs, output_scale):
+    def scale_texture_data(texture_data, output_scale):
+        ### returns a copy of the texture data with pixel bounds of the given scale. Works without reading the uvs again.
+        ### Textures with a max scale are never scaled above it
+        if texture_data.max_scale != None:
+            output_scale = min(output_scale, texture_data.max_scale)
+        bounds_px = [int(value * output_scale) for value in texture_data.bounds_src]
+        width = abs((bounds_px[2] - bounds_px[0]))
+        height = abs((bounds_px[3] - bounds_px[1]))
+        return TextureData(texture_data.img_name, texture_data.texture_object, bounds_px, texture_data.bounds_rel,
+                           width, height, texture_data.bounds_src, texture_data.max_scale, output_scale)
+
+    @staticmethod
+    def get_sorted_texture_data(objs, output_scale, max_scales=None):
+        ### max_scales optionally limits the scale of single textures by object name
         texture_data_list = []
         for obj in objs:
             if obj.type == "MESH":
-                texture_data = TextureAtlasGenerator.get_texture_bounds(obj, output_scale)
+                texture_data = TextureAtlasGenerator.get_texture_bounds(obj, 1.0)
                 if texture_data != None:
-                    texture_data_list.append(texture_data)
+                    if max_scales != None:
+                        texture_data.max_scale = max_scales.get(obj.name)
+                    texture_data_list.append(TextureAtlasGenerator.scale_texture_data(texture_data, output_scale))
         texture_data_list = sorted(texture_data_list,
                                    key=lambda x: x.width * x.height + math.pow(x.width, 1) + math.pow(x.height, 1),
                                    reverse=True)
         return texture_data_list
 
     @staticmethod
-    def texture_intersects_others(texture_data, texture_slot, atlas_data):
-        tex_fits_width = texture_slot.x + (texture_data.width + atlas_data.margin) < atlas_data.width
-        tex_fits_height = texture_slot.y + (texture_data.height + atlas_data.margin) < atlas_data.height
-        if tex_fits_width == False or tex_fits_height == False:
-            return True
-        for slot in atlas_data.texture_slots:
-            if slot.texture_data != None and slot != texture_slot:
-
-                r1 = []
-                r1.append(texture_slot.x)
-                r1.append(texture_slot.y)
-                r1.append(texture_slot.x + texture_data.width)
-                r1.append(texture_slot.y + texture_data.height)
-                r2 = []
-                r2.append(slot.x)
-                r2.append(slot.y)
-                r2.append(slot.x + slot.texture_data.width)
-                r2.append(slot.y + slot.texture_data.height)
-
-                points_a = []
-                points_a.append(Vector((r1[0], r1[1])))
-                points_a.append(Vector((r1[2], r1[1])))
-                points_a.append(Vector((r1[2], r1[3])))
-                points_a.append(Vector((r1[0], r1[3])))
-                lines_a = [[points_a[0], points_a[1]], [points_a[1], points_a[2]], [points_a[2], points_a[3]],
-                           [points_a[3], points_a[0]]]
-
-                points_b = []
-                points_b.append(Vector((r2[0], r2[1])))
-                points_b.append(Vector((r2[2], r2[1])))
-                points_b.append(Vector((r2[2], r2[3])))
-                points_b.append(Vector((r2[0], r2[3])))
-                lines_b = [[points_b[0], points_b[1]], [points_b[1], points_b[2]], [points_b[2], points_b[3]],
-                           [points_b[3], points_b[0]]]
-
-                for line_a in lines_a:
-                    for line_b in lines_b:
-                        i = intersect_line_line_2d(line_a[0], line_a[1], line_b[0], line_b[1])
-                        if i != None:
-                            return True
-
-        return False
+    def create_texture_atlas_data(texture_data_list, atlas_name, width, height, max_width, max_height, margin=0,
+                                  square=True, output_scale=1.0, algorithm="MAXRECTS", scale_precision=0.01):
+        return TextureAtlasGenerator.create_texture_atlas_pages(texture_data_list, atlas_name, width, height, max_width,
+                                                                max_height, margin, square, output_scale, algorithm,
+                                                                scale_precision, multi_page=False)[0]
 
     @staticmethod
-    def create_texture_atlas_data(texture_data_list, atlas_name, width, height, max_width, max_height, margin=0,
-                                  square=True, output_scale=1.0):
-        atlas_data = TextureAtlas(atlas_name, width, height, max_width, max_height, margin, square, output_scale)
-        objects = []
-        for texture_data in texture_data_list:
-            objects.append(texture_data.texture_object)
-
-        restart_generation = True
-        decrease_scale = False
-        while restart_generation == True:
-
-            if restart_generation == True:
-                if decrease_scale:
-                    atlas_data.output_scale *= 0.95
-                    decrease_scale = False
-                texture_data_list = TextureAtlasGenerator.get_sorted_texture_data(objects, atlas_data.output_scale)
-                atlas_data.cleanup_slots()
-                restart_generation = False
-
-            for i, texture_data in enumerate(texture_data_list):
-                if restart_generation:
-                    break
-                for j, texture_slot in enumerate(atlas_data.texture_slots):
-                    if texture_slot.texture_data == None:
-                        tex_intersects_other = TextureAtlasGenerator.texture_intersects_others(texture_data,
-                                                                                               texture_slot, atlas_data)
-                        if tex_intersects_other and j == len(atlas_data.texture_slots) - 1:
-                            if atlas_data.width == atlas_data.height and atlas_data.height < atlas_data.max_height:
-                                atlas_data.height *= 2
-                                if atlas_data.square:
-                                    if atlas_data.width < atlas_data.height:
-                                        atlas_data.width *= 2
-                            elif atlas_data.height > atlas_data.width and atlas_data.width < atlas_data.max_width:
-                                atlas_data.width *= 2
-
-                            if atlas_data.width >= atlas_data.max_width and atlas_data.height >= atlas_data.max_height:
-                                decrease_scale = True
-                                print("Max Atlas size of ", atlas_data.width, "x", atlas_data.height,
-                                      " reached. Decreasing texture size and restarting generation.")
-                            else:
-                                print("Current Atlas size is to small. Increasing to", atlas_data.width, "x", atlas_data.height,
-                                      " and restarting generation.")
-                            restart_generation = True
-
-                        if restart_generation:
-                            break
-                        if not tex_intersects_other:
-                            texture_slot.texture_data = texture_data
-                            x1 = texture_slot.x + texture_data.width
-                            y1 = texture_slot.y
-                            x2 = texture_slot.x
-                            y2 = texture_slot.y + texture_data.height
-                            atlas_data.create_new_slot(x1 + margin, y1)
-                            atlas_data.create_new_slot(x2, y2 + margin)
-                            break
-
-        return atlas_data
+    def create_texture_atlas_pages(texture_data_list, atlas_name, width, height, max_width, max_height, margin=0,
+                                   square=True, output_scale=1.0, algorithm="MAXRECTS", scale_precision=0.01,
+                                   multi_page=False, allow_rotation=False):
+        ### returns a list of atlas pages. Without multi_page all textures are scaled down until they fit into one page
+        ### texture bounds are read once and only scaled for every packing pass
+        def get_sizes(scale):
+            scaled_data_list = [TextureAtlasGenerator.scale_texture_data(texture_data, scale)
+                                for texture_data in texture_data_list]
+            return [(texture_data.width, texture_data.height) for texture_data in scaled_data_list]
+
+        results, scale, restarts = search_pack_scale(get_sizes, output_scale, width, height, max_width, max_height,
+                                                     margin, square, algorithm, scale_precision, multi_page,
+                                                     allow_rotation)
+        if scale != output_scale:
+            print("Max Atlas size of ", max_width, "x", max_height, " reached. Decreased texture size to",
+                  str(round(scale * 100, 1)) + "% after", restarts, "packing passes.")
+            output_scale = scale
+        packed_data_list = [TextureAtlasGenerator.scale_texture_data(texture_data, output_scale)
+                            for texture_data in texture_data_list]
+
+        atlas_pages = []
+        for i, result in enumerate(results):
+            page_name = atlas_name if i == 0 else atlas_name + "_" + str(i)
+            atlas_data = TextureAtlas(page_name, result.width, result.height, max_width, max_height, margin, square,
+                                      output_scale)
+            atlas_data.occupancy = result.occupancy
+            atlas_data.restarts = restarts
+            for index, position, rotated in zip(result.indices, result.positions, result.rotated):
+                atlas_data.texture_slots.append(TextureSlot(position[0], position[1], packed_data_list[index],
+                                                            rotated=rotated))
+            atlas_pages.append(atlas_data)
+            print("Atlas", page_name, "packed with", algorithm, "into", atlas_data.width, "x", atlas_data.height,
+                  "with", str(round(atlas_data.occupancy * 100, 1)) + "% occupancy.")
+        return atlas_pages
 
     @staticmethod
-    def generate_uv_layout(name="texture_atlas", objects=None, width=256, height=256, max_width=2048, max_height=2048,
-                           margin=1, texture_bleed=0, square=True, output_scale=1.0):
-        context = bpy.context
+    def get_image_pixels(image, image_pixels):
+        ### reads all pixels of an image at once as (height, width, 4) array. image_pixels caches images used by several sprites.
+        ### grayscale and rgb images are expanded to rgba
+        if image.name not in image_pixels:
+            width, height = image.size
+            channels = image.channels
+            pixels = np.array(image.pixels[:], dtype=np.float32)
+            if width == 0 or height == 0 or len(pixels) == 0:
+                raise ValueError("Image " + image.name + " has no pixels. Check that the image file can be loaded.")
+            if channels not in [1, 3, 4] or len(pixels) != width * height * channels:
+                raise ValueError("Image " + image.name + " has an unsupported pixel format with " + str(channels) + " channels.")
+            pixels = pixels.reshape((height, width, channels))
+            if channels == 1:
+                pixels = np.repeat(pixels, 3, axis=2)
+            if pixels.shape[2] == 3:
+                pixels = np.concatenate((pixels, np.ones((height, width, 1), dtype=np.float32)), axis=2)
+            image_pixels[image.name] = pixels
+        return image_pixels[image.name]
 
-        ### Extract texture data from given objects. Gives texture width, height and boundaries
-        texture_data_list = TextureAtlasGenerator.get_sorted_texture_data(objects, output_scale)
+    @staticmethod
+    def scale_pixels(pixels, width, height):
+        ### bilinear resampling with premultiplied alpha, so transparent pixels do not darken the edges
+        src_height, src_width = pixels.shape[:2]
+        if src_width == width and src_height == height:
+            return pixels
+        premultiplied = pixels.copy()
+        premultiplied[:, :, :3] *= premultiplied[:, :, 3:]
+
+        def sample_positions(src_size, size):
+            positions = np.clip((np.arange(size) + 0.5) * src_size / float(size) - 0.5, 0, src_size - 1)
+            index_a = np.floor(positions).astype(np.int64)
+            index_b = np.minimum(index_a + 1, src_size - 1)
+            return index_a, index_b, (positions - index_a).astype(np.float32)
+
+        x_a, x_b, x_factor = sample_positions(src_width, width)
+        y_a, y_b, y_factor = sample_positions(src_height, height)
+        x_factor = x_factor[None, :, None]
+        y_factor = y_factor[:, None, None]
+        rows_a = premultiplied[y_a]
+        rows_b = premultiplied[y_b]
+        top = rows_a[:, x_a] * (1 - x_factor) + rows_a[:, x_b] * x_factor
+        bottom = rows_b[:, x_a] * (1 - x_factor) + rows_b[:, x_b] * x_factor
+        scaled = top * (1 - y_factor) + bottom * y_factor
+
+        alpha = scaled[:, :, 3:]
+        scaled[:, :, :3] = np.where(alpha > 0, scaled[:, :, :3] / np.maximum(alpha, 1e-8), 0)
+        return scaled
 
+    @staticmethod
+    def downsample_pixels(pixels, width, height):
+        ### integer factors average whole pixel blocks, all other sizes are resampled bilinear
+        src_height, src_width = pixels.shape[:2]
+        factor_x = src_width // width
+        factor_y = src_height // height
+        if factor_x * width != src_width or factor_y * height != src_height:
+            return TextureAtlasGenerator.scale_pixels(pixels, width, height)
+        premultiplied = pixels.copy()
+        premultiplied[:, :, :3] *= premultiplied[:, :, 3:]
+        scaled = premultiplied.reshape((height, factor_y, width, factor_x, 4)).mean(axis=(1, 3))
+        alpha = scaled[:, :, 3:]
+        scaled[:, :, :3] = np.where(alpha > 0, scaled[:, :, :3] / np.maximum(alpha, 1e-8), 0)
+        return scaled
 
-        ### Generates Atlas data which is later used to create uv data
-        atlas_data = TextureAtlasGenerator.create_texture_atlas_data(texture_data_list, name, width, height, max_width,
-                                                                     max_height, margin, square, output_scale)
+    @staticmethod
+    def bleed_pixels(pixels, covered, texture_bleed):
+        ### extends the textures by texture_bleed pixels into the uncovered atlas area, one pixel ring per step
+        height, width = covered.shape
+        for i in range(texture_bleed):
+            grown = covered.copy()
+            for offset_x, offset_y in ((1, 0), (-1, 0), (0, 1), (0, -1)):
+                dst_x = slice(max(offset_x, 0), width + min(offset_x, 0))
+                dst_y = slice(max(offset_y, 0), height + min(offset_y, 0))
+                src_x = slice(max(-offset_x, 0), width + min(-offset_x, 0))
+                src_y = slice(max(-offset_y, 0), height + min(-offset_y, 0))
+                fill = covered[src_y, src_x] & ~grown[dst_y, dst_x]
+                pixels[dst_y, dst_x][fill] = pixels[src_y, src_x][fill]
+                grown[dst_y, dst_x] |= fill
+            if grown.sum() == covered.sum():
+                break
+            covered = grown
+        return pixels
 
-        ### create new object with atlas uv layout
+    @staticmethod
+    def get_source_pixels(texture_data, image_pixels):
+        ### returns the unscaled pixel region of the source image a texture uses
+        image = bpy.data.images[texture_data.img_name]
+        src_pixels = TextureAtlasGenerator.get_image_pixels(image, image_pixels)
+        src_height, src_width = src_pixels.shape[:2]
+        src_x0 = min(max(int(texture_data.bounds_src[0]), 0), src_width)
+        src_y0 = min(max(int(texture_data.bounds_src[1]), 0), src_height)
+        src_x1 = min(max(src_x0 + 1, int(texture_data.bounds_src[2])), src_width)
+        src_y1 = min(max(src_y0 + 1, int(texture_data.bounds_src[3])), src_height)
+        if src_x0 == src_x1 or src_y0 == src_y1:
+            raise ValueError("The uvs of a sprite lie outside of image " + image.name + ".")
+        return src_pixels[src_y0:src_y1, src_x0:src_x1]
+
+    @staticmethod
+    def get_unique_texture_data(texture_data_list, image_pixels):
+        ### splits textures by the hash of their source pixels. Returns the unique textures and the duplicates of each
+        ### unique texture by its object name
+        unique_data_list = []
+        duplicates = {}
+        unique_data = {}
+        for texture_data in texture_data_list:
+            src_pixels = TextureAtlasGenerator.get_source_pixels(texture_data, image_pixels)
+            key = get_data_hash(src_pixels)
+            if key in unique_data:
+                ### the shared rectangle has to be large enough for the duplicate that is needed at the highest scale
+                unique = unique_data[key]
+                if unique.max_scale != None:
+                    unique.max_scale = None if texture_data.max_scale == None else max(unique.max_scale, texture_data.max_scale)
+                duplicates[unique.object_name].append(texture_data)
+            else:
+                unique_data_list.append(texture_data)
+                duplicates[texture_data.object_name] = []
+                unique_data[key] = texture_data
+        return unique_data_list, duplicates
+
+    @staticmethod
+    def composite_atlas_pixels(atlas_data, texture_bleed=0, image_pixels=None):
+        ### builds the atlas pixels from the packed slots. Rows are stored bottom up, like blender image pixels
+        pixels = np.zeros((atlas_data.height, atlas_data.width, 4), dtype=np.float32)
+        covered = np.zeros((atlas_data.height, atlas_data.width), dtype=bool)
+        image_pixels = image_pixels if image_pixels != None else {}
         for slot in atlas_data.texture_slots:
-            if slot.texture_data != None:
+            texture_data = slot.texture_data
+            if slot.shared or texture_data == None or texture_data.width == 0 or texture_data.height == 0:
+                continue
+            src_pixels = TextureAtlasGenerator.get_source_pixels(texture_data, image_pixels)
+            tex_pixels = TextureAtlasGenerator.scale_pixels(src_pixels, texture_data.width, texture_data.height)
+            if slot.rotated:
+                ### rotate 90 degrees clockwise
+                tex_pixels = tex_pixels[:, ::-1].transpose((1, 0, 2))
+
+            ### uvs are flipped vertically in the atlas, so the slot y is measured from the top
+            height, width = tex_pixels.shape[:2]
+            x = slot.x
+            y = atlas_data.height - slot.y - height
+            pixels[y:y + height, x:x + width] = tex_pixels
+            covered[y:y + height, x:x + width] = True
+        if texture_bleed > 0:
+            TextureAtlasGenerator.bleed_pixels(pixels, covered, texture_bleed)
+        return pixels
 
-                obj = slot.texture_data.texture_object
-                uv_map = obj.data.uv_textures.new(name="COA_UV_ATLAS")
-                uv_layer = obj.data.uv_layers["COA_UV_ATLAS"]
+    @staticmethod
+    def generate_uv_layout(name="texture_atlas", objects=None, width=256, height=256, max_width=2048, max_height=2048,
+                           margin=1, texture_bleed=0, square=True, output_scale=1.0, algorithm="MAXRECTS",
+                           scale_precision=0.01, deduplicate=True, allow_rotation=False, max_scales=None):
+        atlas_imgs, merged_uv_obj, atlas_pages = TextureAtlasGenerator.generate_uv_layout_pages(
+            name, objects, width, height, max_width, max_height, margin, texture_bleed, square, output_scale, algorithm,
+            scale_precision, multi_page=False, deduplicate=deduplicate, allow_rotation=allow_rotation,
+            max_scales=max_scales)
+        return atlas_imgs[0], merged_uv_obj, atlas_pages[0]
 
-                uv_old_width = slot.texture_data.bounds_rel[2] - slot.texture_data.bounds_rel[0]
-                uv_old_height = slot.texture_data.bounds_rel[3] - slot.texture_data.bounds_rel[1]
-                uv_old_pos = Vector((slot.texture_data.bounds_rel[0], slot.texture_data.bounds_rel[1]))
+    @staticmethod
+    def generate_uv_layout_pages(name="texture_atlas", objects=None, width=256, height=256, max_width=2048,
+                                 max_height=2048, margin=1, texture_bleed=0, square=True, output_scale=1.0,
+                                 algorithm="MAXRECTS", scale_precision=0.01, multi_page=True, deduplicate=True,
+                                 allow_rotation=False, max_scales=None):
+        ### like generate_uv_layout, but textures can be spread over several atlas pages. The uvs of each texture
+        ### are relative to its own page. Returns a list of atlas images and a list of atlas pages
+        context = bpy.context
 
-                uv_new_width = slot.texture_data.width / atlas_data.width
-                uv_new_height = slot.texture_data.height / atlas_data.height
-                uv_new_pos = Vector((slot.x / atlas_data.width, slot.y / atlas_data.height))
+        ### Extract texture data from given objects. Gives texture width, height and boundaries
+        texture_data_list = TextureAtlasGenerator.get_sorted_texture_data(objects, output_scale, max_scales)
 
-                scale_x = uv_new_width / uv_old_width
-                scale_y = uv_new_height / uv_old_height
 
-                uv_flip_y = (1.0 - uv_new_height) - 2 * (uv_new_pos.y)
+        ### textures with identical source pixels are packed once and share their atlas rectangle
+        image_pixels = {}
+        duplicates = {}
+        if deduplicate:
+            texture_data_count = len(texture_data_list)
+            texture_data_list, duplicates = TextureAtlasGenerator.get_unique_texture_data(texture_data_list, image_pixels)
+            if len(texture_data_list) < texture_data_count:
+                print("Packing", len(texture_data_list), "unique of", texture_data_count, "textures.")
 
-                for uv_data in uv_layer.data:
-                    uv = uv_data.uv
-                    uv -= uv_old_pos
-                    uv[0] *= scale_x
-                    uv[1] *= scale_y
-                    uv += uv_new_pos
-                    uv_data.uv += Vector((0, uv_flip_y))
+        ### Generates Atlas data which is later used to create uv data
+        atlas_pages = TextureAtlasGenerator.create_texture_atlas_pages(texture_data_list, name, width, height,
+                                                                       max_width, max_height, margin, square,
+                                                                       output_scale, algorithm, scale_precision,
+                                                                       multi_page, allow_rotation)
+        for atlas_data in atlas_pages:
+            for slot in list(atlas_data.texture_slots):
+                for texture_data in duplicates.get(slot.texture_data.object_name, []):
+                    texture_data = TextureAtlasGenerator.scale_texture_data(texture_data, atlas_data.output_scale)
+                    texture_data.width = slot.texture_data.width
+                    texture_data.height = slot.texture_data.height
+                    texture_data.scale = slot.texture_data.scale
+                    atlas_data.texture_slots.append(TextureSlot(slot.x, slot.y, texture_data, shared=True,
+                                                                rotated=slot.rotated))
 
-        if len(context.selected_objects) > 1:
-            bpy.ops.object.join()
-        merged_uv_obj = context.active_object
+        ### create new object with atlas uv layout
+        for atlas_data in atlas_pages:
+            for slot in atlas_data.texture_slots:
+                if slot.texture_data != None:
+
+                    obj = slot.texture_data.texture_object
+                    obj.data.uv_textures.new(name="COA_UV_ATLAS")
+                    uv_layer = obj.data.uv_layers["COA_UV_ATLAS"]
+
+                    uv_old_width = slot.texture_data.bounds_rel[2] - slot.texture_data.bounds_rel[0]
+                    uv_old_height = slot.texture_data.bounds_rel[3] - slot.texture_data.bounds_rel[1]
+                    uv_old_pos = Vector((slot.texture_data.bounds_rel[0], slot.texture_data.bounds_rel[1]))
+
+                    uv_new_width = slot.texture_data.width / atlas_data.width
+                    uv_new_height = slot.texture_data.height / atlas_data.height
+                    uv_new_pos = Vector((slot.x / atlas_data.width, slot.y / atlas_data.height))
+
+                    scale_x = uv_new_width / uv_old_width
+                    scale_y = uv_new_height / uv_old_height
+
+                    uv_flip_y = (1.0 - uv_new_height) - 2 * (uv_new_pos.y)
+
+                    if slot.rotated:
+                        ### the texture is rotated 90 degrees clockwise and covers height x width pixels in the atlas
+                        page_x = slot.x / atlas_data.width
+                        page_y = 1.0 - (slot.y + slot.texture_data.width) / atlas_data.height
+                        rotated_width = slot.texture_data.height / atlas_data.width
+                        rotated_height = slot.texture_data.width / atlas_data.height
+                        for uv_data in uv_layer.data:
+                            u = (uv_data.uv[0] - uv_old_pos.x) / uv_old_width
+                            v = (uv_data.uv[1] - uv_old_pos.y) / uv_old_height
+                            uv_data.uv = Vector((page_x + v * rotated_width, page_y + (1.0 - u) * rotated_height))
+                        continue
+
+                    for uv_data in uv_layer.data:
+                        uv = uv_data.uv
+                        uv -= uv_old_pos
+                        uv[0] *= scale_x
+                        uv[1] *= scale_y
+                        uv += uv_new_pos
+                        uv_data.uv += Vector((0, uv_flip_y))
+
+        ### join all objects into the active one. The override keeps this independent of a ui context
+        if len(objects) > 1:
+            override = context.copy()
+            override["scene"] = context.scene
+            override["active_object"] = context.scene.objects.active
+            override["object"] = context.scene.objects.active
+            override["selected_objects"] = objects
+            override["selected_editable_objects"] = objects
+            bpy.ops.object.join(override)
+        merged_uv_obj = context.scene.objects.active
         merged_uv_obj.data.uv_textures.active = merged_uv_obj.data.uv_textures["COA_UV_ATLAS"]
-        atlas_img = bpy.data.images.new(atlas_data.name, atlas_data.width, atlas_data.height, alpha=True)
+        atlas_imgs = []
+        for atlas_data in atlas_pages:
+            atlas_imgs.append(bpy.data.images.new(atlas_data.name, atlas_data.width, atlas_data.height, alpha=True))
         for vert in merged_uv_obj.data.vertices:
             vert.select = True
             vert.hide = False
         for uv_data in merged_uv_obj.data.uv_textures["COA_UV_ATLAS"].data:
-            uv_data.image = atlas_img
-
-        ### bake uv atlas
-        context.scene.render.bake_type = "TEXTURE"
-        context.scene.render.use_bake_selected_to_active = False
-        context.scene.render.use_bake_clear = True
-        context.scene.render.bake_margin = texture_bleed
-        bpy.ops.object.bake_image()
-        return atlas_img, merged_uv_obj, atlas_data
+            uv_data.image = atlas_imgs[0]
+
+        ### copy the texture pixels into the atlas images
+        for atlas_data, atlas_img in zip(atlas_pages, atlas_imgs):
+            atlas_data.pixels = TextureAtlasGenerator.composite_atlas_pixels(atlas_data, texture_bleed, image_pixels)
+            atlas_img.pixels[:] = atlas_data.pixels.ravel().tolist()
+        return atlas_imgs, merged_uv_obj, atlas_pages
 
 
 # TextureAtlasGenerator.generate_uv_layout(name="texture_atlas", objects=bpy.context.selected_objects, width=256,height=256, max_width=1024, max_height=1024, margin=1, texture_bleed=0,square=True, output_scale=1.0)
\ No newline at end of file
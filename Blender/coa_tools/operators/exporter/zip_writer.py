@@ -0,0 +1,143 @@
+'''
+Streaming zip writer. Entries are deflated while they are written, so large exports never have to exist as a whole in
+memory or as a temporary file. zipfile can only stream into an entry and choose the deflate level since python 3.6 and
+3.7, blender 2.79 ships python 3.5.
+
+Every entry stores its crc and sizes in a data descriptor behind the compressed data, as the sizes are not known when
+the local header is written. If an exception leaves the with block of a ZipStreamWriter, the unfinished file is deleted
+instead of being completed with truncated entries.
+'''
+
+import os
+import time
+import zlib
+import struct
+
+LOCAL_HEADER = 0x04034b50
+DATA_DESCRIPTOR = 0x08074b50
+CENTRAL_HEADER = 0x02014b50
+END_OF_CENTRAL_DIRECTORY = 0x06054b50
+
+ZIP_VERSION = 20
+FLAG_DATA_DESCRIPTOR = 0x08
+FLAG_UTF8 = 0x800
+METHOD_DEFLATED = 8
+BUFFER_SIZE = 1 << 16
+
+
+def get_dos_time(timestamp):
+    t = time.localtime(timestamp)
+    dos_time = (t.tm_hour << 11) | (t.tm_min << 5) | (t.tm_sec // 2)
+    dos_date = ((max(t.tm_year, 1980) - 1980) << 9) | (t.tm_mon << 5) | t.tm_mday
+    return dos_time, dos_date
+
+
+class ZipEntryWriter:
+    ### file like object of a single zip entry. Text is encoded as utf-8
+    def __init__(self, zip_writer, name, level):
+        self.zip_writer = zip_writer
+        self.name = name.encode("utf-8")
+        self.flags = FLAG_DATA_DESCRIPTOR | FLAG_UTF8
+        self.dos_time, self.dos_date = get_dos_time(time.time())
+        self.offset = zip_writer.file.tell()
+        self.compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+        self.crc = 0
+        self.size = 0
+        self.compressed_size = 0
+        self.buffer = []
+        self.buffer_size = 0
+        self.closed = False
+        zip_writer.file.write(struct.pack("<IHHHHHIIIHH", LOCAL_HEADER, ZIP_VERSION, self.flags, METHOD_DEFLATED,
+                                          self.dos_time, self.dos_date, 0, 0, 0, len(self.name), 0) + self.name)
+
+    def write(self, data):
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        self.buffer.append(data)
+        self.buffer_size += len(data)
+        if self.buffer_size >= BUFFER_SIZE:
+            self.flush()
+
+    def flush(self):
+        ### small writes are collected, so zlib and crc32 run on larger blocks
+        if self.buffer_size > 0:
+            data = b"".join(self.buffer)
+            self.buffer = []
+            self.buffer_size = 0
+            self.crc = zlib.crc32(data, self.crc)
+            self.size += len(data)
+            self.write_compressed(self.compressor.compress(data))
+
+    def write_compressed(self, data):
+        self.compressed_size += len(data)
+        self.zip_writer.file.write(data)
+
+    def close(self):
+        if self.closed:
+            return
+        self.flush()
+        self.write_compressed(self.compressor.flush())
+        self.closed = True
+        if self.size > 0xffffffff or self.compressed_size > 0xffffffff:
+            raise ValueError("Zip entry " + self.name.decode("utf-8") + " is larger than 4 GB.")
+        self.zip_writer.file.write(struct.pack("<IIII", DATA_DESCRIPTOR, self.crc & 0xffffffff, self.compressed_size,
+                                               self.size))
+        self.zip_writer.entries.append(self)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type == None:
+            self.close()
+
+
+class ZipStreamWriter:
+    ### writes a zip file entry by entry. Only one entry can be open at a time. level is the zlib deflate level 0-9
+    def __init__(self, path, level=6):
+        self.path = path
+        self.file = open(path, "wb")
+        self.level = level
+        self.entries = []
+        self.entry = None
+
+    def open(self, name):
+        if self.entry != None:
+            self.entry.close()
+        self.entry = ZipEntryWriter(self, name, self.level)
+        return self.entry
+
+    def close(self):
+        if self.file == None:
+            return
+        if self.entry != None:
+            self.entry.close()
+            self.entry = None
+        central_directory_offset = self.file.tell()
+        for entry in self.entries:
+            self.file.write(struct.pack("<IHHHHHHIIIHHHHHII", CENTRAL_HEADER, ZIP_VERSION, ZIP_VERSION, entry.flags,
+                                        METHOD_DEFLATED, entry.dos_time, entry.dos_date, entry.crc & 0xffffffff,
+                                        entry.compressed_size, entry.size, len(entry.name), 0, 0, 0, 0, 0,
+                                        entry.offset) + entry.name)
+        central_directory_size = self.file.tell() - central_directory_offset
+        self.file.write(struct.pack("<IHHHHIIH", END_OF_CENTRAL_DIRECTORY, 0, 0, len(self.entries), len(self.entries),
+                                    central_directory_size, central_directory_offset, 0))
+        self.file.close()
+        self.file = None
+
+    def abort(self):
+        ### closes the file without writing the central directory and deletes it
+        if self.file == None:
+            return
+        self.file.close()
+        self.file = None
+        os.remove(self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type == None:
+            self.close()
+        else:
+            self.abort()